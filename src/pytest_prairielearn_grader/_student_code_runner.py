@@ -1,40 +1,88 @@
+import argparse
 import asyncio
 import concurrent.futures
+import cProfile
+import ctypes
+import errno
+import gc
 import io
 import json
 import linecache
 import os
+import pstats
+import signal
+import socket
+import statistics
 import sys
+import threading
+import time
 import traceback
+import tracemalloc
 import types
 from collections.abc import Callable
+from collections.abc import Iterator
 from collections.abc import Mapping
 from collections.abc import Sequence
+from contextlib import contextmanager
 from contextlib import redirect_stderr
 from contextlib import redirect_stdout
+from contextlib import suppress
 from copy import deepcopy
 from typing import Any
+from typing import Literal
+from typing import cast
 
+if sys.platform != "win32":
+    import resource
+
+from pytest_prairielearn_grader.code_cache import load_compiled_code
 from pytest_prairielearn_grader.json_utils import from_server_json
 
 # TODO make it so that other files in this package cannot import from this one
 # ask Gemini how to do it
 from pytest_prairielearn_grader.json_utils import to_json
+from pytest_prairielearn_grader.shared_params import open_shared_array
+from pytest_prairielearn_grader.shared_params import open_shared_params
+from pytest_prairielearn_grader.utils import DEFAULT_OUTPUT_LIMIT
+from pytest_prairielearn_grader.utils import FRAME_HEADER
+from pytest_prairielearn_grader.utils import AllocationSite
+from pytest_prairielearn_grader.utils import BenchmarkOptions
+from pytest_prairielearn_grader.utils import BenchmarkStats
+from pytest_prairielearn_grader.utils import BoundedOutput
+from pytest_prairielearn_grader.utils import ComparisonOptions
+from pytest_prairielearn_grader.utils import FrameType
 from pytest_prairielearn_grader.utils import FunctionStatusCode
+from pytest_prairielearn_grader.utils import MemoryUsage
 from pytest_prairielearn_grader.utils import NamesForUserInfo
+from pytest_prairielearn_grader.utils import OutputChunkMessage
+from pytest_prairielearn_grader.utils import ProcessReadyMessage
 from pytest_prairielearn_grader.utils import ProcessStartRequest
 from pytest_prairielearn_grader.utils import ProcessStartResponse
 from pytest_prairielearn_grader.utils import ProcessStatusCode
+from pytest_prairielearn_grader.utils import ProfileEntry
 from pytest_prairielearn_grader.utils import QueryStatusCode
+from pytest_prairielearn_grader.utils import ResourceLimits
+from pytest_prairielearn_grader.utils import ResourceUsage
+from pytest_prairielearn_grader.utils import ScalingOptions
 from pytest_prairielearn_grader.utils import SetupQueryRequest
 from pytest_prairielearn_grader.utils import SetupQueryResponse
+from pytest_prairielearn_grader.utils import StudentFunctionMapRequest
 from pytest_prairielearn_grader.utils import StudentFunctionRequest
 from pytest_prairielearn_grader.utils import StudentFunctionResponse
 from pytest_prairielearn_grader.utils import StudentQueryRequest
 from pytest_prairielearn_grader.utils import StudentQueryResponse
+from pytest_prairielearn_grader.utils import deserialize_namespace_unsafe
 from pytest_prairielearn_grader.utils import deserialize_object_unsafe
+from pytest_prairielearn_grader.utils import drop_privileges
+from pytest_prairielearn_grader.utils import encode_json_frame
 from pytest_prairielearn_grader.utils import get_builtins
+from pytest_prairielearn_grader.utils import resource_usage_from_rusage
+from pytest_prairielearn_grader.utils import serialize_namespace_unsafe
 from pytest_prairielearn_grader.utils import serialize_object_unsafe
+from pytest_prairielearn_grader.utils import set_resource_limits
+
+# Setup code variables and student code variables of an initialized runner
+InitializedVars = tuple[dict[str, Any], dict[str, Any]]
 
 ImportFunction = Callable[[str, Mapping[str, object] | None, Mapping[str, object] | None, Sequence[str], int], types.ModuleType]
 
@@ -46,6 +94,258 @@ HOST = "127.0.0.1"  # Loopback address, means "this computer only"
 # The number of workers should ideally be around the number of CPU cores.
 executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
+# Student code runs in this process and can replace functions in the modules it shares with
+# the runner (e.g. `time.perf_counter`), so the functions used to time its calls are bound here,
+# before any student code runs
+perf_counter = time.perf_counter
+gc_collect, gc_disable, gc_enable, gc_isenabled = gc.collect, gc.disable, gc.enable, gc.isenabled
+fmean, median, stdev = statistics.fmean, statistics.median, statistics.stdev
+
+# How long a timed out call gets to stop after it has been interrupted. This has to stay below
+# the grader's response grace period, so the grader gets the timeout response in time.
+INTERRUPT_GRACE_PERIOD = 0.25
+
+# How many characters of stdout and stderr are kept for each response. Set by the start request.
+output_limit: int | None = DEFAULT_OUTPUT_LIMIT
+# Name the student code is compiled under, so profiles can be limited to it. Set by the start request.
+student_code_file_name: str | None = None
+# The student code is compiled with the leading code before it and the trailing code after it.
+# These place the student's file within it, so lines can be reported as lines of that file.
+# Set by the start request.
+student_line_offset = 0
+student_line_count: int | None = None
+
+
+def student_file_line(line: int) -> int | None:
+    """
+    Returns the line of the student's file that a line of the compiled student code comes from,
+    or None if it comes from the leading or trailing code.
+    """
+    file_line = line - student_line_offset
+    if file_line < 1 or (student_line_count is not None and file_line > student_line_count):
+        return None
+
+    return file_line
+
+
+class LineCoverage:
+    """
+    Records which lines of the student code run, using `sys.monitoring` (Python 3.12+). Line
+    events are only turned on for the student code's own code objects, and each line turns
+    its event off the first time it runs, so code that already ran costs nothing, unlike with
+    `sys.settrace`. `take_lines` turns the events back on, so each call gets its own set of lines.
+    """
+
+    lines: set[int]
+
+    def __init__(self) -> None:
+        self.lines = set()
+
+    @classmethod
+    def start(cls, code: types.CodeType) -> "LineCoverage | None":
+        """
+        Starts recording the lines run by `code` and the functions and classes defined in it.
+        Returns None if `sys.monitoring` is not available or its coverage tool ID is taken.
+        """
+        monitoring = getattr(sys, "monitoring", None)
+        if monitoring is None:
+            return None
+
+        try:
+            monitoring.use_tool_id(monitoring.COVERAGE_ID, "pl-autograder")
+        except ValueError:
+            return None
+
+        coverage = cls()
+        monitoring.register_callback(monitoring.COVERAGE_ID, monitoring.events.LINE, coverage._record_line)
+
+        code_objects = [code]
+        while code_objects:
+            code_object = code_objects.pop()
+            monitoring.set_local_events(monitoring.COVERAGE_ID, code_object, monitoring.events.LINE)
+            code_objects.extend(const for const in code_object.co_consts if isinstance(const, types.CodeType))
+
+        return coverage
+
+    def _record_line(self, code: types.CodeType, line: int) -> Any:
+        self.lines.add(line)
+        return sys.monitoring.DISABLE  # type: ignore[attr-defined]
+
+    def take_lines(self) -> list[int]:
+        """
+        Returns the lines of the student's file recorded since the previous call, and starts
+        recording them again.
+        """
+        lines = sorted(file_line for line in self.lines if (file_line := student_file_line(line)) is not None)
+        self.lines.clear()
+        sys.monitoring.restart_events()  # type: ignore[attr-defined]
+
+        return lines
+
+
+# Set by the start request if it asked for line coverage
+line_coverage: LineCoverage | None = None
+
+# Streamed output is sent once this many characters have been written, or when it is flushed
+OUTPUT_CHUNK_SIZE = 8 * 1024
+
+OutputStream = Literal["stdout", "stderr"]
+# Sends a chunk of output for one of the streams to the grader
+OutputSender = Callable[[OutputStream, str], None]
+
+
+# The profiler of the call that is running, if it is profiled (see `profiling`)
+active_profiler: cProfile.Profile | None = None
+
+# The sys.monitoring events cProfile uses on Python 3.12+, with the profiler methods they call
+PROFILER_CALLBACKS = {
+    "PY_START": "_pystart_callback",
+    "PY_RESUME": "_pystart_callback",
+    "PY_THROW": "_pystart_callback",
+    "PY_RETURN": "_pyreturn_callback",
+    "PY_YIELD": "_pyreturn_callback",
+    "PY_UNWIND": "_pyreturn_callback",
+    "CALL": "_ccall_callback",
+    "C_RETURN": "_creturn_callback",
+    "C_RAISE": "_creturn_callback",
+}
+
+
+class CallInterrupted(BaseException):
+    """
+    Raised inside a student function call that timed out. Derives from BaseException so
+    that `except Exception` blocks in student code don't swallow it.
+    """
+
+    def __init__(self, *args: object) -> None:
+        # The exception is created in the interrupted thread before the student's frames unwind.
+        # Stopping the profiler here times the frames that are still running up to this point,
+        # which cProfile on Python 3.12+ doesn't do for frames that end by unwinding.
+        if active_profiler is not None:
+            active_profiler.disable()
+        super().__init__(*args)
+
+
+class InterruptibleCall:
+    """
+    A student function call that can be interrupted from another thread, by asynchronously
+    raising `CallInterrupted` in the thread running it. The exception is raised the next time
+    that thread runs Python bytecode, so a call that is blocked in C code (e.g. in `time.sleep`)
+    is not stopped until it returns from there.
+
+    The interrupt can only be raised while the call is running, so it never escapes into the
+    executor's own code, which would kill its worker thread.
+    """
+
+    function: Callable[[], Any]
+    _lock: threading.Lock
+    _thread_id: int | None
+    _interrupted: bool
+
+    def __init__(self, function: Callable[[], Any]) -> None:
+        self.function = function
+        self._lock = threading.Lock()
+        self._thread_id = None
+        self._interrupted = False
+
+    def __call__(self) -> Any:
+        with self._lock:
+            self._thread_id = threading.get_ident()
+
+        try:
+            return self.function()
+        finally:
+            with self._lock:
+                if self._interrupted:
+                    # Clear the interrupt if it is still pending because the call finished first
+                    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self._thread_id), None)
+                self._thread_id = None
+
+    def interrupt(self) -> bool:
+        """
+        Interrupts the call if it is still running. Returns whether it was interrupted.
+        """
+        with self._lock:
+            if self._thread_id is None or self._interrupted:
+                return False
+
+            thread_id = ctypes.c_ulong(self._thread_id)
+            self._interrupted = ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, ctypes.py_object(CallInterrupted)) == 1
+            return self._interrupted
+
+
+class StreamedOutput(io.TextIOBase):
+    """
+    A text stream that sends what is written to it to the grader in chunks, instead of
+    keeping it. Nothing is left to return in the response, so `getvalue` sends whatever
+    is still buffered and returns an empty string.
+    """
+
+    stream: OutputStream
+    send_output: OutputSender
+    _buffer: list[str]
+    _buffer_size: int
+
+    def __init__(self, stream: OutputStream, send_output: OutputSender) -> None:
+        super().__init__()
+        self.stream = stream
+        self.send_output = send_output
+        self._buffer = []
+        self._buffer_size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+
+        self._buffer.append(text)
+        self._buffer_size += len(text)
+        if self._buffer_size >= OUTPUT_CHUNK_SIZE:
+            self.flush()
+
+        return len(text)
+
+    def flush(self) -> None:
+        if self._buffer_size:
+            data = "".join(self._buffer)
+            self._buffer.clear()
+            self._buffer_size = 0
+            self.send_output(self.stream, data)
+
+    def getvalue(self) -> str:
+        self.flush()
+        return ""
+
+
+def make_output_sender(writer: asyncio.StreamWriter, request_id: int) -> OutputSender:
+    """
+    Returns a function that sends output of the given request to the grader. Student code
+    runs on the executor's thread, which waits until each chunk has been handed over to the
+    connection, so output can't pile up in the runner faster than the grader reads it.
+    """
+    loop = asyncio.get_running_loop()
+    loop_thread_id = threading.get_ident()
+
+    async def write_frame(frame: bytes) -> None:
+        writer.write(frame)
+        await writer.drain()
+
+    def send_output(stream: OutputStream, data: str) -> None:
+        message: OutputChunkMessage = {"message_type": "output", "request_id": request_id, "stream": stream, "data": data}
+        frame = encode_json_frame(message)
+
+        if threading.get_ident() == loop_thread_id:
+            writer.write(frame)
+            return
+
+        # If the grader is gone, there is no one left to send the output to
+        with suppress(Exception):
+            asyncio.run_coroutine_threadsafe(write_frame(frame), loop).result()
+
+    return send_output
+
 
 def populate_linecache(contents: str, fname: str) -> None:
     """
@@ -60,23 +360,335 @@ def populate_linecache(contents: str, fname: str) -> None:
     )
 
 
+def timed_call(function: Callable[..., Any], args_tup: Any, kwargs_dict: Any, durations: list[float]) -> Any:
+    """
+    Calls a function with its own copy of the arguments, so a function that modifies them
+    (e.g. sorts a list in place) gets the same input every time, and appends how long the
+    call took to `durations`. Copying the arguments is not timed.
+    """
+    args, kwargs = deepcopy(args_tup), deepcopy(kwargs_dict)
+
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    durations.append(perf_counter() - start)
+
+    return result
+
+
+@contextmanager
+def gc_disabled(disable_gc: bool) -> Iterator[None]:
+    gc_was_enabled = gc_isenabled()
+    if disable_gc:
+        gc_collect()
+        gc_disable()
+
+    try:
+        yield
+    finally:
+        if gc_was_enabled:
+            gc_enable()
+
+
+@contextmanager
+def pinned_to_cpu(cpu: int | None) -> Iterator[None]:
+    """
+    Pins the calling thread to a single CPU, so timed calls are not moved between CPUs.
+    Does nothing if no CPU is given, the platform doesn't support it, or the CPU is not
+    one this process may run on.
+    """
+    if cpu is None or not hasattr(os, "sched_setaffinity") or cpu not in (previous_cpus := os.sched_getaffinity(0)):
+        yield
+        return
+
+    os.sched_setaffinity(0, {cpu})
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous_cpus)
+
+
+def benchmark_student_function(
+    student_function: Callable[..., Any], args_tup: Any, kwargs_dict: Any, options: BenchmarkOptions, durations: list[float]
+) -> Any:
+    """
+    Calls a student function `warmup` times and then `rounds` times while timing each call
+    (see `timed_call`), and returns the result of the last call. The durations are appended
+    to `durations` as they are measured.
+    """
+    for _ in range(options["warmup"]):
+        student_function(*deepcopy(args_tup), **deepcopy(kwargs_dict))
+
+    result = None
+    with gc_disabled(options["disable_gc"]):
+        for _ in range(options["rounds"]):
+            result = timed_call(student_function, args_tup, kwargs_dict, durations)
+
+    return result
+
+
+def compare_student_function(
+    student_function: Callable[..., Any],
+    reference_function: Callable[..., Any],
+    args_tup: Any,
+    kwargs_dict: Any,
+    options: ComparisonOptions,
+    durations: list[float],
+    reference_durations: list[float],
+) -> Any:
+    """
+    Times a student function and a reference function on the same arguments, and returns the
+    result of the last student call. The two are called in turns, alternating which one goes
+    first, so a busy moment on the host slows both down instead of only one of them. Rounds
+    are added in batches until the ratio of the median durations changes by less than
+    `tolerance` from one batch to the next, or `max_rounds` is reached.
+    """
+    for _ in range(options["warmup"]):
+        student_function(*deepcopy(args_tup), **deepcopy(kwargs_dict))
+        reference_function(*deepcopy(args_tup), **deepcopy(kwargs_dict))
+
+    result = None
+    previous_ratio = None
+    with gc_disabled(options["disable_gc"]), pinned_to_cpu(options["cpu"]):
+        while len(durations) < options["max_rounds"]:
+            for _ in range(min(options["rounds"], options["max_rounds"] - len(durations))):
+                if len(durations) % 2 == 0:
+                    result = timed_call(student_function, args_tup, kwargs_dict, durations)
+                    timed_call(reference_function, args_tup, kwargs_dict, reference_durations)
+                else:
+                    timed_call(reference_function, args_tup, kwargs_dict, reference_durations)
+                    result = timed_call(student_function, args_tup, kwargs_dict, durations)
+
+            ratio = median(durations) / max(median(reference_durations), 1e-9)
+            if previous_ratio is not None and abs(ratio - previous_ratio) <= options["tolerance"] * previous_ratio:
+                break
+            previous_ratio = ratio
+
+    return result
+
+
+def measure_student_scaling(
+    student_function: Callable[..., Any], generator: Callable[[int], Any], options: ScalingOptions, scaling_times: list[float]
+) -> None:
+    """
+    Times a student function on an input generated for each size, and appends the fastest of
+    `rounds` calls at each size to `scaling_times`. The generator returns the arguments for a
+    size as a tuple, or a single argument. Inputs are generated here rather than sent by the
+    grader, so large inputs never go through the socket. Results are not kept, as they can be
+    as large as the inputs.
+    """
+    for size in options["sizes"]:
+        args = generator(size)
+        args_tup = args if isinstance(args, tuple) else (args,)
+
+        # An untimed call first, so the first size doesn't pay for warming up
+        student_function(*deepcopy(args_tup))
+
+        durations: list[float] = []
+        with gc_disabled(options["disable_gc"]):
+            for _ in range(options["rounds"]):
+                timed_call(student_function, args_tup, {}, durations)
+
+        scaling_times.append(min(durations))
+
+
+@contextmanager
+def profiling(profiler: cProfile.Profile) -> Iterator[None]:
+    """
+    Profiles the block in the calling thread only. On Python 3.12+, cProfile gets its events
+    from `sys.monitoring`, which reports the calls of every thread, so the event loop waking up
+    to interrupt a call would otherwise be mixed into the call's profile and throw off its times.
+    """
+    global active_profiler
+
+    profiler.enable()
+    monitoring = getattr(sys, "monitoring", None)
+    if monitoring is not None:
+        thread_id = threading.get_ident()
+        for event_name, method_name in PROFILER_CALLBACKS.items():
+            callback = getattr(profiler, method_name)
+            monitoring.register_callback(
+                monitoring.PROFILER_ID,
+                getattr(monitoring.events, event_name),
+                lambda *args, callback=callback: callback(*args) if threading.get_ident() == thread_id else None,
+            )
+
+    active_profiler = profiler
+    try:
+        yield
+    finally:
+        active_profiler = None
+        profiler.disable()
+
+
+def profile_entries(profiler: cProfile.Profile, limit: int) -> list[ProfileEntry]:
+    """
+    Returns up to `limit` of the profiled functions from the student code, by cumulative time.
+    Functions from the setup, leading and trailing code, libraries and builtins are left out, as
+    students can't change them.
+    """
+    profiled_functions = cast(dict[tuple[str, int, str], tuple[int, int, float, float, Any]], pstats.Stats(profiler).stats)  # type: ignore[attr-defined]
+
+    entries: list[ProfileEntry] = [
+        {"function": function, "line": file_line, "calls": calls, "total_time": total_time, "cumulative_time": cumulative_time}
+        for (file_name, line, function), (_, calls, total_time, cumulative_time, _) in profiled_functions.items()
+        if file_name == student_code_file_name and (file_line := student_file_line(line)) is not None
+    ]
+    entries.sort(key=lambda entry: entry["cumulative_time"], reverse=True)
+
+    return entries[:limit]
+
+
+@contextmanager
+def traced_memory(site_limit: int | None, usage: list[MemoryUsage]) -> Iterator[None]:
+    """
+    Traces the memory allocated inside the block with tracemalloc, and appends the peak and net
+    allocated bytes to `usage`, with up to `site_limit` of the lines of the student code holding
+    the most memory at the end. The usage is recorded even if the block raises, e.g. when a call
+    is interrupted. Does nothing if no limit is given.
+    """
+    if site_limit is None:
+        yield
+        return
+
+    # Tracing may already be on, e.g. through PYTHONTRACEMALLOC, in which case it is left on
+    was_tracing = tracemalloc.is_tracing()
+    if was_tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if not was_tracing:
+            tracemalloc.stop()
+
+        sites: list[AllocationSite] = [
+            {"line": file_line, "size": statistic.size, "count": statistic.count}
+            for statistic in snapshot.statistics("lineno")
+            if statistic.traceback[0].filename == student_code_file_name
+            and (file_line := student_file_line(statistic.traceback[0].lineno)) is not None
+        ]
+        usage.append({"peak": max(peak - baseline, 0), "net": current - baseline, "sites": sites[:site_limit]})
+
+
+def benchmark_stats(durations: list[float]) -> BenchmarkStats:
+    return {
+        "rounds": len(durations),
+        "min": min(durations),
+        "max": max(durations),
+        "mean": fmean(durations),
+        "median": median(durations),
+        "stddev": stdev(durations) if len(durations) > 1 else 0.0,
+    }
+
+
 async def student_function_runner(
-    student_code_vars: dict[str, Any], func_name: str, timeout: float, args_tup: Any, kwargs_dict: Any
+    student_code_vars: dict[str, Any],
+    func_name: str,
+    timeout: float,
+    args_tup: Any,
+    kwargs_dict: Any,
+    send_output: OutputSender | None = None,
+    benchmark: BenchmarkOptions | None = None,
+    comparison: ComparisonOptions | None = None,
+    reference_vars: dict[str, Any] | None = None,
+    scaling: ScalingOptions | None = None,
+    profile: int | None = None,
+    memory: int | None = None,
 ) -> StudentFunctionResponse:
-    stdout_capture = io.StringIO()
-    stderr_capture = io.StringIO()
+    # Output is either kept up to the output limit and returned in the response, or streamed
+    stdout_capture: BoundedOutput | StreamedOutput
+    stderr_capture: BoundedOutput | StreamedOutput
+    if send_output is None:
+        stdout_capture = BoundedOutput(output_limit)
+        stderr_capture = BoundedOutput(output_limit)
+    else:
+        stdout_capture = StreamedOutput("stdout", send_output)
+        stderr_capture = StreamedOutput("stderr", send_output)
     execution_error = None
     exception_traceback = None
     result = None
 
-    try:
-
-        def student_function_temp() -> Any:
-            student_function = student_code_vars[func_name]
+    durations: list[float] = []
+    reference_durations: list[float] = []
+    scaling_times: list[float] = []
+    profiler = cProfile.Profile() if profile is not None else None
+    memory_usage: list[MemoryUsage] = []
+    if line_coverage is not None:
+        # Lines that ran outside of function calls don't belong to this call
+        line_coverage.take_lines()
+
+    def student_function_temp() -> Any:
+        student_function = student_code_vars[func_name]
+        if scaling is not None:
+            generator_name = scaling["generator"]
+            if reference_vars is None or not callable(reference_vars.get(generator_name)):
+                raise NameError(f"Input generator '{generator_name}' is not defined by the setup code.")
+
+            return measure_student_scaling(student_function, reference_vars[generator_name], scaling, scaling_times)
+        if comparison is not None:
+            reference_name = comparison["reference"]
+            if reference_vars is None or not callable(reference_vars.get(reference_name)):
+                raise NameError(f"Reference function '{reference_name}' is not defined by the setup code.")
+
+            reference_function = reference_vars[reference_name]
+            return compare_student_function(
+                student_function, reference_function, args_tup, kwargs_dict, comparison, durations, reference_durations
+            )
+        if benchmark is not None:
+            return benchmark_student_function(student_function, args_tup, kwargs_dict, benchmark, durations)
+        with traced_memory(memory, memory_usage):
+            if profiler is not None:
+                with profiling(profiler):
+                    return student_function(*args_tup, **kwargs_dict)
             return student_function(*args_tup, **kwargs_dict)
 
-        with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-            result = await asyncio.wait_for(asyncio.get_event_loop().run_in_executor(executor, student_function_temp), timeout=timeout)
+    call = InterruptibleCall(student_function_temp)
+
+    with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
+        future = asyncio.get_event_loop().run_in_executor(executor, call)
+        # Unlike `asyncio.wait_for`, this tells a timeout apart from a TimeoutError raised by the student code
+        done, _ = await asyncio.wait({future}, timeout=timeout)
+        timed_out = not done
+
+        # Try to stop the call in place, so the student code's state survives the timeout
+        if timed_out and call.interrupt():
+            done, _ = await asyncio.wait({future}, timeout=INTERRUPT_GRACE_PERIOD)
+
+    if timed_out:
+        if done:
+            # Retrieve the CallInterrupted exception, so asyncio doesn't log it as unhandled
+            future.exception()
+
+        # If the call could not be stopped, it keeps running on the executor's only thread and
+        # every later call would queue behind it. The grader replaces this runner in that case.
+        timeout_response: StudentFunctionResponse = {
+            "status": FunctionStatusCode.TIMEOUT,
+            "value": to_json(None),
+            "stdout": stdout_capture.getvalue(),
+            "stderr": stderr_capture.getvalue(),
+            "exception_name": "TimeoutError",
+            "exception_message": f"Call to '{func_name}' did not finish within {timeout} seconds.",
+            "traceback": None,
+            "interrupted": bool(done),
+        }
+        # The profile of an interrupted call shows where the time went. A call that is still
+        # running is still being profiled, so its profile can't be read.
+        if profiler is not None and profile is not None and done:
+            timeout_response["profile"] = profile_entries(profiler, profile)
+        if memory_usage:
+            timeout_response["memory"] = memory_usage[0]
+        if line_coverage is not None and done:
+            timeout_response["covered_lines"] = line_coverage.take_lines()
+
+        return timeout_response
+
+    try:
+        result = future.result()
     except Exception as e:
         execution_error = e
         exception_traceback = traceback.format_exc(limit=-1)
@@ -91,9 +703,37 @@ async def student_function_runner(
         "traceback": exception_traceback,
     }
 
+    if (benchmark is not None or comparison is not None) and execution_error is None:
+        function_response["benchmark"] = benchmark_stats(durations)
+    if comparison is not None and execution_error is None:
+        function_response["reference_benchmark"] = benchmark_stats(reference_durations)
+    if scaling is not None and execution_error is None:
+        function_response["scaling"] = scaling_times
+    if profiler is not None and profile is not None:
+        function_response["profile"] = profile_entries(profiler, profile)
+    if memory_usage:
+        function_response["memory"] = memory_usage[0]
+    if line_coverage is not None:
+        function_response["covered_lines"] = line_coverage.take_lines()
+
     return function_response
 
 
+def skipped_call_response(func_name: str, reason: str) -> StudentFunctionResponse:
+    """
+    Response for a call in a batch that was never started, e.g. because the batch ran out of time.
+    """
+    return {
+        "status": FunctionStatusCode.SKIPPED,
+        "value": to_json(None),
+        "stdout": "",
+        "stderr": "",
+        "exception_name": "TimeoutError",
+        "exception_message": f"Call to '{func_name}' was skipped because {reason}.",
+        "traceback": None,
+    }
+
+
 def get_custom_importer(import_whitelist: list[str] | None, import_blacklist: list[str] | None) -> ImportFunction:
     """
     Returns a custom import function that restricts imports based on the provided whitelist and blacklist.
@@ -135,13 +775,26 @@ async def student_code_runner(
     starting_vars: dict[str, Any] | None,
     builtin_whitelist: list[str] | None,
     names_for_user_list: list[NamesForUserInfo] | None,
+    resource_limits: ResourceLimits | None = None,
+    compiled_setup_code: str | None = None,
+    compiled_student_code: str | None = None,
+    setup_vars: str | None = None,
+    coverage: bool = False,
 ) -> tuple[dict[str, Any], dict[str, Any], ProcessStartResponse]:
-    stdout_capture = io.StringIO()
-    stderr_capture = io.StringIO()
+    global line_coverage
+
+    stdout_capture = BoundedOutput(output_limit)
+    stderr_capture = BoundedOutput(output_limit)
     execution_error: Exception | None = None
     exception_traceback = None
-    local_vars = deepcopy(starting_vars) if starting_vars else {}
+    # The starting variables were just decoded from the start request, so they are ours to modify
+    local_vars = dict(starting_vars) if starting_vars else {}
+    # Large arrays from data.json may be mapped from files shared by all sandboxes
+    shared_arrays = open_shared_params(local_vars)
     local_vars["__from_server_json"] = from_server_json  # Add the deserialization function to the local variables for setup code to use
+    if shared_arrays:
+        # Shared arrays are already decoded, so pass them through as they are
+        local_vars["__from_server_json"] = lambda v_json: v_json if id(v_json) in shared_arrays else from_server_json(v_json)
 
     student_code_vars: dict[str, Any] = {}
     student_code_vars["__builtins__"] = get_builtins(builtin_whitelist)
@@ -149,13 +802,22 @@ async def student_code_runner(
     student_code_vars["__builtins__"]["__name__"] = "__main__"  # Set __name__ to "__main__" to mimic the main module
     student_code_vars["__builtins__"]["__import__"] = get_custom_importer(import_whitelist, import_blacklist)
 
+    # Durations of each phase in seconds, reported back to the grader
+    timings: dict[str, float] = {}
+
     # TODO the data object is not passed into the setup code. Add this if needed.
 
+    phase_start = perf_counter()
     try:
-        # First, execute the setup code if provided
-        if setup_code:
-            # Compile the setup code
-            code_setup = compile(setup_code, "<setup>", "exec")
+        # First, execute the setup code if provided, or load the variables of a shared run of it
+        if setup_vars is not None:
+            local_vars.update(deserialize_namespace_unsafe(setup_vars, student_code_vars))
+        elif setup_code:
+            # Compile the setup code, unless the grader already sent it compiled
+            if compiled_setup_code is not None:
+                code_setup = load_compiled_code(compiled_setup_code)
+            else:
+                code_setup = compile(setup_code, "<setup>", "exec")
             with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
                 await asyncio.wait_for(
                     asyncio.get_event_loop().run_in_executor(executor, exec, code_setup, student_code_vars, local_vars),
@@ -170,26 +832,46 @@ async def student_code_runner(
         execution_error = e
         # TODO need to create a different message for setup code errors. This should result
         # in a different error message reported from the test case.
+    finally:
+        timings["setup_code_exec"] = perf_counter() - phase_start
 
     if names_for_user_list is not None:
         for name_info in names_for_user_list:
             var_name = name_info["name"]
 
             if var_name in local_vars:
-                # NOTE I think there might be issues with security with deepcopying certain
-                # objects. If needed, we can prevent leaks here through serialization.
-                student_code_vars[var_name] = deepcopy(local_vars[var_name])
+                value = local_vars[var_name]
+                if id(value) in shared_arrays:
+                    # A separate copy-on-write mapping keeps writes away from the setup code's array
+                    student_code_vars[var_name] = open_shared_array(shared_arrays[id(value)])
+                else:
+                    # NOTE I think there might be issues with security with deepcopying certain
+                    # objects. If needed, we can prevent leaks here through serialization.
+                    student_code_vars[var_name] = deepcopy(value)
 
     if execution_error is None:
         try:
             # Next, compile student code. Make sure to handle errors in this later
             # TODO have a better filename
-            code_setup = compile(student_code, student_file_name, "exec")
+            phase_start = perf_counter()
+            if compiled_student_code is not None:
+                code_setup = load_compiled_code(compiled_student_code)
+            else:
+                code_setup = compile(student_code, student_file_name, "exec")
+            timings["student_code_compile"] = perf_counter() - phase_start
+
+            if coverage:
+                line_coverage = LineCoverage.start(code_setup)
+
+            phase_start = perf_counter()
             with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-                await asyncio.wait_for(
-                    asyncio.get_event_loop().run_in_executor(executor, exec, code_setup, student_code_vars, student_code_vars),
-                    timeout=timeout,
-                )
+                try:
+                    await asyncio.wait_for(
+                        asyncio.get_event_loop().run_in_executor(executor, exec, code_setup, student_code_vars, student_code_vars),
+                        timeout=timeout,
+                    )
+                finally:
+                    timings["student_code_exec"] = perf_counter() - phase_start
 
         except asyncio.TimeoutError:
             execution_error = asyncio.TimeoutError("Student code execution timed out")
@@ -206,6 +888,8 @@ async def student_code_runner(
         status = ProcessStatusCode.SUCCESS
     elif isinstance(execution_error, asyncio.TimeoutError):
         status = ProcessStatusCode.TIMEOUT
+    elif resource_limits and is_resource_limit_error(execution_error, resource_limits):
+        status = ProcessStatusCode.RESOURCE_LIMIT
     else:
         status = ProcessStatusCode.EXCEPTION
 
@@ -216,15 +900,132 @@ async def student_code_runner(
         "execution_error": type(execution_error).__name__ if execution_error else None,
         "execution_message": str(execution_error) if execution_error else None,
         "execution_traceback": str(exception_traceback),
+        "timings": timings,
     }
+    if line_coverage is not None:
+        result_dict["covered_lines"] = line_coverage.take_lines()
 
     return local_vars, student_code_vars, result_dict
 
 
-async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+def limit_runner_resources(resource_limits: ResourceLimits) -> None:
+    """
+    Applies resource limits to this runner. The executor's worker thread is started first,
+    since threads count towards the process limit.
+    """
+    executor.submit(int).result()
+    set_resource_limits(resource_limits)
+
+
+def is_resource_limit_error(error: Exception, resource_limits: ResourceLimits) -> bool:
+    """
+    Whether an error raised by the setup or student code was caused by one of the resource limits.
+    """
+    if isinstance(error, MemoryError):
+        return "memory_mb" in resource_limits
+
+    if isinstance(error, BlockingIOError) and error.errno == errno.EAGAIN:
+        # Starting a process fails with EAGAIN at the process limit
+        return "processes" in resource_limits
+
+    if isinstance(error, OSError) and error.errno == errno.EFBIG:
+        return "file_size_mb" in resource_limits
+
+    return False
+
+
+async def initialize_student_code(start_json_message: ProcessStartRequest) -> tuple[dict[str, Any], dict[str, Any], ProcessStartResponse]:
+    """
+    Runs the setup and student code described by a start request.
+    """
+    global output_limit, student_code_file_name, student_line_offset, student_line_count
+
+    student_code = start_json_message["student_code"]
+    student_file_name = start_json_message["student_file_name"]
+    setup_code = start_json_message["setup_code"]
+    initialization_timeout = start_json_message["initialization_timeout"]
+    import_whitelist = start_json_message["import_whitelist"]
+    import_blacklist = start_json_message["import_blacklist"]
+    starting_vars = start_json_message["starting_vars"]
+    builtin_whitelist = start_json_message["builtin_whitelist"]
+    names_for_user_list = start_json_message["names_for_user_list"]
+    resource_limits = start_json_message.get("resource_limits")
+    compiled_setup_code = start_json_message.get("compiled_setup_code")
+    compiled_student_code = start_json_message.get("compiled_student_code")
+    setup_vars = start_json_message.get("setup_vars")
+    output_limit = start_json_message.get("output_limit", DEFAULT_OUTPUT_LIMIT)
+    student_code_file_name = student_file_name
+    student_line_offset = start_json_message.get("student_line_offset", 0)
+    student_line_count = start_json_message.get("student_line_count")
+
+    populate_linecache(student_code, student_file_name)
+
+    local_vars, student_code_vars, start_response = await student_code_runner(
+        setup_code=setup_code,
+        student_code=student_code,
+        student_file_name=student_file_name,
+        timeout=initialization_timeout,
+        import_whitelist=import_whitelist,
+        import_blacklist=import_blacklist,
+        starting_vars=starting_vars,
+        builtin_whitelist=builtin_whitelist,
+        names_for_user_list=names_for_user_list,
+        resource_limits=resource_limits,
+        compiled_setup_code=compiled_setup_code,
+        compiled_student_code=compiled_student_code,
+        setup_vars=setup_vars,
+        coverage=start_json_message.get("coverage", False),
+    )
+
+    if start_json_message.get("return_setup_vars") and start_response["status"] == ProcessStatusCode.SUCCESS:
+        start_response["setup_vars"] = serialize_setup_vars(local_vars, student_code_vars)
+
+    return local_vars, student_code_vars, start_response
+
+
+def serialize_setup_vars(local_vars: dict[str, Any], student_code_vars: dict[str, Any]) -> str | None:
+    """
+    Serializes the variables defined by the setup code, so other sandboxes can use them
+    without running it. Functions from the setup code run with the student code's globals,
+    and get those of the sandbox that loads them. Returns None if some variable can't be
+    serialized.
+    """
+    # The runner adds this one itself
+    setup_vars = {name: value for name, value in local_vars.items() if name != "__from_server_json"}
+
+    try:
+        return serialize_namespace_unsafe(setup_vars, student_code_vars)
+    except Exception:
+        return None
+
+
+async def read_stream_frame(reader: asyncio.StreamReader) -> tuple[FrameType, bytes] | None:
+    """
+    Reads a single frame from the grader. Returns None if the grader closed the connection.
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+
+    payload_length, frame_type = FRAME_HEADER.unpack(header)
+    return FrameType(frame_type), await reader.readexactly(payload_length)
+
+
+async def handle_client(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    local_vars: dict[str, Any] | None = None,
+    student_code_vars: dict[str, Any] | None = None,
+) -> None:
     """
     Reads lines from stdin asynchronously and responds on stdout.
     Mimics a simple server handling requests.
+
+    If the student code has already been initialized (e.g. in a runner forked from a
+    snapshot), its variables are passed in and no start message is needed.
     """
     # try:
     #     json_message = json.loads(message)
@@ -247,46 +1048,25 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
     #     await writer.drain()
 
     try:
-        student_code_vars: None | dict = None
-        local_vars: None | dict = None
-
-        async for line_bytes in reader:
-            line = line_bytes.decode().strip()
-            if not line:  # Handle empty lines
-                continue
+        while (frame := await read_stream_frame(reader)) is not None:
+            frame_type, payload = frame
+            if frame_type != FrameType.JSON:
+                raise ValueError(f"Unexpected frame type {frame_type}")
 
-            json_message = json.loads(line)
+            json_message = json.loads(payload)
 
             msg_type = json_message.get("message_type")
             if msg_type == "start":
                 start_json_message: ProcessStartRequest = json_message
                 # Execute the student code for the first time and load
                 # variables into the student_code_vars dictionary
-                student_code = start_json_message["student_code"]
-                student_file_name = start_json_message["student_file_name"]
-                setup_code = start_json_message["setup_code"]
-                initialization_timeout = start_json_message["initialization_timeout"]
-                import_whitelist = start_json_message["import_whitelist"]
-                import_blacklist = start_json_message["import_blacklist"]
-                starting_vars = start_json_message["starting_vars"]
-                builtin_whitelist = start_json_message["builtin_whitelist"]
-                names_for_user_list = start_json_message["names_for_user_list"]
-
-                populate_linecache(student_code, student_file_name)
-
-                local_vars, student_code_vars, start_response = await student_code_runner(
-                    setup_code=setup_code,
-                    student_code=student_code,
-                    student_file_name=student_file_name,
-                    timeout=initialization_timeout,
-                    import_whitelist=import_whitelist,
-                    import_blacklist=import_blacklist,
-                    starting_vars=starting_vars,
-                    builtin_whitelist=builtin_whitelist,
-                    names_for_user_list=names_for_user_list,
-                )
+                # Limit the runner before any student code runs
+                if resource_limits := start_json_message.get("resource_limits"):
+                    limit_runner_resources(resource_limits)
+
+                local_vars, student_code_vars, start_response = await initialize_student_code(start_json_message)
 
-                writer.write((json.dumps(start_response) + os.linesep).encode())
+                writer.write(encode_json_frame(start_response))
 
             elif msg_type == "query_setup":
                 assert local_vars is not None
@@ -301,7 +1081,8 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
                 else:
                     setup_query_response = {"status": QueryStatusCode.NOT_FOUND, "value_encoded": ""}
 
-                writer.write((json.dumps(setup_query_response) + os.linesep).encode())
+                setup_query_response["request_id"] = query_setup_json_message["request_id"]
+                writer.write(encode_json_frame(setup_query_response))
 
             elif msg_type == "query":
                 assert student_code_vars is not None
@@ -318,7 +1099,8 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
                 else:
                     query_response = {"status": QueryStatusCode.NOT_FOUND, "value": ""}
 
-                writer.write((json.dumps(query_response) + os.linesep).encode())
+                query_response["request_id"] = query_json_message["request_id"]
+                writer.write(encode_json_frame(query_response))
 
             elif msg_type == "query_function":
                 assert student_code_vars is not None
@@ -328,29 +1110,77 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
                 args = deserialize_object_unsafe(query_function_json_message["args_encoded"])
                 kwargs = deserialize_object_unsafe(query_function_json_message["kwargs_encoded"])
                 query_timeout = query_function_json_message["query_timeout"]
+                send_output = None
+                if query_function_json_message.get("stream_output"):
+                    send_output = make_output_sender(writer, query_function_json_message["request_id"])
+
+                function_response = await student_function_runner(
+                    student_code_vars,
+                    func_name,
+                    query_timeout,
+                    args,
+                    kwargs,
+                    send_output,
+                    benchmark=query_function_json_message.get("benchmark"),
+                    comparison=query_function_json_message.get("comparison"),
+                    reference_vars=local_vars,
+                    scaling=query_function_json_message.get("scaling"),
+                    profile=query_function_json_message.get("profile"),
+                    memory=query_function_json_message.get("memory"),
+                )
 
-                function_response = await student_function_runner(student_code_vars, func_name, query_timeout, args, kwargs)
+                function_response["request_id"] = query_function_json_message["request_id"]
+                writer.write(encode_json_frame(function_response))
 
-                writer.write((json.dumps(function_response) + os.linesep).encode())
+            elif msg_type == "map_function":
+                assert student_code_vars is not None
+                map_json_message: StudentFunctionMapRequest = json_message
+
+                func_name = map_json_message["function_name"]
+                args_list = cast(list[tuple], deserialize_object_unsafe(map_json_message["args_list_encoded"]))
+                per_call_timeout = map_json_message["per_call_timeout"]
+                total_timeout = map_json_message["total_timeout"]
+
+                loop = asyncio.get_running_loop()
+                deadline = None if total_timeout is None else loop.time() + total_timeout
+
+                # Results are streamed back one call at a time as they complete
+                timed_out = False
+                for request_id, args in zip(map_json_message["request_ids"], args_list, strict=True):
+                    call_timeout = per_call_timeout if deadline is None else min(per_call_timeout, deadline - loop.time())
+
+                    if timed_out:
+                        # The timed out call is still occupying the executor
+                        map_response = skipped_call_response(func_name, "an earlier call in the batch timed out")
+                    elif call_timeout > 0:
+                        send_output = make_output_sender(writer, request_id) if map_json_message.get("stream_output") else None
+                        map_response = await student_function_runner(
+                            student_code_vars, func_name, call_timeout, args, {}, send_output, memory=map_json_message.get("memory")
+                        )
+                        timed_out = map_response["status"] == FunctionStatusCode.TIMEOUT and not map_response.get("interrupted")
+                    else:
+                        map_response = skipped_call_response(func_name, f"the total timeout of {total_timeout} seconds was exceeded")
+
+                    map_response["request_id"] = request_id
+                    writer.write(encode_json_frame(map_response))
+                    await writer.drain()
 
             # TODO handle cases of different payloads
             # The first payload should be student code
-            if line.lower() == "exit":
-                writer.write(("Goodbye!" + os.linesep).encode())
-                await writer.drain()
-                break  # Exit the loop and terminate the server
 
             # Simulate processing a request
             # response = f"Server processed: '{line.upper()}'\n"
 
+            # Requests are answered in the order they arrive, so the grader can pipeline
+            # several of them. Student code still runs one call at a time on the executor.
             await writer.drain()  # Ensure the response is written to stdout
 
     except asyncio.CancelledError:
-        writer.write((json.dumps({"status": "failure", "message": "Server was cancelled."}) + os.linesep).encode())
+        writer.write(encode_json_frame({"status": "failure", "message": "Server was cancelled."}))
     except asyncio.TimeoutError:
-        writer.write((json.dumps({"status": "failure", "message": "Student code timed out."}) + os.linesep).encode())
+        writer.write(encode_json_frame({"status": "failure", "message": "Student code timed out."}))
     except Exception as e:
-        writer.write((json.dumps({"status": "failure", "message": f"An error occurred: {e}"}) + os.linesep).encode())
+        writer.write(encode_json_frame({"status": "failure", "message": f"An error occurred: {e}"}))
     finally:
         # It's good practice to close transports and writers
         # print("Closing server connections...")
@@ -359,9 +1189,49 @@ async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWrit
         await writer.wait_closed()  # Wait for the writer to finish closing
 
 
-async def main():
+STREAM_BUFFER_LIMIT = 10 * 1024 * 1024  # Buffer up to 10 MB before pausing reads from the grader
+
+
+async def serve() -> None:
     """
-    Starts the asynchronous socket server.
+    Binds a TCP socket on the loopback interface, prints its address so the grader can
+    connect, and serves student code requests. Used on platforms where the grader can't
+    hand the runner a connected socket.
+    """
+    # Start the server, binding to the specified host and port
+    server = await asyncio.start_server(handle_client, HOST, 0, limit=STREAM_BUFFER_LIMIT)
+    addr = server.sockets[0].getsockname()
+    print(f"{addr[0]}, {addr[1]}", flush=True)
+
+    async with server:
+        # Run forever, or until the server is explicitly stopped
+        await server.serve_forever()
+
+
+async def serve_connection(student_socket: socket.socket, initialized_vars: InitializedVars | None = None) -> None:
+    """
+    Serves student code requests on a socket that is already connected to the grader,
+    until the grader closes it. A ready message is sent first, so the grader knows that
+    all imports are done.
+    """
+    reader, writer = await asyncio.open_connection(sock=student_socket, limit=STREAM_BUFFER_LIMIT)
+
+    ready_message: ProcessReadyMessage = {"message_type": "ready", "pid": os.getpid()}
+    if sys.platform != "win32":
+        # The grader leaves this out of the resources used by the student code
+        ready_message["startup_usage"] = resource_usage_from_rusage(resource.getrusage(resource.RUSAGE_SELF))
+    writer.write(encode_json_frame(ready_message))
+    await writer.drain()
+
+    if initialized_vars is None:
+        await handle_client(reader, writer)
+    else:
+        await handle_client(reader, writer, local_vars=initialized_vars[0], student_code_vars=initialized_vars[1])
+
+
+async def main(socket_fd: int | None = None) -> None:
+    """
+    Starts the asynchronous socket server, or serves the inherited socket if one is given.
     """
     # Ensure ProactorEventLoop is used on Windows for robust socket operations
     if sys.platform == "win32":
@@ -372,17 +1242,190 @@ async def main():
         except NotImplementedError:
             print("ProactorEventLoop not available, continuing with default loop.", file=sys.stderr)
 
-    line_limit = 10 * 1024 * 1024  # 10 MB line limit to handle large messages
+    if socket_fd is None:
+        await serve()
+    else:
+        await serve_connection(socket.socket(fileno=socket_fd))
 
-    # Start the server, binding to the specified host and port
-    server = await asyncio.start_server(handle_client, HOST, 0, limit=line_limit)
-    addr = server.sockets[0].getsockname()
-    print(f"{addr[0]}, {addr[1]}", flush=True)
 
-    async with server:
-        # Run forever, or until the server is explicitly stopped
-        await server.serve_forever()
+def run_forked_runner(
+    student_socket: socket.socket,
+    worker_username: str | None,
+    initialized_vars: InitializedVars | None,
+    resource_limits: ResourceLimits | None = None,
+) -> None:
+    """
+    Entry point for a runner forked from the fork server. Drops privileges and applies the
+    resource limits of the initialized student code, if needed, and then serves requests
+    like a freshly started runner.
+    """
+    global executor
+
+    if worker_username is not None:
+        drop_privileges(worker_username)
+
+    # The executor's worker thread (if the fork server ever started one) does not exist in
+    # this process, so start over with a fresh executor.
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    if resource_limits:
+        limit_runner_resources(resource_limits)
+
+    asyncio.run(serve_connection(student_socket, initialized_vars))
+
+
+def run_fork_server(fd_socket: socket.socket) -> None:
+    """
+    Runs a fork server (zygote). All dependencies of the runner are already imported at this
+    point, so forked runners share those pages copy-on-write with this process instead of
+    importing them again. Requests and responses are JSON lines on stdin and stdout. The
+    socket each forked runner serves, and the pipe for its stdout and stderr, are received
+    over `fd_socket` with each fork request.
+
+    The fork server can also be asked to initialize student code itself. Runners forked
+    after that start from a copy of the initialized student code instead of running it again.
+    """
+    children: set[int] = set()
+    initialized_vars: InitializedVars | None = None
+    initialized_resource_limits: ResourceLimits | None = None
+
+    # Keep private copies of the control pipes and point the standard streams somewhere
+    # harmless, so nothing printed by student code or by the forked runners can end up
+    # in the responses to the grader.
+    control_in = os.fdopen(os.dup(sys.stdin.fileno()), "rb")
+    control_out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    devnull_fd = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull_fd, sys.stdin.fileno())
+    os.dup2(devnull_fd, sys.stdout.fileno())
+    os.close(devnull_fd)
+
+    # Move everything allocated so far out of the collector's view, so collections in the
+    # children don't touch (and so copy) the shared pages.
+    gc.collect()
+    gc.freeze()
+
+    def poll_child(pid: int) -> tuple[int | None, ResourceUsage | None]:
+        # Nothing is kept about a reaped runner, since the OS may give its pid to a later one.
+        # The grader holds on to the status it is sent.
+        try:
+            waited_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+        except ChildProcessError:
+            return None, None
+
+        if waited_pid == 0:
+            return None, None
+
+        children.discard(pid)
+        return os.waitstatus_to_exitcode(status), resource_usage_from_rusage(rusage)
+
+    def write_response(response: dict[str, Any]) -> None:
+        control_out.write((json.dumps(response) + os.linesep).encode())
+        control_out.flush()
+
+    # Let the grader know that the imports are done, so it can start timing requests
+    write_response({"pid": os.getpid()})
+
+    try:
+        for line in control_in:
+            if not line.strip():
+                continue
+
+            request = json.loads(line)
+            command = request.get("command")
+
+            if command == "fork":
+                _, fds, _, _ = socket.recv_fds(fd_socket, 1, 2)
+                student_socket = socket.socket(fileno=fds[0])
+                output_fd = fds[1]
+
+                pid = os.fork()
+                if pid == 0:
+                    exit_code = 0
+                    try:
+                        os.dup2(output_fd, sys.stdout.fileno())
+                        os.dup2(output_fd, sys.stderr.fileno())
+                        os.close(output_fd)
+                        control_in.close()
+                        control_out.close()
+                        fd_socket.close()
+                        run_forked_runner(student_socket, request.get("worker_username"), initialized_vars, initialized_resource_limits)
+                    except BaseException:
+                        traceback.print_exc()
+                        exit_code = 1
+                    finally:
+                        os._exit(exit_code)
+
+                student_socket.close()
+                os.close(output_fd)
+                children.add(pid)
+                response: dict[str, Any] = {"pid": pid}
+
+            elif command == "initialize":
+                if initialized_vars is not None:
+                    response = {"error": "Student code has already been initialized."}
+                else:
+                    initialized_resource_limits = request["start_request"].get("resource_limits")
+
+                    # The CPU time and process limits would count everything the fork server does
+                    # until it exits, including forking runners, so only the runners get those.
+                    if initialized_resource_limits:
+                        server_limits = {
+                            name: value for name, value in initialized_resource_limits.items() if name in ("memory_mb", "file_size_mb")
+                        }
+                        set_resource_limits(cast(ResourceLimits, server_limits))
+
+                    local_vars, student_code_vars, start_response = asyncio.run(initialize_student_code(request["start_request"]))
+
+                    if start_response["status"] == ProcessStatusCode.SUCCESS:
+                        initialized_vars = (local_vars, student_code_vars)
+
+                        # No thread can be running at fork time, and the initialized
+                        # variables should be shared with the forked runners as well.
+                        executor.shutdown(wait=True)
+                        gc.collect()
+                        gc.freeze()
+
+                    response = {"start_response": start_response}
+
+            elif command == "poll":
+                # Polling reaps a runner that exited, which also collects its resource usage
+                returncode, resource_usage = poll_child(request["pid"])
+                response = {"returncode": returncode, "resource_usage": resource_usage}
+
+            else:
+                response = {"error": f"Unknown fork server command: {command}"}
+
+            write_response(response)
+
+    finally:
+        # The grader closed our stdin, so no one is left to clean up the remaining runners
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
+    # Student code that timed out during initialization may still be running in the
+    # executor's thread, which would keep the interpreter from exiting normally.
+    control_out.close()
+    os._exit(0)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Runs student code on behalf of the grader.")
+    parser.add_argument("--fork-server", action="store_true", help="Run as a fork server that starts new runners on request.")
+    parser.add_argument(
+        "--socket-fd",
+        type=int,
+        help="Inherited socket connected to the grader. For the fork server, runner sockets are received on it instead.",
+    )
+    cli_args = parser.parse_args()
+
+    if cli_args.fork_server:
+        if cli_args.socket_fd is None:
+            parser.error("--fork-server requires --socket-fd")
+
+        run_fork_server(socket.socket(fileno=cli_args.socket_fd))
+    else:
+        asyncio.run(main(cli_args.socket_fd))
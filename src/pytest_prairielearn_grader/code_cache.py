@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import hmac
+import importlib.util
+import logging
+import marshal
+import os
+import secrets
+import stat
+import sys
+import tempfile
+import types
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class CompiledCodeCache:
+    """
+    Caches compiled setup and student code as marshalled code objects, so sandboxes can exec
+    code that is ready to run instead of compiling the same source for every test. Entries are
+    keyed by a hash of the source and file name, so every test and student file of a question
+    that runs the same code shares one entry.
+
+    Entries are kept in memory for the session, and also in `cache_dir` if one is given, so
+    later sessions (e.g. grading the next submission) skip compiling as well. Sandboxes run the
+    same interpreter as the grader, so marshalled code can be loaded there as is.
+
+    Loading marshalled code runs whatever it contains, so entries on disk are signed with a
+    key that only the grader's user can read, and entries with a wrong signature are compiled
+    again. A cache directory owned by another user is not used at all, and one owned by the
+    grader is made writable by the grader only.
+    """
+
+    cache_dir: Path | None
+    _entries: dict[str, str]
+    _key: bytes
+
+    def __init__(self, cache_dir: Path | None = None) -> None:
+        self.cache_dir = None
+        self._entries = {}
+        self._key = b""
+
+        if cache_dir is not None:
+            try:
+                self._key = _read_cache_key(cache_dir)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Not caching compiled code in {cache_dir}: {e}")
+            else:
+                self.cache_dir = cache_dir
+
+    @staticmethod
+    def _cache_key(source: str, filename: str) -> str:
+        # Marshalled code is only valid for the bytecode version it was compiled with
+        digest = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+        digest.update(filename.encode("utf-8") + b"\0")
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, source: str, filename: str) -> str | None:
+        """
+        Returns the code object compiled from `source`, marshalled and base64 encoded for the
+        start request. Returns None if the source fails to compile, so the sandbox compiles it
+        itself and reports the error like any other problem with the student code.
+        """
+        key = self._cache_key(source, filename)
+
+        if key in self._entries:
+            return self._entries[key]
+
+        compiled = self._load(key)
+        if compiled is None:
+            try:
+                code = compile(source, filename, "exec", dont_inherit=True)
+            except Exception:
+                # Besides syntax errors, deeply nested code raises a MemoryError or RecursionError
+                return None
+
+            compiled = base64.b64encode(marshal.dumps(code)).decode("ascii")
+            self._store(key, compiled)
+
+        self._entries[key] = compiled
+        return compiled
+
+    def _signature(self, key: str, compiled: str) -> str:
+        return hmac.new(self._key, f"{key}\0{compiled}".encode("ascii"), hashlib.sha256).hexdigest()
+
+    def _load(self, key: str) -> str | None:
+        if self.cache_dir is None:
+            return None
+
+        try:
+            signature, _, compiled = (self.cache_dir / key).read_text(encoding="ascii").partition("\n")
+        except (OSError, UnicodeDecodeError):
+            return None
+
+        if not hmac.compare_digest(signature, self._signature(key, compiled)):
+            logger.warning(f"Ignoring compiled code with an invalid signature in {self.cache_dir / key}")
+            return None
+
+        return compiled
+
+    def _store(self, key: str, compiled: str) -> None:
+        if self.cache_dir is None:
+            return
+
+        # Write to a temporary file first, so concurrent sessions never read a partial entry
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f"{key}.", suffix=".tmp")
+        except OSError as e:
+            logger.warning(f"Could not write compiled code to the cache directory {self.cache_dir}: {e}")
+            return
+
+        try:
+            with os.fdopen(fd, "w", encoding="ascii") as f:
+                f.write(f"{self._signature(key, compiled)}\n{compiled}")
+            os.replace(temp_path, self.cache_dir / key)
+        except OSError as e:
+            logger.warning(f"Could not write compiled code to the cache directory {self.cache_dir}: {e}")
+            Path(temp_path).unlink(missing_ok=True)
+
+
+def _read_cache_key(cache_dir: Path) -> bytes:
+    """
+    Returns the key that signs the entries in `cache_dir`, creating it on first use. Raises a
+    `ValueError` if other users could change the entries or read the key.
+    """
+    if sys.platform != "win32":
+        dir_stat = cache_dir.lstat()
+        if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid():
+            raise ValueError("the directory is not owned by the grader")
+        # pytest creates its cache directories with the default permissions
+        if dir_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            cache_dir.chmod(stat.S_IMODE(dir_stat.st_mode) & ~(stat.S_IWGRP | stat.S_IWOTH))
+
+    key_path = cache_dir / "signing_key"
+    if not key_path.exists():
+        # mkstemp creates the file readable by its owner only. Linking it in place never
+        # replaces a key another session created meanwhile, nor exposes a partial one.
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix="signing_key.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="ascii") as f:
+                f.write(secrets.token_hex(32))
+            os.link(temp_path, key_path)
+        except FileExistsError:
+            pass
+        finally:
+            Path(temp_path).unlink(missing_ok=True)
+
+    if sys.platform != "win32":
+        key_stat = key_path.lstat()
+        if not stat.S_ISREG(key_stat.st_mode) or key_stat.st_uid != os.getuid() or key_stat.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            raise ValueError(f"the signing key {key_path} can be accessed by other users")
+
+    key = key_path.read_text(encoding="ascii").strip()
+    if len(key) != 64:
+        raise ValueError(f"the signing key {key_path} is incomplete")
+
+    return bytes.fromhex(key)
+
+
+def load_compiled_code(compiled: str) -> types.CodeType:
+    """
+    Loads a code object returned by `CompiledCodeCache.get`. Only the grader produces these, and
+    entries read from disk have had their signature checked.
+    """
+    return marshal.loads(base64.b64decode(compiled))  # noqa: S302
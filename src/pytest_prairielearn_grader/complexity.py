@@ -0,0 +1,83 @@
+from collections.abc import Callable
+from collections.abc import Sequence
+from typing import NamedTuple
+
+import numpy as np
+
+# Candidate complexity classes, from the slowest growing to the fastest growing
+COMPLEXITY_CLASSES: dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "1": np.ones_like,
+    "log n": np.log,
+    "n": lambda n: n,
+    "n log n": lambda n: n * np.log(n),
+    "n^2": lambda n: n**2,
+    "n^3": lambda n: n**3,
+}
+
+
+class ScalingFit(NamedTuple):
+    """
+    How the running time of a function grows with the size of its input. `best_fit` is the
+    complexity class (a key of `COMPLEXITY_CLASSES`) that explains the measured times best.
+    `confidence` is between 0 and 1, and is how much better that class fits than the next
+    best one (0 if they fit equally well). `errors` has the fitting error of every class, and
+    `exponent` is the slope of the times against the sizes on a log-log scale (e.g. close to
+    2 for a quadratic function).
+    """
+
+    sizes: list[int]
+    times: list[float]
+    best_fit: str
+    confidence: float
+    errors: dict[str, float]
+    exponent: float
+
+    def is_at_most(self, complexity: str) -> bool:
+        """
+        Whether the best fit grows no faster than the given complexity class, e.g.
+        `fit.is_at_most("n log n")` for a subquadratic sorting algorithm.
+        """
+        if complexity not in COMPLEXITY_CLASSES:
+            raise ValueError(f"Unknown complexity class {complexity!r}, expected one of {list(COMPLEXITY_CLASSES)}.")
+
+        order = list(COMPLEXITY_CLASSES)
+        return order.index(self.best_fit) <= order.index(complexity)
+
+
+def _fit_error(sizes: np.ndarray, times: np.ndarray, complexity: Callable[[np.ndarray], np.ndarray]) -> float:
+    """
+    Fits `times ~ a + b * complexity(sizes)` with `b >= 0` and returns the sum of the squared
+    relative errors, so the large times don't drown out the small ones.
+    """
+    weights = 1 / times
+    design = np.column_stack([np.ones_like(sizes), complexity(sizes)]) * weights[:, np.newaxis]
+    (a, b), *_ = np.linalg.lstsq(design, np.ones_like(times), rcond=None)
+
+    if b < 0:
+        # A shrinking time is no better explained by this class than by a constant
+        a, b = np.average(times, weights=weights**2), 0.0
+
+    predicted = a + b * complexity(sizes)
+    return float(np.sum(((predicted - times) * weights) ** 2))
+
+
+def fit_complexity(sizes: Sequence[int], times: Sequence[float]) -> ScalingFit:
+    """
+    Finds the complexity class that explains how `times` grow with `sizes` best.
+    """
+    if len(sizes) != len(times) or len(sizes) < 3:
+        raise ValueError("Fitting a complexity class needs a time for each of at least three sizes.")
+
+    size_array = np.asarray(sizes, dtype=np.float64)
+    # A time of zero (below the timer's resolution) would get an infinite weight
+    time_array = np.maximum(np.asarray(times, dtype=np.float64), 1e-9)
+
+    errors = {name: _fit_error(size_array, time_array, complexity) for name, complexity in COMPLEXITY_CLASSES.items()}
+
+    # Sorting is stable, so the slower growing class wins a tie
+    (best_fit, best_error), (_, second_error) = sorted(errors.items(), key=lambda item: item[1])[:2]
+    confidence = 1 - best_error / second_error if second_error > 0 else 0.0
+
+    exponent = float(np.polyfit(np.log(size_array), np.log(time_array), 1)[0])
+
+    return ScalingFit(list(sizes), list(times), best_fit, confidence, errors, exponent)
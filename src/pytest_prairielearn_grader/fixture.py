@@ -1,33 +1,79 @@
+import asyncio
+import functools
 import json
 import logging
 import os
+import signal
 import socket
 import subprocess
-import sys
-from importlib.resources import files
+import time
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Sequence
 from pathlib import Path
 from typing import Any
 from typing import NamedTuple
+from typing import cast
 
+from .code_cache import CompiledCodeCache
+from .complexity import ScalingFit
+from .complexity import fit_complexity
 from .json_utils import from_json
+from .pool import ForkedProcess
+from .pool import ForkServer
+from .pool import ProcessOutput
+from .pool import RunnerLauncher
+from .pool import RunnerProcess
+from .pool import close_runner_process
+from .pool import spawn_runner_process
+from .pool import wait_for_resource_usage
+from .utils import DEFAULT_OUTPUT_LIMIT
+from .utils import BenchmarkOptions
+from .utils import BenchmarkStats
+from .utils import BoundedOutput
+from .utils import ComparisonOptions
+from .utils import FrameReader
+from .utils import FrameType
+from .utils import FunctionStatusCode
+from .utils import IncompleteFrameError
+from .utils import MemoryUsage
 from .utils import NamesForUserInfo
+from .utils import OutputChunkMessage
+from .utils import PerformanceComparison
 from .utils import ProcessStartRequest
 from .utils import ProcessStartResponse
 from .utils import ProcessStatusCode
+from .utils import ProfileEntry
+from .utils import ResourceLimits
+from .utils import ResourceUsage
+from .utils import ScalingOptions
 from .utils import SetupQueryRequest
 from .utils import SetupQueryResponse
+from .utils import StudentFunctionMapRequest
 from .utils import StudentFunctionRequest
 from .utils import StudentFunctionResponse
 from .utils import StudentQueryRequest
 from .utils import StudentQueryResponse
+from .utils import add_resource_usage
 from .utils import deserialize_object_unsafe
-from .utils import drop_privileges
+from .utils import encode_json_frame
+from .utils import read_frame
+from .utils import read_process_resource_usage
+from .utils import resource_usage_since
 from .utils import serialize_object_unsafe
 
 DataFixture = dict[str, Any]
 
-SCRIPT_PATH = str(files("pytest_prairielearn_grader").joinpath("_student_code_runner.py"))
 DEFAULT_TIMEOUT = 1.0
+DEFAULT_BENCHMARK_ROUNDS = 5
+DEFAULT_COMPARISON_TIMEOUT = 10.0
+# How many of the student's slowest functions a profiled call returns
+PROFILE_TOP_FUNCTIONS = 10
+# How many of the student's top allocation sites a call with traced memory returns
+MEMORY_TOP_SITES = 5
+# Extra time the grader waits on top of a timeout enforced by the runner, so that the
+# runner's own timeout status is reported instead of a socket timeout racing it.
+RESPONSE_GRACE_PERIOD = 0.5
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +85,21 @@ class StudentFiles(NamedTuple):
     setup_code_file: Path
 
 
+class SandboxSnapshot(NamedTuple):
+    """
+    A fork server that has already run the setup and student code. Sandboxes started
+    from the snapshot are forked from it with the student code already initialized.
+    `start_response` is the response to the initialization, which every sandbox started
+    from the snapshot reports as its own.
+    """
+
+    fork_server: ForkServer
+    start_response: ProcessStartResponse
+
+    def close(self) -> None:
+        self.fork_server.close()
+
+
 class FeedbackFixture:
     """
     A fixture to handle feedback from the student code.
@@ -58,6 +119,23 @@ class FeedbackFixture:
     def add_message(self, message: str) -> None:
         self.messages.append(message)
 
+    def add_profile(self, profile: list[ProfileEntry] | None, title: str = "Where your code spent its time:") -> None:
+        """
+        Adds a digest of a profiled function call (see `StudentFixture.last_profile`) to the
+        feedback, listing the student's functions by the time spent in them and in the
+        functions they called. Does nothing if there is no profile.
+        """
+        if not profile:
+            return
+
+        lines = [title]
+        lines.extend(
+            f"  {entry['function']} (line {entry['line']}): {entry['cumulative_time']:.3f}s total, "
+            f"{entry['total_time']:.3f}s in the function itself, {entry['calls']} call{'s' if entry['calls'] != 1 else ''}"
+            for entry in profile
+        )
+        self.add_message(os.linesep.join(lines))
+
     def set_score(self, score: float) -> None:
         self.score = score
 
@@ -81,8 +159,77 @@ class FeedbackFixture:
         }
 
 
+class PerformanceFixture:
+    """
+    A fixture to grade the speed of student functions against reference functions from the
+    setup code, with the settings of the test's `performance` marker. A passing test gets full
+    credit if the student function is at most `target_ratio` times slower than the reference,
+    and partial credit of `target_ratio / ratio` otherwise. With several comparisons in one test,
+    the slowest one counts.
+    """
+
+    test_id: str
+    reference: str | None
+    target_ratio: float
+    points: float | None
+    options: dict[str, Any]
+    comparisons: list[PerformanceComparison]
+
+    def __init__(
+        self, test_id: str, reference: str | None = None, target_ratio: float = 1.0, points: float | None = None, **options: Any
+    ) -> None:
+        if target_ratio <= 0:
+            raise ValueError(f"target_ratio must be positive, got {target_ratio}.")
+
+        self.test_id = test_id
+        self.reference = reference
+        self.target_ratio = target_ratio
+        self.points = points
+        # Passed on to `StudentFixture.compare_function`, e.g. rounds or cpu
+        self.options = options
+        self.comparisons = []
+
+    def compare(
+        self, sandbox: "StudentFixture", function_name: str, *args, reference: str | None = None, **kwargs
+    ) -> PerformanceComparison:
+        """
+        Times a student function against the reference function (the marker's, unless another
+        one is given) and records the result for grading.
+        """
+        reference = reference or self.reference
+        if reference is None:
+            raise ValueError("No reference function given, either in the performance marker or to compare.")
+
+        comparison = sandbox.compare_function(function_name, *args, reference=reference, **{**self.options, **kwargs})
+        self.comparisons.append(comparison)
+
+        return comparison
+
+    @property
+    def ratio(self) -> float | None:
+        """
+        The ratio of the slowest comparison, or None if nothing was compared.
+        """
+        return max((comparison["ratio"] for comparison in self.comparisons), default=None)
+
+    @property
+    def score(self) -> float | None:
+        if (ratio := self.ratio) is None:
+            return None
+
+        # `compare_function` only reports positive ratios, but a score outside [0, 1] is never valid
+        if ratio <= 0:
+            return 0.0
+
+        return max(0.0, min(1.0, self.target_ratio / ratio))
+
+    def to_dict(self) -> dict:
+        return {"ratio": self.ratio, "target_ratio": self.target_ratio, "comparisons": self.comparisons}
+
+
 class StudentFixture:
-    process: subprocess.Popen | None
+    process: subprocess.Popen | ForkedProcess | None
+    process_output: ProcessOutput | None
     leading_file: Path
     trailing_file: Path
     student_code_file: Path
@@ -93,7 +240,30 @@ class StudentFixture:
     builtin_whitelist: list[str] | None
     names_for_user_list: list[NamesForUserInfo] | None
     worker_username: str | None
-    _accumulated_stdout: list[str]
+    sandbox_launcher: RunnerLauncher | None
+    resource_limits: ResourceLimits | None
+    code_cache: CompiledCodeCache | None
+    output_limit: int | None
+    collect_coverage: bool
+    covered_lines: set[int]
+    output_callback: Callable[[str, str], None] | None
+    shared_setup_vars: str | None
+    last_profile: list[ProfileEntry] | None
+    last_memory_usage: MemoryUsage | None
+    startup_timings: dict[str, float]
+    pool_startup_timings: dict[str, float]
+    resource_usage: ResourceUsage | None
+    _last_usage_sample: ResourceUsage | None
+    _startup_usage: ResourceUsage | None
+    _deferred_start: Callable[[], None] | None
+    _restart: Callable[[], ProcessStartResponse] | None
+    _accumulated_stdout: BoundedOutput
+    _unsampled_lines: set[int]
+    _streamed_output: dict[int, tuple[BoundedOutput, BoundedOutput]]
+    _next_request_id: int
+    _pending_request_ids: set[int]
+    _received_responses: dict[int, Any]
+    _frame_reader: FrameReader | None
 
     def __init__(
         self,
@@ -104,6 +274,11 @@ class StudentFixture:
         builtin_whitelist: list[str] | None,
         names_for_user_list: list[NamesForUserInfo] | None,
         worker_username: str | None,
+        sandbox_launcher: RunnerLauncher | None = None,
+        resource_limits: ResourceLimits | None = None,
+        code_cache: CompiledCodeCache | None = None,
+        output_limit: int | None = DEFAULT_OUTPUT_LIMIT,
+        collect_coverage: bool = False,
     ) -> None:
         self.leading_file = file_names.leading_file
         self.trailing_file = file_names.trailing_file
@@ -116,11 +291,47 @@ class StudentFixture:
         self.builtin_whitelist = builtin_whitelist
         self.names_for_user_list = names_for_user_list
         self.worker_username = worker_username
+        self.sandbox_launcher = sandbox_launcher
+        self.resource_limits = resource_limits
+        self.code_cache = code_cache
+        # How many characters of stdout and stderr to keep, both for each response and accumulated
+        self.output_limit = output_limit
+        # Whether to record which lines of the student code run. Needs Python 3.12+ in the sandbox.
+        self.collect_coverage = collect_coverage
+        # Lines of the student code that ran during initialization or any function call so far
+        self.covered_lines = set()
+        # Called with the stream name and each chunk of output while function calls run, if set
+        self.output_callback = None
+        # Serialized variables from a shared run of the setup code, see `create_shared_setup`
+        self.shared_setup_vars = None
+        # Profile of the last function call made with `profile=True`
+        self.last_profile = None
+        # Memory usage of the last function call made with `trace_memory=True`
+        self.last_memory_usage = None
 
         # Initialize the process and socket to None
         self.process = None
+        self.process_output = None
         self.student_socket = None
-        self._accumulated_stdout = []
+        # How long each phase of starting the student code server took, in seconds
+        self.startup_timings = {}
+        # Phases of starting a server that a pool started ahead of time. These ran in the
+        # background, so they are kept apart from the phases that held up the test.
+        self.pool_startup_timings = {}
+        # Resources used by the student code server processes that have exited so far
+        self.resource_usage = None
+        self._last_usage_sample = None
+        # What the running server used to start up, which is left out of its resource usage
+        self._startup_usage = None
+        self._deferred_start = None
+        self._restart = None
+        self._accumulated_stdout = BoundedOutput(output_limit)
+        self._unsampled_lines = set()
+        self._streamed_output = {}
+        self._next_request_id = 0
+        self._pending_request_ids = set()
+        self._received_responses = {}
+        self._frame_reader = None
 
     def _assert_process_running(self) -> None:
         """
@@ -131,94 +342,75 @@ class StudentFixture:
 
         process_return_code = self.process.poll()
         if process_return_code is not None:
-            raise RuntimeError(f"Student code server process terminated with code {process_return_code}.")
+            raise RuntimeError(self._with_process_output(f"Student code server process terminated with code {process_return_code}."))
+
+    def defer_start(self, start: Callable[[], None]) -> None:
+        """
+        Defers starting the student code server until the first query. `start` is called
+        once, right before the first request is sent, and must start the server.
+        """
+        self._deferred_start = start
+
+    def _ensure_started(self) -> None:
+        if self.process is None and self._deferred_start is not None:
+            start = self._deferred_start
+            self._deferred_start = None
+
+            logger.debug("Starting deferred student code server on first query")
+            start()
+
+        elif self._frame_reader is not None and self._frame_reader.broken:
+            # A read timed out partway through a response, and the rest of it is still waiting
+            # in the socket, so the server is replaced before the next request
+            self._restart_after_timeout()
 
     def _send_json_object(
-        self, json_object: StudentQueryRequest | ProcessStartRequest | StudentFunctionRequest | SetupQueryRequest
+        self,
+        json_object: StudentQueryRequest | ProcessStartRequest | StudentFunctionRequest | StudentFunctionMapRequest | SetupQueryRequest,
     ) -> None:
         """
         Sends a JSON object to the student code server.
         """
         assert self.student_socket is not None, "Student socket is not connected. Please start the student code server first."
-        self.student_socket.sendall((json.dumps(json_object) + os.linesep).encode("utf-8"))
+        self.student_socket.sendall(encode_json_frame(json_object))
 
-    def _read_from_socket(self) -> bytes:
+    def _read_from_socket(self) -> bytearray:
         """
-        Reads data from a socket until a termination character is found.
+        Reads a single message frame from the socket and returns its payload.
         """
-        buffer = bytearray()
-
-        terminator = os.linesep.encode("utf-8")
-        max_len: int | None = None  # TODO add max length parameter?
-
-        assert self.student_socket is not None, "Student socket is not connected. Please start the student code server first."
-
-        # Define a small chunk size for reading
-        chunk_size = 4096
-        chunk: bytes = b""
-
-        # TODO maybe set a hard iteration limit to avoid infinite loops?
-        while (idx := chunk.rfind(terminator)) == -1:
-            try:
-                # Read a chunk of data
-                chunk = self.student_socket.recv(chunk_size)
-            except TimeoutError as e:
-                # Re-raise the timeout error
-                raise TimeoutError("Socket read timed out.") from e
-
-            # Check if the connection was closed
-            if not chunk:
-                # Connection closed before terminator was found
-                raise Exception("Connection closed by peer before termination character was found.")
-
-            # Append the new chunk to the buffer
-            buffer.extend(chunk)
-
-            # Check for maximum length constraint
-            if max_len is not None and len(buffer) >= max_len:
-                # Raise an error or return buffer depending on desired behavior
-                raise Exception(f"Maximum read length of {max_len} exceeded.")
-
-        loc = len(buffer) - len(chunk) + idx + len(terminator)
-
-        # Return the buffer content up to and including the terminator
-        # to only return the necessary data if more data was read
-        return buffer[:loc]
-
-    def start_student_code_server(self, *, initialization_timeout: float = DEFAULT_TIMEOUT) -> ProcessStartResponse:
-        if self.worker_username is not None:
-            logger.debug(f"Starting student code server with worker username: {self.worker_username}")
-        else:
-            logger.debug("Starting student code server without dropping privileges.")
-
-        def try_drop_privileges() -> None:
-            if self.worker_username is not None:
-                drop_privileges(self.worker_username)
-
-        # Only use preexec_fn on Unix platforms (not Windows)
-        if sys.platform == "win32":
-            preexec_fn_arg = None
-        else:
-            preexec_fn_arg = try_drop_privileges
-
-        self.process = subprocess.Popen(
-            args=(sys.executable, SCRIPT_PATH),
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            preexec_fn=preexec_fn_arg,
-        )
-
-        # Assert process is running after popen call
-        self._assert_process_running()
+        assert self._frame_reader is not None, "Student socket is not connected. Please start the student code server first."
 
+        try:
+            frame_type, payload = self._frame_reader.read()
+        except IncompleteFrameError:
+            raise
+        except TimeoutError as e:
+            # Re-raise the timeout error
+            raise TimeoutError("Socket read timed out.") from e
+        except ConnectionError as e:
+            if (error := self._connection_lost_error()) is not None:
+                raise error from e
+            raise
+
+        if frame_type != FrameType.JSON:
+            raise RuntimeError(f"Unexpected frame type {frame_type} from student code server.")
+
+        return payload
+
+    def _build_start_request(self, initialization_timeout: float) -> ProcessStartRequest:
         student_code = ""
         if self.leading_file.is_file():
             student_code += self.leading_file.read_text(encoding="utf-8")
             student_code += os.linesep
 
+        # Where the student's own file starts and ends in the combined code
+        student_line_offset = student_code.count("\n")
+        student_line_count = 0
+
         if self.student_code_file.is_file():
-            student_code += self.student_code_file.read_text(encoding="utf-8")
+            student_file_code = self.student_code_file.read_text(encoding="utf-8")
+            student_code += student_file_code
+            student_line_count = student_file_code.count("\n") + 1
 
         if self.trailing_file.is_file():
             student_code += os.linesep
@@ -226,11 +418,18 @@ class StudentFixture:
 
         # TODO maybe add an error message for this?
         setup_code = None
-        if self.setup_code_file.is_file():
+        if self.shared_setup_vars is None and self.setup_code_file.is_file():
             setup_code = self.setup_code_file.read_text(encoding="utf-8")
 
+        compiled_setup_code = None
+        compiled_student_code = None
+        if self.code_cache is not None:
+            compiled_student_code = self.code_cache.get(student_code, str(self.student_code_file))
+            if setup_code:
+                compiled_setup_code = self.code_cache.get(setup_code, "<setup>")
+
         # TODO make this a shared type
-        json_message = ProcessStartRequest(
+        return ProcessStartRequest(
             message_type="start",
             student_code=student_code,
             student_file_name=str(self.student_code_file),
@@ -241,112 +440,498 @@ class StudentFixture:
             starting_vars=self.starting_vars,
             builtin_whitelist=self.builtin_whitelist,
             names_for_user_list=self.names_for_user_list,
+            resource_limits=self.resource_limits,
+            compiled_setup_code=compiled_setup_code,
+            compiled_student_code=compiled_student_code,
+            setup_vars=self.shared_setup_vars,
+            output_limit=self.output_limit,
+            coverage=self.collect_coverage,
+            student_line_offset=student_line_offset,
+            student_line_count=student_line_count,
         )
 
-        assert self.process.stdout is not None, "Process stdout is None. Ensure the process is started correctly."
+    def _connection_lost_error(self) -> Exception | None:
+        """
+        Returns the error to report after the server closed its connection, if it exited.
+        Includes what the server wrote to its own output (e.g. the traceback of a crash).
+        """
+        if self._exceeded_cpu_limit():
+            return RuntimeError("Student code exceeded its CPU time limit.")
+
+        if self.process is None:
+            return None
+
+        try:
+            returncode = self.process.wait(timeout=RESPONSE_GRACE_PERIOD)
+        except subprocess.TimeoutExpired:
+            return None
+
+        return RuntimeError(self._with_process_output(f"Student code server process terminated with code {returncode}."))
 
-        line = self.process.stdout.readline().decode()  # Read the initial output from the process to ensure it's ready
-        host, port = line.strip().split(",")
+    def _get_process_output(self) -> str:
+        """
+        Returns the output of a server that has exited, or an empty string if it's not available.
+        """
+        if self.process_output is None:
+            return ""
+
+        return self.process_output.getvalue(timeout=RESPONSE_GRACE_PERIOD)
+
+    def _with_process_output(self, message: str) -> str:
+        if process_output := self._get_process_output().strip():
+            message += f"{os.linesep * 2}Output of the student code server:{os.linesep}{process_output}"
+
+        return message
+
+    def _exceeded_cpu_limit(self) -> bool:
+        """
+        Whether the server was killed for exceeding its CPU time limit. Only checked after the
+        connection was closed, so the process is expected to exit (if it hasn't already).
+        A process that keeps running after SIGXCPU is killed with SIGKILL at the hard limit,
+        one second later, so that counts as well.
+        """
+        if self.process is None or not self.resource_limits or "cpu_seconds" not in self.resource_limits:
+            return False
+
+        try:
+            returncode = self.process.wait(timeout=RESPONSE_GRACE_PERIOD)
+        except subprocess.TimeoutExpired:
+            return False
+
+        return returncode in (-signal.SIGXCPU, -signal.SIGKILL)
+
+    @staticmethod
+    def _no_response(e: Exception) -> ProcessStartResponse:
+        return {
+            "status": ProcessStatusCode.NO_RESPONSE,
+            "execution_error": type(e).__name__,
+            "execution_message": str(e),
+            "execution_traceback": "",
+            "stdout": "",
+            "stderr": "",
+        }
+
+    def start_student_code_server(self, *, initialization_timeout: float = DEFAULT_TIMEOUT) -> ProcessStartResponse:
+        if self.worker_username is not None:
+            logger.debug(f"Starting student code server with worker username: {self.worker_username}")
+        else:
+            logger.debug("Starting student code server without dropping privileges.")
+
+        self._restart = functools.partial(self.start_student_code_server, initialization_timeout=initialization_timeout)
 
-        self.student_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.student_socket.settimeout(initialization_timeout)
-        self.student_socket.connect((host, int(port)))
+        phase_start = time.perf_counter()
+        if self.sandbox_launcher is not None:
+            runner = self.sandbox_launcher()
+        else:
+            runner = spawn_runner_process(self.worker_username)
+
+        self._use_runner(runner, time.perf_counter() - phase_start)
 
+        # Assert process is running after startup
+        self._assert_process_running()
+        assert self.student_socket is not None
+
+        json_message = self._build_start_request(initialization_timeout)
+
+        self.student_socket.settimeout(initialization_timeout + RESPONSE_GRACE_PERIOD)
+
+        request_start = time.perf_counter()
         self._send_json_object(json_message)
 
         try:
-            data = self._read_from_socket().decode()
+            data = self._read_from_socket()
+            self.startup_timings["start_request"] = time.perf_counter() - request_start
+
+            phase_start = time.perf_counter()
             res: ProcessStartResponse = json.loads(data)
+            self.startup_timings["response_decode"] = time.perf_counter() - phase_start
+            self.startup_timings.update(res.get("timings", {}))
+
             # Accumulate stdout from initialization phase
             if res.get("stdout"):
-                self._accumulated_stdout.append(res["stdout"])
+                self._accumulated_stdout.write(res["stdout"])
+            self._record_covered_lines(res)
         except Exception as e:
-            res = {
-                "status": ProcessStatusCode.NO_RESPONSE,
-                "execution_error": type(e).__name__,
-                "execution_message": str(e),
-                "execution_traceback": "",
-                "stdout": "",
-                "stderr": "",
-            }
+            res = self._no_response(e)
+
+            if not isinstance(e, TimeoutError) and self._exceeded_cpu_limit():
+                res["status"] = ProcessStatusCode.RESOURCE_LIMIT
+            elif self.process is not None and self.process.poll() is not None:
+                # Show why the server died instead of only that it didn't respond
+                res["stderr"] = self._get_process_output()
 
         return res
 
-    def query_setup_raw(self, var_to_query: str) -> SetupQueryResponse:
+    def _use_runner(self, runner: RunnerProcess, acquire_time: float) -> None:
+        """
+        Takes ownership of a started runner. `acquire_time` is how long it took to get it,
+        which is less than its own startup time if it was started ahead of time by a pool.
+        """
+        self.process = runner.process
+        self.process_output = runner.output
+        self.student_socket = runner.student_socket
+        self._frame_reader = FrameReader(runner.student_socket)
+        self._startup_usage = runner.startup_usage
+
+        if runner.started_ahead:
+            self.pool_startup_timings.update(runner.timings)
+        else:
+            self.startup_timings.update(runner.timings)
+        self.startup_timings["sandbox_acquire"] = acquire_time
+
+    def create_snapshot(self, *, initialization_timeout: float = DEFAULT_TIMEOUT) -> SandboxSnapshot:
+        """
+        Runs the setup and student code once in a new fork server and returns it as a
+        snapshot that sandboxes can be started from (see `start_from_snapshot`).
+        The caller is responsible for closing the snapshot.
+        """
+        logger.debug(f"Creating sandbox snapshot for {self.student_code_file}")
+
+        # The fork server runs the student code itself, so it must drop privileges up front
+        fork_server = ForkServer(self.worker_username, drop_privileges_at_start=True)
+        json_message = self._build_start_request(initialization_timeout)
+
+        try:
+            phase_start = time.perf_counter()
+            res = fork_server.initialize(dict(json_message), initialization_timeout + RESPONSE_GRACE_PERIOD)
+            start_response = cast(ProcessStartResponse, res)
+            self.startup_timings["snapshot_create"] = time.perf_counter() - phase_start
+            self.startup_timings.update(start_response.get("timings", {}))
+        except Exception as e:
+            start_response = self._no_response(e)
+
+        return SandboxSnapshot(fork_server, start_response)
+
+    def start_from_snapshot(self, snapshot: SandboxSnapshot) -> ProcessStartResponse:
+        """
+        Starts the student code server by forking it from an already initialized snapshot.
+        Returns the snapshot's start response, so startup failures are reported exactly as
+        if the student code had been initialized in this sandbox.
+        """
+        self._restart = functools.partial(self.start_from_snapshot, snapshot)
+        res = snapshot.start_response
+
+        if res.get("stdout"):
+            self._accumulated_stdout.write(res["stdout"])
+        self._record_covered_lines(res)
+
+        # Nothing to fork if initialization did not succeed
+        if res["status"] != ProcessStatusCode.SUCCESS:
+            return res
+
+        phase_start = time.perf_counter()
+        runner = snapshot.fork_server.spawn()
+        self._use_runner(runner, time.perf_counter() - phase_start)
+
         self._assert_process_running()
 
-        json_message: SetupQueryRequest = {"message_type": "query_setup", "var": var_to_query}
+        return res
 
-        assert self.student_socket is not None, "Student socket is not connected. Please start the student code server first."
-        self._send_json_object(json_message)
-        data: SetupQueryResponse = json.loads(self._read_from_socket().decode())
+    def create_shared_setup(self, *, initialization_timeout: float = DEFAULT_TIMEOUT) -> str | None:
+        """
+        Runs only the setup code, in a sandbox of its own, and returns its variables serialized
+        for `shared_setup_vars`. Sandboxes given these variables load them instead of running
+        the setup code again. Returns None if there is no setup code, if it fails, or if its
+        variables can't be serialized. Sandboxes then run the setup code themselves, so any
+        errors are still reported for each test.
+        """
+        if not self.setup_code_file.is_file():
+            return None
 
-        return data
+        logger.debug(f"Running shared setup code from {self.setup_code_file}")
 
-    def query_setup(self, var_to_query: str) -> Any:
+        json_message = self._build_start_request(initialization_timeout)
+        json_message["student_code"] = ""
+        json_message["compiled_student_code"] = None
+        json_message["names_for_user_list"] = None
+        json_message["return_setup_vars"] = True
+
+        phase_start = time.perf_counter()
+        runner = self.sandbox_launcher() if self.sandbox_launcher is not None else spawn_runner_process(self.worker_username)
+
+        try:
+            runner.student_socket.settimeout(initialization_timeout + RESPONSE_GRACE_PERIOD)
+            runner.student_socket.sendall(encode_json_frame(json_message))
+            _, payload = read_frame(runner.student_socket)
+            res: ProcessStartResponse = json.loads(payload)
+        except Exception as e:
+            logger.warning(f"Shared setup code did not respond, running it in each sandbox instead: {e}")
+            return None
+        finally:
+            close_runner_process(runner)
+
+        self.startup_timings["shared_setup_create"] = time.perf_counter() - phase_start
+
+        if res["status"] != ProcessStatusCode.SUCCESS:
+            logger.debug(f"Shared setup code failed with status {res['status']}, running it in each sandbox instead")
+            return None
+
+        if res.get("setup_vars") is None:
+            logger.warning("Variables defined by the setup code could not be serialized, running it in each sandbox instead")
+            return None
+
+        return res.get("setup_vars")
+
+    def _new_request_id(self) -> int:
         """
-        Queries a variable from the setup code and returns its value.
+        Returns a new request ID and marks it as waiting for a response.
         """
-        response = self.query_setup_raw(var_to_query)
+        self._next_request_id += 1
+        self._pending_request_ids.add(self._next_request_id)
+        return self._next_request_id
 
+    def _read_response(self, request_id: int) -> Any:
+        """
+        Reads the response to the request with the given ID. Responses to other requests
+        that are still pending are kept until they are asked for. Late responses to requests
+        that were abandoned (e.g. because the socket timed out) are discarded.
+        """
+        try:
+            while request_id not in self._received_responses:
+                self._store_response(self._read_from_socket())
+        finally:
+            self._pending_request_ids.discard(request_id)
+
+        return self._received_responses.pop(request_id)
+
+    def _store_response(self, payload: bytes | bytearray) -> None:
+        """
+        Keeps a response until it is asked for, or discards it if its request was abandoned.
+        """
+        response = json.loads(payload)
+        response_id = response.get("request_id")
+
+        if response.get("message_type") == "output":
+            self._store_output_chunk(response)
+            return
+
+        self._record_covered_lines(response)
+
+        if (streamed_output := self._streamed_output.pop(response_id, None)) is not None:
+            stdout, stderr = streamed_output
+            response["stdout"] = stdout.getvalue() + response.get("stdout", "")
+            response["stderr"] = stderr.getvalue() + response.get("stderr", "")
+
+        if response_id in self._pending_request_ids:
+            self._received_responses[response_id] = response
+        else:
+            logger.debug(f"Discarding late response to request {response_id}")
+
+    def _record_covered_lines(self, response: ProcessStartResponse | StudentFunctionResponse) -> None:
+        if lines := response.get("covered_lines"):
+            self.covered_lines.update(lines)
+            self._unsampled_lines.update(lines)
+
+    def sample_covered_lines(self) -> list[int]:
+        """
+        Returns the lines of the student code that ran since the previous sample (or since the
+        server started), so a long-lived sandbox can report coverage per test. Empty unless the
+        fixture collects coverage.
+        """
+        lines, self._unsampled_lines = sorted(self._unsampled_lines), set()
+        return lines
+
+    def _store_output_chunk(self, message: OutputChunkMessage) -> None:
+        """
+        Keeps streamed output of a function call up to the output limit, until its response
+        arrives, and passes it on to `output_callback`.
+        """
+        streamed_output = self._streamed_output.get(message["request_id"])
+        if streamed_output is None or message["request_id"] not in self._pending_request_ids:
+            return
+
+        stdout, stderr = streamed_output
+        (stdout if message["stream"] == "stdout" else stderr).write(message["data"])
+
+        if self.output_callback is not None:
+            self.output_callback(message["stream"], message["data"])
+
+    def _new_streamed_request_id(self) -> int:
+        """
+        Returns a new request ID for a function call, and prepares to receive its output
+        in chunks if output is streamed.
+        """
+        request_id = self._new_request_id()
+        if self.output_callback is not None:
+            self._streamed_output[request_id] = (BoundedOutput(self.output_limit), BoundedOutput(self.output_limit))
+
+        return request_id
+
+    def _setup_query_request(self, var_to_query: str) -> SetupQueryRequest:
+        self._ensure_started()
+        self._assert_process_running()
+
+        return {"message_type": "query_setup", "request_id": self._new_request_id(), "var": var_to_query}
+
+    def _query_request(self, var_to_query: str, query_timeout: float) -> StudentQueryRequest:
+        self._ensure_started()
+        self._assert_process_running()
+
+        return StudentQueryRequest(message_type="query", request_id=self._new_request_id(), var=var_to_query, query_timeout=query_timeout)
+
+    def _function_request(
+        self,
+        function_name: str,
+        args: tuple,
+        kwargs: dict[str, Any],
+        query_timeout: float,
+        benchmark: BenchmarkOptions | None = None,
+        comparison: ComparisonOptions | None = None,
+        scaling: ScalingOptions | None = None,
+        profile: bool = False,
+        trace_memory: bool = False,
+    ) -> StudentFunctionRequest:
+        self._ensure_started()
+
+        json_message = StudentFunctionRequest(
+            message_type="query_function",
+            request_id=self._new_streamed_request_id(),
+            function_name=function_name,
+            args_encoded=serialize_object_unsafe(args),
+            kwargs_encoded=serialize_object_unsafe(kwargs),
+            query_timeout=query_timeout,
+            stream_output=self.output_callback is not None,
+        )
+        if benchmark is not None:
+            json_message["benchmark"] = benchmark
+        if comparison is not None:
+            json_message["comparison"] = comparison
+        if scaling is not None:
+            json_message["scaling"] = scaling
+        if profile:
+            json_message["profile"] = PROFILE_TOP_FUNCTIONS
+        if trace_memory:
+            json_message["memory"] = MEMORY_TOP_SITES
+
+        return json_message
+
+    @staticmethod
+    def _benchmark_options(rounds: int, warmup: int, disable_gc: bool) -> BenchmarkOptions:
+        if rounds < 1:
+            raise ValueError(f"A benchmark needs at least one round, got {rounds}.")
+        if warmup < 0:
+            raise ValueError(f"The number of warmup calls can't be negative, got {warmup}.")
+
+        return {"rounds": rounds, "warmup": warmup, "disable_gc": disable_gc}
+
+    def query_setup_raw(self, var_to_query: str) -> SetupQueryResponse:
+        json_message = self._setup_query_request(var_to_query)
+
+        assert self.student_socket is not None, "Student socket is not connected. Please start the student code server first."
+        self._send_json_object(json_message)
+        data: SetupQueryResponse = self._read_response(json_message["request_id"])
+
+        return data
+
+    @staticmethod
+    def _setup_value(var_to_query: str, response: SetupQueryResponse) -> Any:
         if response["status"] == "not_found":
             raise NameError(f"Query for setup variable '{var_to_query}' failed")
 
         return deserialize_object_unsafe(response["value_encoded"])
 
-    def query_raw(self, var_to_query: str, *, query_timeout: float = DEFAULT_TIMEOUT) -> StudentQueryResponse:
-        self._assert_process_running()
+    def query_setup(self, var_to_query: str) -> Any:
+        """
+        Queries a variable from the setup code and returns its value.
+        """
+        return self._setup_value(var_to_query, self.query_setup_raw(var_to_query))
 
-        json_message = StudentQueryRequest(message_type="query", var=var_to_query, query_timeout=query_timeout)
+    def _send_query(self, var_to_query: str, query_timeout: float) -> int:
+        json_message = self._query_request(var_to_query, query_timeout)
 
         assert self.student_socket is not None, "Student socket is not connected. Please start the student code server first."
         self.student_socket.settimeout(query_timeout)
         self._send_json_object(json_message)
-        data: StudentQueryResponse = json.loads(self._read_from_socket().decode())
+
+        return json_message["request_id"]
+
+    def query_raw(self, var_to_query: str, *, query_timeout: float = DEFAULT_TIMEOUT) -> StudentQueryResponse:
+        request_id = self._send_query(var_to_query, query_timeout)
+        data: StudentQueryResponse = self._read_response(request_id)
 
         return data
 
+    @staticmethod
+    def _query_value(var_to_query: str, response: StudentQueryResponse) -> Any:
+        if response["status"] == "not_found":
+            raise NameError(f"Query for '{var_to_query}' failed")
+
+        return from_json(response["value"])
+
     def query(self, var_to_query: str, *, query_timeout: float = DEFAULT_TIMEOUT) -> Any:
         """
         Queries a variable from the student code and returns its value.
         """
-        response = self.query_raw(var_to_query, query_timeout=query_timeout)
+        return self._query_value(var_to_query, self.query_raw(var_to_query, query_timeout=query_timeout))
 
-        if response["status"] == "not_found":
-            raise NameError(f"Query for '{var_to_query}' failed")
+    def query_many(self, vars_to_query: Iterable[str], *, query_timeout: float = DEFAULT_TIMEOUT) -> list[Any]:
+        """
+        Queries several variables from the student code and returns their values in order.
+        All queries are sent before waiting for any response, so this takes a single round
+        trip instead of one per variable.
+        """
+        vars_to_query = list(vars_to_query)
+        request_ids = [self._send_query(var_to_query, query_timeout) for var_to_query in vars_to_query]
 
-        return from_json(response["value"])
+        try:
+            responses = [self._read_response(request_id) for request_id in request_ids]
+        finally:
+            # Don't keep responses that were never read if one of the reads failed
+            for request_id in request_ids:
+                self._pending_request_ids.discard(request_id)
+                self._received_responses.pop(request_id, None)
+
+        return [self._query_value(var_to_query, response) for var_to_query, response in zip(vars_to_query, responses, strict=True)]
 
-    def query_function_raw(self, function_name: str, *args, query_timeout: float = DEFAULT_TIMEOUT, **kwargs) -> StudentFunctionResponse:
+    def query_function_raw(
+        self,
+        function_name: str,
+        *args,
+        query_timeout: float = DEFAULT_TIMEOUT,
+        profile: bool = False,
+        trace_memory: bool = False,
+        **kwargs,
+    ) -> StudentFunctionResponse:
         """
         TODO add query timeout keyword only argument
+
+        With `profile=True`, the call is run under cProfile, and the student's slowest functions
+        are returned under "profile" and kept in `last_profile`, even if the call timed out.
+        With `trace_memory=True`, the call's allocations are traced with tracemalloc, and its
+        memory usage is returned under "memory" and kept in `last_memory_usage`.
         """
 
-        json_message = StudentFunctionRequest(
-            message_type="query_function",
-            function_name=function_name,
-            args_encoded=serialize_object_unsafe(args),
-            kwargs_encoded=serialize_object_unsafe(kwargs),
-            query_timeout=query_timeout,
-        )
+        json_message = self._function_request(function_name, args, kwargs, query_timeout, profile=profile, trace_memory=trace_memory)
+        response = self._send_function_request(json_message, query_timeout)
+        if profile:
+            self.last_profile = response.get("profile")
+        if trace_memory:
+            self.last_memory_usage = response.get("memory")
+
+        return response
 
+    def _send_function_request(self, json_message: StudentFunctionRequest, query_timeout: float) -> StudentFunctionResponse:
         assert self.student_socket is not None, "Student socket is not connected. Please start the student code server first."
-        self.student_socket.settimeout(query_timeout)
-        self.student_socket.sendall((json.dumps(json_message) + os.linesep).encode("utf-8"))
-        data: StudentFunctionResponse = json.loads(self._read_from_socket().decode())
+        self.student_socket.settimeout(query_timeout + RESPONSE_GRACE_PERIOD)
+        self._send_json_object(json_message)
+
+        try:
+            data: StudentFunctionResponse = self._read_response(json_message["request_id"])
+        except TimeoutError:
+            self._restart_after_timeout()
+            raise
+
+        if self._call_is_stuck(data):
+            self._restart_after_timeout()
 
         # Accumulate stdout from function calls for potential feedback inclusion
         if data.get("stdout"):
-            self._accumulated_stdout.append(data["stdout"])
+            self._accumulated_stdout.write(data["stdout"])
 
         return data
 
-    def query_function(self, function_name: str, *args, query_timeout: float = DEFAULT_TIMEOUT, **kwargs) -> Any:
-        """
-        Queries a function from the student code and returns its return value.
-        """
-        response = self.query_function_raw(function_name, *args, query_timeout=query_timeout, **kwargs)
-
+    @staticmethod
+    def _function_value(function_name: str, response: StudentFunctionResponse, query_timeout: float) -> Any:
         match response["status"]:
             case "exception":
                 raise RuntimeError(
@@ -354,28 +939,577 @@ class StudentFixture:
                 )
             case "timeout":
                 raise TimeoutError(f"Query for function '{function_name}' timed out after {query_timeout} seconds.")
+            case "skipped":
+                raise TimeoutError(f"Query for function '{function_name}' failed: {response['exception_message']}")
             case "not_found":
                 raise NameError(f"Query for function '{function_name}' failed: {response['exception_message']}")
 
         return from_json(response["value"])
 
+    def query_function(
+        self,
+        function_name: str,
+        *args,
+        query_timeout: float = DEFAULT_TIMEOUT,
+        profile: bool = False,
+        trace_memory: bool = False,
+        max_memory: int | None = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Queries a function from the student code and returns its return value. With
+        `profile=True`, the call is profiled and the profile is kept in `last_profile`. With
+        `trace_memory=True` or a `max_memory` in bytes, the call's memory usage is kept in
+        `last_memory_usage`, and an AssertionError is raised if its peak exceeds `max_memory`.
+        """
+        trace_memory = trace_memory or max_memory is not None
+        response = self.query_function_raw(
+            function_name, *args, query_timeout=query_timeout, profile=profile, trace_memory=trace_memory, **kwargs
+        )
+        value = self._function_value(function_name, response, query_timeout)
+        self._check_memory(function_name, response, max_memory)
+
+        return value
+
+    @staticmethod
+    def _check_memory(function_name: str, response: StudentFunctionResponse, max_memory: int | None) -> None:
+        if max_memory is None or (usage := response.get("memory")) is None or usage["peak"] <= max_memory:
+            return
+
+        message = (
+            f"Function '{function_name}' used up to {usage['peak'] / 1024**2:.2f} MB of memory, "
+            f"more than the limit of {max_memory / 1024**2:.2f} MB."
+        )
+        if usage["sites"]:
+            sites = ", ".join(f"line {site['line']} ({site['size'] / 1024**2:.2f} MB)" for site in usage["sites"])
+            message += f" The lines of your code holding the most memory after the call: {sites}."
+
+        raise AssertionError(message)
+
+    def benchmark_function_raw(
+        self,
+        function_name: str,
+        *args,
+        rounds: int = DEFAULT_BENCHMARK_ROUNDS,
+        warmup: int = 1,
+        disable_gc: bool = False,
+        query_timeout: float = DEFAULT_TIMEOUT,
+        **kwargs,
+    ) -> StudentFunctionResponse:
+        """
+        Times a function from the student code. The sandbox calls it `warmup` times without
+        timing it, and then `rounds` times while timing each call, so sending the request and
+        serializing the arguments and return value are not measured. `query_timeout` applies
+        to all of the calls together. If the call succeeds, the response has the timing
+        statistics under "benchmark", and the return value of the last call.
+        """
+        benchmark = self._benchmark_options(rounds, warmup, disable_gc)
+        json_message = self._function_request(function_name, args, kwargs, query_timeout, benchmark)
+
+        return self._send_function_request(json_message, query_timeout)
+
+    def benchmark_function(
+        self,
+        function_name: str,
+        *args,
+        rounds: int = DEFAULT_BENCHMARK_ROUNDS,
+        warmup: int = 1,
+        disable_gc: bool = False,
+        query_timeout: float = DEFAULT_TIMEOUT,
+        **kwargs,
+    ) -> BenchmarkStats:
+        """
+        Times a function from the student code (see `benchmark_function_raw`) and returns the
+        statistics of the timed calls, in seconds. Raises like `query_function` if a call failed.
+        """
+        response = self.benchmark_function_raw(
+            function_name, *args, rounds=rounds, warmup=warmup, disable_gc=disable_gc, query_timeout=query_timeout, **kwargs
+        )
+        self._function_value(function_name, response, query_timeout)
+
+        return response["benchmark"]
+
+    def compare_function_raw(
+        self,
+        function_name: str,
+        *args,
+        reference: str,
+        rounds: int = DEFAULT_BENCHMARK_ROUNDS,
+        max_rounds: int = 50,
+        warmup: int = 1,
+        tolerance: float = 0.05,
+        disable_gc: bool = False,
+        cpu: int | None = None,
+        query_timeout: float = DEFAULT_COMPARISON_TIMEOUT,
+        **kwargs,
+    ) -> StudentFunctionResponse:
+        """
+        Times a function from the student code against the `reference` function defined by the
+        setup code, on the same arguments and in the same sandbox. The two are called in turns,
+        in batches of `rounds` calls each, until the ratio of their median durations changes by
+        less than `tolerance` (relative) between batches, or `max_rounds` calls were timed.
+        If `cpu` is given, the calls are pinned to that CPU where the platform supports it.
+        `query_timeout` applies to all of the calls together. If the call succeeds, the response
+        has the statistics of the student function under "benchmark", and those of the reference
+        under "reference_benchmark".
+        """
+        benchmark = self._benchmark_options(rounds, warmup, disable_gc)
+        if max_rounds < rounds:
+            raise ValueError(f"max_rounds ({max_rounds}) can't be less than rounds ({rounds}).")
+
+        comparison = ComparisonOptions(reference=reference, max_rounds=max_rounds, tolerance=tolerance, cpu=cpu, **benchmark)
+        json_message = self._function_request(function_name, args, kwargs, query_timeout, comparison=comparison)
+
+        return self._send_function_request(json_message, query_timeout)
+
+    def compare_function(self, function_name: str, *args, reference: str, **kwargs) -> PerformanceComparison:
+        """
+        Times a function from the student code against a reference function (see
+        `compare_function_raw`, which takes the same keyword arguments). Raises like
+        `query_function` if a call failed.
+        """
+        query_timeout = kwargs.get("query_timeout", DEFAULT_COMPARISON_TIMEOUT)
+        response = self.compare_function_raw(function_name, *args, reference=reference, **kwargs)
+        self._function_value(function_name, response, query_timeout)
+
+        student, reference_stats = response["benchmark"], response["reference_benchmark"]
+        # Calls faster than the clock's resolution can take no time at all
+        if student["median"] <= 0 or reference_stats["median"] <= 0:
+            raise RuntimeError(
+                f"Could not time '{function_name}' against '{reference}', a median call took no measurable time. "
+                "Use larger inputs so that each call takes longer."
+            )
+
+        return {
+            "function_name": function_name,
+            "reference": reference,
+            "student": student,
+            "reference_stats": reference_stats,
+            "ratio": student["median"] / reference_stats["median"],
+        }
+
+    def measure_scaling(
+        self,
+        function_name: str,
+        input_generator: str,
+        sizes: Iterable[int],
+        *,
+        rounds: int = 3,
+        disable_gc: bool = False,
+        query_timeout: float = DEFAULT_COMPARISON_TIMEOUT,
+    ) -> ScalingFit:
+        """
+        Measures how the running time of a function from the student code grows with the size
+        of its input, and fits it to the complexity classes in `COMPLEXITY_CLASSES`.
+        `input_generator` is the name of a function defined by the setup code, which takes a
+        size and returns the arguments for that size (a tuple, or a single argument). The
+        inputs are generated inside the sandbox, so they are never sent over the socket. Each
+        size is timed `rounds` times and the fastest call counts. `query_timeout` applies to
+        all of the calls together. Raises like `query_function` if a call failed.
+
+        Sizes should grow geometrically (e.g. doubling) and be large enough that each call
+        takes well over a millisecond, so that the fit isn't dominated by noise.
+        """
+        sizes = list(sizes)
+        if len(sizes) < 3 or any(size < 1 for size in sizes):
+            raise ValueError(f"Measuring scaling needs at least three positive sizes, got {sizes}.")
+        if rounds < 1:
+            raise ValueError(f"Measuring scaling needs at least one round, got {rounds}.")
+
+        scaling = ScalingOptions(generator=input_generator, sizes=sizes, rounds=rounds, disable_gc=disable_gc)
+        json_message = self._function_request(function_name, (), {}, query_timeout, scaling=scaling)
+        response = self._send_function_request(json_message, query_timeout)
+        self._function_value(function_name, response, query_timeout)
+
+        return fit_complexity(sizes, response["scaling"])
+
+    def map_function_raw(
+        self,
+        function_name: str,
+        args_list: Iterable[Sequence[Any]],
+        *,
+        per_call_timeout: float = DEFAULT_TIMEOUT,
+        total_timeout: float | None = None,
+        trace_memory: bool = False,
+    ) -> list[StudentFunctionResponse]:
+        """
+        Calls a function from the student code once for each tuple of positional arguments
+        in `args_list`, in a single round trip. Returns one response per call, in order.
+        Calls that would start after `total_timeout` seconds are skipped and reported as timed out.
+        With `trace_memory=True`, the memory usage of each call is traced separately (see
+        `query_function_raw`), and `last_memory_usage` is that of the call with the highest peak.
+        """
+        self._ensure_started()
+        self._assert_process_running()
+
+        args_list = [tuple(args) for args in args_list]
+        json_message = StudentFunctionMapRequest(
+            message_type="map_function",
+            request_ids=[self._new_streamed_request_id() for _ in args_list],
+            function_name=function_name,
+            args_list_encoded=serialize_object_unsafe(args_list),
+            per_call_timeout=per_call_timeout,
+            total_timeout=total_timeout,
+            stream_output=self.output_callback is not None,
+        )
+        if trace_memory:
+            json_message["memory"] = MEMORY_TOP_SITES
+
+        assert self.student_socket is not None, "Student socket is not connected. Please start the student code server first."
+        # Each call's response is sent as soon as it finishes, so only wait for one call at a time
+        self.student_socket.settimeout(per_call_timeout + RESPONSE_GRACE_PERIOD)
+        self._send_json_object(json_message)
+
+        responses: list[StudentFunctionResponse] = []
+        try:
+            for request_id in json_message["request_ids"]:
+                response: StudentFunctionResponse = self._read_response(request_id)
+
+                # Accumulate stdout from function calls for potential feedback inclusion
+                if response.get("stdout"):
+                    self._accumulated_stdout.write(response["stdout"])
+
+                responses.append(response)
+        except TimeoutError:
+            self._restart_after_timeout()
+            raise
+        finally:
+            # Don't keep waiting for the rest of the batch if one of the reads failed
+            for request_id in json_message["request_ids"]:
+                self._pending_request_ids.discard(request_id)
+                self._received_responses.pop(request_id, None)
+                self._streamed_output.pop(request_id, None)
+
+        if any(self._call_is_stuck(response) for response in responses):
+            self._restart_after_timeout()
+
+        if trace_memory:
+            usages = [usage for response in responses if (usage := response.get("memory")) is not None]
+            self.last_memory_usage = max(usages, key=lambda usage: usage["peak"], default=None)
+
+        return responses
+
+    def map_function(
+        self,
+        function_name: str,
+        args_list: Iterable[Sequence[Any]],
+        *,
+        per_call_timeout: float = DEFAULT_TIMEOUT,
+        total_timeout: float | None = None,
+        trace_memory: bool = False,
+        max_memory: int | None = None,
+    ) -> list[Any]:
+        """
+        Calls a function from the student code once for each tuple of positional arguments
+        in `args_list` and returns the return values in order. Raises for the first call that
+        failed, like `query_function`, or whose peak memory exceeded `max_memory` bytes.
+        """
+        responses = self.map_function_raw(
+            function_name,
+            args_list,
+            per_call_timeout=per_call_timeout,
+            total_timeout=total_timeout,
+            trace_memory=trace_memory or max_memory is not None,
+        )
+
+        values = []
+        for response in responses:
+            values.append(self._function_value(function_name, response, per_call_timeout))
+            self._check_memory(function_name, response, max_memory)
+
+        return values
+
     def get_accumulated_stdout(self) -> str:
         """
         Returns the accumulated stdout from all function calls made through this fixture.
+        Output beyond `output_limit` characters is left out of the middle.
         """
-        return "".join(self._accumulated_stdout)
+        return self._accumulated_stdout.getvalue()
 
     # TODO add functions that let instructors use the student fixture
     # use the stuff pete set up here: https://github.com/reteps/pytest-autograder-prototype
+    @staticmethod
+    def _call_is_stuck(response: StudentFunctionResponse) -> bool:
+        """
+        Whether a function call timed out and could not be interrupted by the server.
+        """
+        return response["status"] == FunctionStatusCode.TIMEOUT and not response.get("interrupted", False)
+
+    def _restart_after_timeout(self) -> None:
+        """
+        Replaces the student code server after a function call timed out and could not be
+        interrupted. The call is still running on the server's only worker thread and would
+        hold up every later call, so the server is killed and the student code is initialized
+        again in a new one. The same goes for a read that timed out partway through a response,
+        which leaves the connection unusable. State built up by earlier calls is lost, and
+        initialization output is not collected a second time.
+        """
+        restart = self._restart
+        if restart is None:
+            return
+
+        logger.debug("Request timed out, restarting the student code server")
+
+        if self.student_socket is not None:
+            self.student_socket.close()
+            self.student_socket = None
+            self._frame_reader = None
+
+        if self.process is not None:
+            self.process.kill()
+            self._collect_resource_usage()
+
+        # Requests sent to the old server will never be answered
+        self._pending_request_ids.clear()
+        self._received_responses.clear()
+        self._streamed_output.clear()
+
+        # Output from initializing the student code again is not kept
+        accumulated_stdout = self._accumulated_stdout
+        self._accumulated_stdout = BoundedOutput(self.output_limit)
+        try:
+            res = restart()
+        except Exception as e:
+            logger.warning(f"Failed to restart the student code server after a timeout: {e}")
+            self._cleanup()
+            return
+        finally:
+            self._accumulated_stdout = accumulated_stdout
+
+        if res["status"] != ProcessStatusCode.SUCCESS:
+            logger.warning(f"Student code failed to initialize again after a timeout: {res['status']}")
+            self._cleanup()
+
     def _cleanup(self) -> None:
         if self.student_socket is not None:
             self.student_socket.close()
             self.student_socket = None
+            self._frame_reader = None
 
         if self.process is not None:
             self.process.terminate()
-            self.process.wait()
-            self.process = None
+            self._collect_resource_usage()
+
+    def _collect_resource_usage(self) -> None:
+        """
+        Waits for the stopped student code server to exit and adds the resources it used
+        (apart from its startup) to `resource_usage`.
+        """
+        assert self.process is not None
+
+        usage = wait_for_resource_usage(self.process)
+        self.process = None
+
+        if usage is not None and self._startup_usage is not None:
+            usage = resource_usage_since(usage, self._startup_usage)
+
+        if usage is not None:
+            self.resource_usage = usage if self.resource_usage is None else add_resource_usage(self.resource_usage, usage)
+
+    def sample_resource_usage(self) -> ResourceUsage | None:
+        """
+        Returns the resources used by the student code server since the previous sample
+        (or since it started) without stopping it, so a long-lived sandbox can be accounted
+        per test. Returns None if the usage of a running process can't be read on this
+        platform, or if the server is not running.
+        """
+        if self.process is None:
+            return None
+
+        current = read_process_resource_usage(self.process.pid)
+        if current is None:
+            return None
+
+        if self._startup_usage is not None:
+            current = resource_usage_since(current, self._startup_usage)
+
+        if self.resource_usage is not None:
+            # Include servers that were replaced after a timeout
+            current = add_resource_usage(self.resource_usage, current)
+
+        previous, self._last_usage_sample = self._last_usage_sample, current
+        return current if previous is None else resource_usage_since(current, previous)
 
     def __repr__(self) -> str:
         return f"StudentFixture(leading_file={self.leading_file}, trailing_file={self.trailing_file}, student_code_file={self.student_code_file})"
+
+
+class AsyncStudentFixture:
+    """
+    An asyncio client for a started `StudentFixture`. It uses the same connection and
+    protocol, but waits for responses without blocking the event loop, so calls to
+    different sandboxes can run concurrently (e.g. with `asyncio.gather`). Calls to the
+    same sandbox are still sent one at a time.
+    """
+
+    fixture: StudentFixture
+    _lock: asyncio.Lock
+
+    def __init__(self, fixture: StudentFixture) -> None:
+        self.fixture = fixture
+        self._lock = asyncio.Lock()
+
+    async def _request(self, json_message: StudentQueryRequest | StudentFunctionRequest | SetupQueryRequest, timeout: float | None) -> Any:
+        is_function_call = json_message["message_type"] == "query_function"
+
+        async with self._lock:
+            try:
+                response = await self._exchange(json_message, timeout)
+            except TimeoutError:
+                if is_function_call:
+                    await asyncio.to_thread(self.fixture._restart_after_timeout)
+                raise
+
+            if is_function_call and self.fixture._call_is_stuck(response):
+                await asyncio.to_thread(self.fixture._restart_after_timeout)
+
+        return response
+
+    async def _exchange(self, json_message: StudentQueryRequest | StudentFunctionRequest | SetupQueryRequest, timeout: float | None) -> Any:
+        fixture = self.fixture
+        student_socket = fixture.student_socket
+        frame_reader = fixture._frame_reader
+        assert student_socket is not None, "Student socket is not connected. Please start the student code server first."
+        assert frame_reader is not None
+
+        request_id = json_message["request_id"]
+        loop = asyncio.get_running_loop()
+
+        # The socket is shared with the synchronous client, so restore its mode afterwards
+        previous_timeout = student_socket.gettimeout()
+        student_socket.setblocking(False)
+
+        try:
+            await loop.sock_sendall(student_socket, encode_json_frame(json_message))
+
+            async with asyncio.timeout(timeout):
+                while request_id not in fixture._received_responses:
+                    frame_type, payload = await frame_reader.read_async()
+
+                    if frame_type != FrameType.JSON:
+                        raise RuntimeError(f"Unexpected frame type {frame_type} from student code server.")
+
+                    fixture._store_response(payload)
+        except TimeoutError as e:
+            raise TimeoutError("Socket read timed out.") from e
+        except ConnectionError as e:
+            if (error := await asyncio.to_thread(fixture._connection_lost_error)) is not None:
+                raise error from e
+            raise
+        finally:
+            fixture._pending_request_ids.discard(request_id)
+            student_socket.settimeout(previous_timeout)
+
+        return fixture._received_responses.pop(request_id)
+
+    async def query_setup_raw(self, var_to_query: str) -> SetupQueryResponse:
+        return await self._request(self.fixture._setup_query_request(var_to_query), None)
+
+    async def query_setup(self, var_to_query: str) -> Any:
+        """
+        Queries a variable from the setup code and returns its value.
+        """
+        return self.fixture._setup_value(var_to_query, await self.query_setup_raw(var_to_query))
+
+    async def query_raw(self, var_to_query: str, *, query_timeout: float = DEFAULT_TIMEOUT) -> StudentQueryResponse:
+        return await self._request(self.fixture._query_request(var_to_query, query_timeout), query_timeout)
+
+    async def query(self, var_to_query: str, *, query_timeout: float = DEFAULT_TIMEOUT) -> Any:
+        """
+        Queries a variable from the student code and returns its value.
+        """
+        return self.fixture._query_value(var_to_query, await self.query_raw(var_to_query, query_timeout=query_timeout))
+
+    async def query_function_raw(
+        self,
+        function_name: str,
+        *args,
+        query_timeout: float = DEFAULT_TIMEOUT,
+        profile: bool = False,
+        trace_memory: bool = False,
+        **kwargs,
+    ) -> StudentFunctionResponse:
+        json_message = self.fixture._function_request(
+            function_name, args, kwargs, query_timeout, profile=profile, trace_memory=trace_memory
+        )
+        data: StudentFunctionResponse = await self._request(json_message, query_timeout + RESPONSE_GRACE_PERIOD)
+        if profile:
+            self.fixture.last_profile = data.get("profile")
+        if trace_memory:
+            self.fixture.last_memory_usage = data.get("memory")
+
+        # Accumulate stdout from function calls for potential feedback inclusion
+        if data.get("stdout"):
+            self.fixture._accumulated_stdout.write(data["stdout"])
+
+        return data
+
+    async def query_function(
+        self,
+        function_name: str,
+        *args,
+        query_timeout: float = DEFAULT_TIMEOUT,
+        profile: bool = False,
+        trace_memory: bool = False,
+        max_memory: int | None = None,
+        **kwargs,
+    ) -> Any:
+        """
+        Queries a function from the student code and returns its return value.
+        """
+        trace_memory = trace_memory or max_memory is not None
+        response = await self.query_function_raw(
+            function_name, *args, query_timeout=query_timeout, profile=profile, trace_memory=trace_memory, **kwargs
+        )
+        value = self.fixture._function_value(function_name, response, query_timeout)
+        self.fixture._check_memory(function_name, response, max_memory)
+
+        return value
+
+    async def benchmark_function_raw(
+        self,
+        function_name: str,
+        *args,
+        rounds: int = DEFAULT_BENCHMARK_ROUNDS,
+        warmup: int = 1,
+        disable_gc: bool = False,
+        query_timeout: float = DEFAULT_TIMEOUT,
+        **kwargs,
+    ) -> StudentFunctionResponse:
+        benchmark = self.fixture._benchmark_options(rounds, warmup, disable_gc)
+        json_message = self.fixture._function_request(function_name, args, kwargs, query_timeout, benchmark)
+        data: StudentFunctionResponse = await self._request(json_message, query_timeout + RESPONSE_GRACE_PERIOD)
+
+        if data.get("stdout"):
+            self.fixture._accumulated_stdout.write(data["stdout"])
+
+        return data
+
+    async def benchmark_function(
+        self,
+        function_name: str,
+        *args,
+        rounds: int = DEFAULT_BENCHMARK_ROUNDS,
+        warmup: int = 1,
+        disable_gc: bool = False,
+        query_timeout: float = DEFAULT_TIMEOUT,
+        **kwargs,
+    ) -> BenchmarkStats:
+        """
+        Times a function from the student code and returns the statistics of the timed calls.
+        """
+        response = await self.benchmark_function_raw(
+            function_name, *args, rounds=rounds, warmup=warmup, disable_gc=disable_gc, query_timeout=query_timeout, **kwargs
+        )
+        self.fixture._function_value(function_name, response, query_timeout)
+
+        return response["benchmark"]
+
+    def get_accumulated_stdout(self) -> str:
+        """
+        Returns the accumulated stdout from all function calls made through this fixture.
+        """
+        return self.fixture.get_accumulated_stdout()
+
+    def __repr__(self) -> str:
+        return f"AsyncStudentFixture({self.fixture!r})"
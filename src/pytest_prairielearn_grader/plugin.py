@@ -1,9 +1,11 @@
+import asyncio
+import functools
+import inspect
 import json
 import logging
 import os
 import sys
 from collections.abc import Iterable
-from copy import deepcopy
 from pathlib import Path
 from types import ModuleType
 from typing import Any
@@ -17,13 +19,26 @@ import pytest
 from _pytest.config import Config
 from prettytable import PrettyTable
 
+from .code_cache import CompiledCodeCache
+from .fixture import AsyncStudentFixture
 from .fixture import FeedbackFixture
+from .fixture import PerformanceFixture
+from .fixture import SandboxSnapshot
 from .fixture import StudentFiles
 from .fixture import StudentFixture
+from .pool import DEFAULT_POOL_SIZE
+from .pool import ForkServer
+from .pool import RunnerLauncher
+from .pool import SandboxPool
+from .pool import spawn_runner_process
+from .shared_params import SharedParamStore
+from .utils import DEFAULT_OUTPUT_LIMIT
 from .utils import GradingOutputLevel
 from .utils import NamesForUserInfo
 from .utils import ProcessStartResponse
 from .utils import ProcessStatusCode
+from .utils import ResourceLimits
+from .utils import ResourceUsage
 from .utils import get_output_level_marker
 
 logger = logging.getLogger(__name__)
@@ -39,6 +54,9 @@ class TestResult(NamedTuple):
     report: _pytest.reports.TestReport
     call: pytest.CallInfo
     stdout: str
+    # The phase the result is graded as, which differs from `report.when` for a lazily
+    # started sandbox that failed to start during the call
+    when: str
 
 
 def get_datadir(test_module: ModuleType) -> Path | None:
@@ -117,8 +135,15 @@ def _initialize_sandbox_fixture(
     builtin_whitelist = params_dict.get("builtin_whitelist")
     names_for_user_list = cast(list[NamesForUserInfo] | None, params_dict.get("names_for_user"))
 
+    # Large arrays are mapped by each sandbox from a shared file if the test module opted in with
+    # `sandbox_shared_params = True`. The params are only sent as JSON, so no deep copy is needed.
+    sandbox_params = params_dict
+    if data_json is not None and getattr(request.module, "sandbox_shared_params", False):
+        plugin = request.config.result_collector_plugin  # type: ignore[attr-defined]
+        sandbox_params = plugin.shared_params.share_params(request.module.__name__, params_dict)
+
     starting_vars: dict[str, Any] = {
-        "__data_params": deepcopy(params_dict) if data_json is not None else {},
+        "__data_params": dict(sandbox_params) if data_json is not None else {},
     }
 
     if names_for_user_list is not None:
@@ -132,7 +157,7 @@ def _initialize_sandbox_fixture(
             if variable_type != expected_variable_type and value is not None:
                 logger.warning(f"Variable type mismatch for starting var {name}: expected {expected_variable_type}, got {variable_type}")
 
-            starting_vars[name] = value
+            starting_vars[name] = sandbox_params.get(name, None)
 
     # Check for module-level timeout variable (works for module-scoped fixtures)
     # This allows setting: sandbox_timeout = 0.5 at module level
@@ -146,6 +171,8 @@ def _initialize_sandbox_fixture(
         initialization_timeout = marker.args[0]
         logger.debug(f"Using test-specific timeout override: {initialization_timeout}s")
 
+    resource_limits = _get_resource_limits(request, params_dict)
+
     fixture = StudentFixture(
         file_names=file_names,
         import_whitelist=import_whitelist,
@@ -154,11 +181,47 @@ def _initialize_sandbox_fixture(
         builtin_whitelist=builtin_whitelist,
         names_for_user_list=names_for_user_list,
         worker_username=request.config.getoption("--worker-username"),
+        sandbox_launcher=request.config.result_collector_plugin.sandbox_launcher,  # type: ignore[attr-defined]
+        resource_limits=resource_limits,
+        code_cache=request.config.result_collector_plugin.code_cache,  # type: ignore[attr-defined]
+        # 0 keeps all output
+        output_limit=request.config.getoption("--sandbox-output-limit") or None,
+        collect_coverage=request.config.getoption("--sandbox-coverage"),
     )
+    fixture.shared_setup_vars = _get_shared_setup_vars(request, fixture, initialization_timeout)
 
     return fixture, initialization_timeout
 
 
+def _get_resource_limits(request: pytest.FixtureRequest, params_dict: dict[str, Any]) -> ResourceLimits | None:
+    """
+    Collects the resource limits for a sandbox. Limits from data.json params are overridden by
+    a module-level `sandbox_resource_limits` dict, which is overridden by the `sandbox_resource_limits`
+    marker. Returns None if no limits are set.
+    """
+    limits: dict[str, Any] = dict(params_dict.get("resource_limits", {}))
+
+    if hasattr(request, "module") and hasattr(request.module, "sandbox_resource_limits"):
+        limits.update(request.module.sandbox_resource_limits)
+
+    marker = request.node.get_closest_marker("sandbox_resource_limits")
+    if marker:
+        limits.update(marker.kwargs)
+
+    if not limits:
+        return None
+
+    if unknown_limits := limits.keys() - ResourceLimits.__optional_keys__:
+        raise ValueError(f"Unknown sandbox resource limits: {sorted(unknown_limits)}")
+
+    if sys.platform == "win32":
+        logger.warning("Sandbox resource limits are not supported on Windows and will be ignored")
+        return None
+
+    logger.debug(f"Using sandbox resource limits: {limits}")
+    return cast(ResourceLimits, limits)
+
+
 def _handle_sandbox_startup_errors(
     request: pytest.FixtureRequest,
     response: ProcessStartResponse,
@@ -196,41 +259,170 @@ def _handle_sandbox_startup_errors(
     elif response_status == ProcessStatusCode.TIMEOUT:
         pytest.fail("Student code initialization timed out", pytrace=False)
 
+    elif response_status == ProcessStatusCode.RESOURCE_LIMIT:
+        fail_message = "Student code exceeded a resource limit"
+        if exception_name := response.get("execution_error"):
+            fail_message += f": {exception_name}"
+
+        pytest.fail(fail_message, pytrace=False)
+
     elif response_status == ProcessStatusCode.NO_RESPONSE:
-        pytest.fail(f"No response from initialization with timeout {initialization_timeout}", pytrace=False)
+        fail_message = f"No response from initialization with timeout {initialization_timeout}"
+        # The output of a sandbox that died, e.g. the traceback of a crash
+        if process_output := response.get("stderr", "").strip():
+            fail_message += f"{os.linesep * 2}Output of the student code server:{os.linesep}{process_output}"
+
+        pytest.fail(fail_message, pytrace=False)
 
     elif response_status != ProcessStatusCode.SUCCESS:
         logger.warning(f"Unexpected status in response from student code server: {response}")
         pytest.fail(f"Unexpected status from student code server: {response_status}", pytrace=False)
 
 
+def _get_sandbox_snapshot(request: pytest.FixtureRequest, fixture: StudentFixture, initialization_timeout: int) -> SandboxSnapshot | None:
+    """
+    Returns the snapshot to start the sandbox from if the test module opted in with
+    `sandbox_snapshot = True`, creating it on first use. Returns None otherwise.
+    """
+    if not getattr(request.module, "sandbox_snapshot", False):
+        return None
+
+    if sys.platform == "win32":
+        logger.warning("Sandbox snapshots are not supported on Windows, initializing each sandbox separately")
+        return None
+
+    plugin = request.config.result_collector_plugin  # type: ignore[attr-defined]
+    resource_limits = tuple(sorted((fixture.resource_limits or {}).items()))
+    cache_key = (request.module.__name__, str(fixture.student_code_file), initialization_timeout, resource_limits)
+
+    if cache_key not in plugin.sandbox_snapshots:
+        logger.debug(f"Creating sandbox snapshot for {cache_key}")
+        plugin.sandbox_snapshots[cache_key] = fixture.create_snapshot(initialization_timeout=initialization_timeout)
+
+    return plugin.sandbox_snapshots[cache_key]
+
+
+def _get_shared_setup_vars(request: pytest.FixtureRequest, fixture: StudentFixture, initialization_timeout: int) -> str | None:
+    """
+    Returns the variables from running the setup code once for the whole test module if it
+    opted in with `sandbox_shared_setup = True`, running it on first use. Returns None otherwise,
+    or if the setup code could not be shared.
+    """
+    if not getattr(request.module, "sandbox_shared_setup", False):
+        return None
+
+    plugin = request.config.result_collector_plugin  # type: ignore[attr-defined]
+    resource_limits = tuple(sorted((fixture.resource_limits or {}).items()))
+    cache_key = (request.module.__name__, str(fixture.setup_code_file), initialization_timeout, resource_limits)
+
+    if cache_key not in plugin.shared_setups:
+        logger.debug(f"Running shared setup code for {cache_key}")
+        plugin.shared_setups[cache_key] = fixture.create_shared_setup(initialization_timeout=initialization_timeout)
+
+    return plugin.shared_setups[cache_key]
+
+
+def _record_startup_timings(request: pytest.FixtureRequest, fixture: StudentFixture) -> None:
+    """
+    Records how long each phase of starting the fixture's sandbox took against the test
+    that started it, for the timings in the results file. Phases that a sandbox pool ran in
+    the background are recorded apart, since they didn't add to the test's run time.
+    """
+    plugin = request.config.result_collector_plugin  # type: ignore[attr-defined]
+    plugin.startup_timings[request.node.nodeid] = dict(fixture.startup_timings)
+    if fixture.pool_startup_timings:
+        plugin.pool_startup_timings[request.node.nodeid] = dict(fixture.pool_startup_timings)
+
+
+def _record_resource_usage(request: pytest.FixtureRequest, usage: ResourceUsage | None) -> None:
+    """
+    Records the resources the student code used during a test, for the results file.
+    """
+    if usage is not None:
+        plugin = request.config.result_collector_plugin  # type: ignore[attr-defined]
+        plugin.resource_usage[request.node.nodeid] = usage
+
+
+def _record_covered_lines(request: pytest.FixtureRequest, fixture: StudentFixture) -> None:
+    """
+    Records the lines of the student code that ran during a test, for the results file.
+    """
+    if fixture.collect_coverage:
+        plugin = request.config.result_collector_plugin  # type: ignore[attr-defined]
+        plugin.covered_lines[request.node.nodeid] = fixture.sample_covered_lines()
+
+
+def _start_sandbox(request: pytest.FixtureRequest, fixture: StudentFixture, initialization_timeout: int) -> None:
+    """
+    Starts a sandbox server, from a snapshot if the test module asked for one, and fails
+    the test if the student code could not be initialized.
+    """
+    snapshot = _get_sandbox_snapshot(request, fixture, initialization_timeout)
+
+    # TODO make sure to read student output and include in the exception message
+    # TODO also get this configuration by reading from the marker
+    logger.debug(f"Starting sandbox for {request.node.nodeid} with timeout {initialization_timeout}s")
+    try:
+        if snapshot is not None:
+            response = fixture.start_from_snapshot(snapshot)
+        else:
+            response = fixture.start_student_code_server(initialization_timeout=initialization_timeout)
+    finally:
+        _record_startup_timings(request, fixture)
+    _handle_sandbox_startup_errors(request, response, initialization_timeout)
+    logger.debug(f"Sandbox started successfully for {request.node.nodeid}")
+
+
+def _use_lazy_start(request: pytest.FixtureRequest) -> bool:
+    """
+    Whether to start the sandbox on its first query instead of before the test. A module-level
+    `sandbox_lazy_start` variable overrides the `--sandbox-lazy-start` command line option.
+    """
+    if hasattr(request, "module") and hasattr(request.module, "sandbox_lazy_start"):
+        return bool(request.module.sandbox_lazy_start)
+
+    return bool(request.config.getoption("--sandbox-lazy-start"))
+
+
 def _start_and_yield_sandbox(
     request: pytest.FixtureRequest,
     fixture: StudentFixture,
     initialization_timeout: int,
+    lazy: bool = False,
 ) -> Iterable[StudentFixture]:
     """
     Common logic to start a sandbox server and yield the fixture.
     Handles cleanup in the finally block.
     """
     try:
-        # TODO make sure to read student output and include in the exception message
-        # TODO also get this configuration by reading from the marker
-        logger.debug(f"Starting sandbox for {request.node.nodeid} with timeout {initialization_timeout}s")
-        response = fixture.start_student_code_server(initialization_timeout=initialization_timeout)
-        _handle_sandbox_startup_errors(request, response, initialization_timeout)
-        logger.debug(f"Sandbox started successfully for {request.node.nodeid}")
+        if lazy:
+            plugin = request.config.result_collector_plugin  # type: ignore[attr-defined]
+
+            def start() -> None:
+                try:
+                    _start_sandbox(request, fixture, initialization_timeout)
+                except BaseException:
+                    # Report this like the setup failure it would have been without lazy startup
+                    plugin.lazy_startup_failures.add(request.node.nodeid)
+                    raise
+
+            logger.debug(f"Deferring sandbox startup for {request.node.nodeid} until its first query")
+            fixture.defer_start(start)
+        else:
+            _start_sandbox(request, fixture, initialization_timeout)
 
         yield fixture
     finally:
         logger.debug(f"Cleaning up sandbox for {request.node.nodeid}")
         fixture._cleanup()
+        _record_resource_usage(request, fixture.resource_usage)
+        _record_covered_lines(request, fixture)
 
 
 @pytest.fixture
 def sandbox(request: pytest.FixtureRequest, data_json: dict[str, Any] | None) -> Iterable[StudentFixture]:
     fixture, initialization_timeout = _initialize_sandbox_fixture(request, data_json, request.param)
-    yield from _start_and_yield_sandbox(request, fixture, initialization_timeout)
+    yield from _start_and_yield_sandbox(request, fixture, initialization_timeout, lazy=_use_lazy_start(request))
 
 
 def _find_student_files(module: ModuleType) -> list[StudentFiles]:
@@ -322,7 +514,11 @@ def module_sandbox(request: pytest.FixtureRequest, data_json: dict[str, Any] | N
         fixture, initialization_timeout = _initialize_sandbox_fixture(request, data_json, student_files)
 
         try:
-            response = fixture.start_student_code_server(initialization_timeout=initialization_timeout)
+            try:
+                response = fixture.start_student_code_server(initialization_timeout=initialization_timeout)
+            finally:
+                # Only the first test using the module sandbox pays for starting it
+                _record_startup_timings(request, fixture)
             _handle_sandbox_startup_errors(request, response, initialization_timeout)
 
             # Cache the fixture for reuse within this module
@@ -345,6 +541,47 @@ def module_sandbox(request: pytest.FixtureRequest, data_json: dict[str, Any] | N
     # Note: We don't cleanup here - cleanup happens at module teardown via pytest_sessionfinish
 
 
+@pytest.fixture
+def async_sandbox(sandbox: StudentFixture) -> AsyncStudentFixture:
+    """
+    Asyncio client for the `sandbox` fixture, for use in `async def` tests. Awaiting calls
+    on several sandboxes at once (e.g. with `asyncio.gather`) lets them run concurrently.
+    """
+    return AsyncStudentFixture(sandbox)
+
+
+@pytest.fixture
+def async_module_sandbox(module_sandbox: StudentFixture) -> AsyncStudentFixture:
+    """
+    Asyncio client for the `module_sandbox` fixture, for use in `async def` tests.
+    """
+    # A new client for each test, since each async test runs in its own event loop
+    return AsyncStudentFixture(module_sandbox)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem: pytest.Function) -> bool | None:
+    """
+    Runs `async def` tests that use an async sandbox fixture in a new event loop, so those
+    fixtures can be used without installing an async plugin. Other async tests, and tests
+    marked for pytest-asyncio or anyio, are left to those plugins.
+    """
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+
+    if not {"async_sandbox", "async_module_sandbox"}.intersection(pyfuncitem.fixturenames):
+        return None
+
+    if pyfuncitem.get_closest_marker("asyncio") is not None or pyfuncitem.get_closest_marker("anyio") is not None:
+        return None
+
+    # Fixtures that are only used (e.g. autouse fixtures) are not arguments of the test
+    parameters = inspect.signature(pyfuncitem.obj).parameters
+    test_args = {name: pyfuncitem.funcargs[name] for name in pyfuncitem.fixturenames if name in parameters}
+    asyncio.run(pyfuncitem.obj(**test_args))
+    return True
+
+
 def pytest_generate_tests(metafunc: pytest.Metafunc) -> None:
     """
     Generate parameterized tests for sandbox and parameterized_module_sandbox fixtures.
@@ -379,6 +616,64 @@ def pytest_addoption(parser: pytest.Parser) -> None:
         help="The username for the user of the worker process.",
     )
 
+    group.addoption(
+        "--sandbox-pool-size",
+        action="store",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help="Number of pre-started sandbox processes to keep ready for new tests. Set to 0 to start every sandbox on demand.",
+    )
+
+    group.addoption(
+        "--sandbox-lazy-start",
+        action="store_true",
+        default=False,
+        help="Start each test's sandbox on its first query instead of before the test runs.",
+    )
+
+    group.addoption(
+        "--sandbox-start-method",
+        action="store",
+        choices=("spawn", "forkserver"),
+        default="spawn",
+        help=(
+            "How sandbox processes are started. 'spawn' starts a new interpreter for each sandbox, "
+            "'forkserver' forks each sandbox from a single process that has already imported its dependencies (Unix only)."
+        ),
+    )
+
+    group.addoption(
+        "--sandbox-code-cache",
+        action="store",
+        choices=("off", "memory", "disk"),
+        default="memory",
+        help=(
+            "Where compiled setup and student code is cached, so sandboxes don't compile the same code for every test. "
+            "'memory' keeps it for the session, 'disk' also keeps it in pytest's cache directory for later sessions."
+        ),
+    )
+
+    group.addoption(
+        "--sandbox-coverage",
+        action="store_true",
+        default=False,
+        help=(
+            "Record which lines of the student code each test ran, and add them to the results as 'covered_lines'. "
+            "Uses sys.monitoring, so it needs Python 3.12 or newer."
+        ),
+    )
+
+    group.addoption(
+        "--sandbox-output-limit",
+        action="store",
+        type=int,
+        default=DEFAULT_OUTPUT_LIMIT,
+        help=(
+            "How many characters of stdout and stderr to keep from the student code, for each call and for each test's feedback. "
+            "Output beyond the limit is left out of the middle. Set to 0 to keep all output."
+        ),
+    )
+
 
 def _win32_longpath(path):
     """
@@ -436,26 +731,105 @@ def pytest_configure(config: Config) -> None:
 
     # Add a marker for the sandbox fixture to set the initialization timeout
     config.addinivalue_line("markers", "sandbox_timeout(timeout_value): sets a timeout for initialization of the sandbox fixture")
+    config.addinivalue_line(
+        "markers",
+        "sandbox_resource_limits(memory_mb, cpu_seconds, processes, file_size_mb): sets resource limits for the sandbox fixture",
+    )
+    config.addinivalue_line(
+        "markers",
+        "performance(reference, target_ratio=1.0, points=None, **options): "
+        "grades the speed of student functions compared through the performance fixture against a reference function",
+    )
 
     # Only register our plugin if it hasn't been already (e.g., in case of multiple conftests)
     if not hasattr(config, "result_collector_plugin"):
-        config.result_collector_plugin = ResultCollectorPlugin()  # type: ignore[attr-defined]
+        worker_username = config.getoption("--worker-username")
+
+        fork_server = None
+        launcher: RunnerLauncher
+        if config.getoption("--sandbox-start-method") == "forkserver":
+            if sys.platform == "win32":
+                raise pytest.UsageError("The 'forkserver' sandbox start method is not supported on Windows.")
+
+            fork_server = ForkServer(worker_username)
+            launcher = fork_server.spawn
+        else:
+            launcher = functools.partial(spawn_runner_process, worker_username)
+
+        pool_size = config.getoption("--sandbox-pool-size")
+        sandbox_pool = SandboxPool(pool_size, launcher) if pool_size > 0 else None
+
+        code_cache = None
+        code_cache_mode = config.getoption("--sandbox-code-cache")
+        if code_cache_mode != "off":
+            cache_dir = None
+            # The cache directory is missing if the cacheprovider plugin is disabled
+            if code_cache_mode == "disk" and hasattr(config, "cache"):
+                cache_dir = config.cache.mkdir("pl_autograder_compiled_code")
+            code_cache = CompiledCodeCache(cache_dir)
+
+        if config.getoption("--sandbox-coverage") and not hasattr(sys, "monitoring"):
+            logger.warning("--sandbox-coverage needs Python 3.12 or newer, no line coverage will be collected")
+
+        config.result_collector_plugin = ResultCollectorPlugin(sandbox_pool, fork_server, code_cache)  # type: ignore[attr-defined]
         config.pluginmanager.register(config.result_collector_plugin)  # type: ignore[attr-defined]
 
 
 class ResultCollectorPlugin:
     collected_results: dict[str, TestResult]
     student_feedback_data: dict[str, FeedbackFixture]
+    performance_data: dict[str, PerformanceFixture]
     grading_data: dict[str, Any]
     module_sandbox_cache: dict[tuple[str, str], StudentFixture]
     module_init_errors: dict[tuple[str, str], str]  # Stores initialization errors by (module_name, file_path)
-
-    def __init__(self) -> None:
+    sandbox_snapshots: dict[tuple[str, str, int, tuple], SandboxSnapshot]  # Keyed by (module_name, file_path, timeout, resource limits)
+    shared_setups: dict[tuple[str, str, int, tuple], str | None]  # Keyed by (module_name, setup file path, timeout, resource limits)
+    lazy_startup_failures: set[str]  # Node IDs of tests whose lazily started sandbox failed to start
+    startup_timings: dict[str, dict[str, float]]  # Sandbox startup phase durations by node ID
+    pool_startup_timings: dict[str, dict[str, float]]  # Startup phases a pool ran in the background, by node ID
+    shared_params: SharedParamStore
+    resource_usage: dict[str, ResourceUsage]  # Resources used by each test's student code by node ID
+    covered_lines: dict[str, list[int]]  # Lines of the student code each test ran by node ID, with --sandbox-coverage
+    sandbox_pool: SandboxPool | None
+    fork_server: ForkServer | None
+    code_cache: CompiledCodeCache | None
+
+    def __init__(
+        self,
+        sandbox_pool: SandboxPool | None = None,
+        fork_server: ForkServer | None = None,
+        code_cache: CompiledCodeCache | None = None,
+    ) -> None:
         self.collected_results = {}
         self.student_feedback_data = {}
+        self.performance_data = {}
         self.grading_data = {}
         self.module_sandbox_cache = {}
         self.module_init_errors = {}
+        self.sandbox_snapshots = {}
+        self.shared_setups = {}
+        self.lazy_startup_failures = set()
+        self.startup_timings = {}
+        self.pool_startup_timings = {}
+        self.resource_usage = {}
+        self.covered_lines = {}
+        self.shared_params = SharedParamStore()
+        self.sandbox_pool = sandbox_pool
+        self.fork_server = fork_server
+        self.code_cache = code_cache
+
+    @property
+    def sandbox_launcher(self) -> RunnerLauncher | None:
+        """
+        Returns the function used to start new sandbox processes, or None to start them directly.
+        """
+        if self.sandbox_pool is not None:
+            return self.sandbox_pool.checkout
+
+        if self.fork_server is not None:
+            return self.fork_server.spawn
+
+        return None
 
     def pytest_configure(self, config: Config) -> None:
         """
@@ -465,6 +839,18 @@ class ResultCollectorPlugin:
             "markers", "grading_data(name, points, include_stdout_feedback=True): Mark a test with custom data that can be injected."
         )
 
+    def pytest_collection_finish(self, session: pytest.Session) -> None:
+        """
+        Start warming up sandbox processes once we know that some test will need one.
+        """
+        if self.sandbox_pool is None:
+            return
+
+        if any(
+            fixture_name in ("sandbox", "module_sandbox") for item in session.items for fixture_name in getattr(item, "fixturenames", ())
+        ):
+            self.sandbox_pool.start()
+
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_makereport(self, item: pytest.Item, call: pytest.CallInfo) -> Iterable[None]:
         """
@@ -477,12 +863,19 @@ class ResultCollectorPlugin:
         if marker:
             self.grading_data[item.nodeid] = marker.kwargs
 
+        # A lazily started sandbox fails during the call, but this is still a setup error,
+        # so grade it exactly like a sandbox that failed to start before the test. The report
+        # itself is left alone for other plugins.
+        when = report.when
+        if when == "call" and item.nodeid in self.lazy_startup_failures:
+            when = "setup"
+
         # Make a report for the setup phase, replace with the call phase if it happens later
-        if report.when == "setup":
-            self.collected_results[report.nodeid] = TestResult(report=report, call=call, stdout="")
+        if when == "setup":
+            self.collected_results[report.nodeid] = TestResult(report=report, call=call, stdout="", when=when)
             # Add a default outcome if not already set
 
-        elif report.when == "call":
+        elif when == "call":
             # Get accumulated stdout from the student fixture if available
             accumulated_stdout = ""
             funcargs = getattr(item, "funcargs", None)
@@ -493,7 +886,14 @@ class ResultCollectorPlugin:
                     if stdout_content.strip():  # Only store if there's actual content
                         accumulated_stdout = stdout_content
 
-            self.collected_results[report.nodeid] = TestResult(report=report, call=call, stdout=accumulated_stdout)
+            self.collected_results[report.nodeid] = TestResult(report=report, call=call, stdout=accumulated_stdout, when=when)
+
+            # A module sandbox keeps running after the test, so take what it used since the previous test
+            if funcargs and isinstance(module_fixture := funcargs.get("module_sandbox"), StudentFixture):
+                if usage := module_fixture.sample_resource_usage():
+                    self.resource_usage[item.nodeid] = usage
+                if module_fixture.collect_coverage:
+                    self.covered_lines[item.nodeid] = module_fixture.sample_covered_lines()
             # You could store more details here if needed
             # item.config.my_test_results[report.nodeid] = {
             #     "outcome": report.outcome,
@@ -526,6 +926,24 @@ class ResultCollectorPlugin:
 
         return self.student_feedback_data[nodeid]
 
+    @pytest.fixture
+    def performance(self, request: pytest.FixtureRequest) -> PerformanceFixture:
+        """
+        A fixture that compares the speed of student functions with reference functions,
+        using the settings of the test's `performance` marker, and scores the test by it.
+        """
+        nodeid = request.node.nodeid
+
+        if nodeid not in self.performance_data:
+            marker = request.node.get_closest_marker("performance")
+            settings = dict(marker.kwargs) if marker else {}
+            if marker and marker.args:
+                settings.setdefault("reference", marker.args[0])
+
+            self.performance_data[nodeid] = PerformanceFixture(test_id=nodeid, **settings)
+
+        return self.performance_data[nodeid]
+
     @pytest.hookimpl(hookwrapper=True)
     def pytest_sessionfinish(self, session: pytest.Session, exitstatus: int) -> Iterable[None]:
         """
@@ -543,6 +961,23 @@ class ResultCollectorPlugin:
         self.module_sandbox_cache.clear()
         logger.debug("Module sandbox cleanup complete")
 
+        for snapshot_key, snapshot in list(self.sandbox_snapshots.items()):
+            try:
+                logger.debug(f"Closing sandbox snapshot for {snapshot_key}")
+                snapshot.close()
+            except Exception as e:
+                logger.warning(f"Error closing sandbox snapshot for {snapshot_key}: {e}")
+        self.sandbox_snapshots.clear()
+
+        if self.sandbox_pool is not None:
+            self.sandbox_pool.close()
+
+        if self.fork_server is not None:
+            self.fork_server.close()
+
+        # Every sandbox is gone, so nothing maps the shared params anymore
+        self.shared_params.close()
+
         yield  # Let other sessionfinish hooks run
 
         # print("\n--- Custom Test Results Summary (via Plugin Class) ---")
@@ -587,9 +1022,9 @@ class ResultCollectorPlugin:
                 logger.debug(f"Grading output level set to: {output_level}")
 
                 # Customize the message based on the failure phase
-                if report.when == "setup":
+                if test_result.when == "setup":
                     phase_message = "Student code execution failed with an exception"
-                elif report.when == "teardown":
+                elif test_result.when == "teardown":
                     phase_message = "Student code teardown failed with an exception"
                 else:
                     phase_message = "Student code grading failed with an exception"
@@ -610,6 +1045,15 @@ class ResultCollectorPlugin:
                 else:
                     feedback_obj.add_message(str(call.excinfo.getrepr(style="no")))
 
+            # A passing test with a performance comparison is scored by its speed
+            performance = self.performance_data.get(nodeid)
+            performance_score = None
+            if performance is not None and outcome == "passed" and (performance_score := performance.score) is not None:
+                feedback_obj.add_message(
+                    f"Your code took {performance.ratio:.2f} times as long as the reference solution "
+                    f"(target: at most {performance.target_ratio:.2f} times)."
+                )
+
             # Check if stdout feedback should be included (default True)
             include_stdout_feedback = grading_data.get("include_stdout_feedback", True)
             if include_stdout_feedback and test_result.stdout:
@@ -619,7 +1063,10 @@ class ResultCollectorPlugin:
             res_obj["name"] = grading_data.get("name", nodeid)
             res_obj["max_points"] = grading_data.get("points", 1)
 
-            if report.when in ["setup", "teardown"] and report.outcome == "failed":
+            if (performance_marker := item.get_closest_marker("performance")) and performance_marker.kwargs.get("points") is not None:
+                res_obj["max_points"] = performance_marker.kwargs["points"]
+
+            if test_result.when in ["setup", "teardown"] and report.outcome == "failed":
                 res_obj["outcome"] = "error"
             else:
                 res_obj["outcome"] = outcome
@@ -633,7 +1080,7 @@ class ResultCollectorPlugin:
 
             if outcome == "passed":
                 if not feedback_obj.final_score_override:
-                    res_obj["points_frac"] = 1.0
+                    res_obj["points_frac"] = 1.0 if performance_score is None else performance_score
                 # Otherwise, we just use the set points value
 
             elif res_obj["points_frac"] is None:
@@ -651,6 +1098,22 @@ class ResultCollectorPlugin:
                     raise ValueError(f"Unexpected outcome '{outcome}' for test '{nodeid}'.")
 
             res_obj["points"] = res_obj["points_frac"] * res_obj["max_points"]
+
+            if nodeid in self.startup_timings:
+                res_obj["timings"] = self.startup_timings[nodeid]
+
+            if nodeid in self.pool_startup_timings:
+                res_obj["pool_timings"] = self.pool_startup_timings[nodeid]
+
+            if nodeid in self.resource_usage:
+                res_obj["resource_usage"] = self.resource_usage[nodeid]
+
+            if nodeid in self.covered_lines:
+                res_obj["covered_lines"] = self.covered_lines[nodeid]
+
+            if performance is not None and performance.comparisons:
+                res_obj["performance"] = performance.to_dict()
+
             final_results.append(res_obj)
         # TODO add gradable property
         # https://prairielearn.readthedocs.io/en/latest/externalGrading/#grading-results
@@ -665,6 +1128,12 @@ class ResultCollectorPlugin:
             "tests": final_results,
         }
 
+        if timings := aggregate_startup_timings([res["timings"] for res in final_results if "timings" in res]):
+            res_dict["timings"] = timings
+
+        if pool_timings := aggregate_startup_timings([res["pool_timings"] for res in final_results if "pool_timings" in res]):
+            res_dict["pool_timings"] = pool_timings
+
         # Add top-level output message if there were any module initialization errors
         if self.module_init_errors:
             error_messages = []
@@ -694,6 +1163,27 @@ class ResultCollectorPlugin:
         # }
 
 
+def aggregate_startup_timings(test_timings: list[dict[str, float]]) -> dict[str, dict[str, float]]:
+    """
+    Summarizes the startup phase durations of all tests, so the phases that dominate a
+    slow grading job stand out. Returns the count, total, mean, and max of each phase.
+    """
+    durations_by_phase: dict[str, list[float]] = {}
+    for timings in test_timings:
+        for phase, duration in timings.items():
+            durations_by_phase.setdefault(phase, []).append(duration)
+
+    return {
+        phase: {
+            "count": len(durations),
+            "total": sum(durations),
+            "mean": sum(durations) / len(durations),
+            "max": max(durations),
+        }
+        for phase, durations in durations_by_phase.items()
+    }
+
+
 def print_autograder_summary(session: pytest.Session, test_results: list[dict[str, Any]]) -> None:
     """
     Print a summary of the autograder results in a formatted table.
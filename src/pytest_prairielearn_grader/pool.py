@@ -0,0 +1,610 @@
+import codecs
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable
+from importlib.resources import files
+from typing import IO
+from typing import Any
+from typing import NamedTuple
+
+from .utils import BoundedOutput
+from .utils import FrameType
+from .utils import ProcessReadyMessage
+from .utils import ResourceUsage
+from .utils import drop_privileges
+from .utils import read_frame
+from .utils import resource_usage_from_rusage
+
+SCRIPT_PATH = str(files("pytest_prairielearn_grader").joinpath("_student_code_runner.py"))
+DEFAULT_POOL_SIZE = 2
+FORK_SERVER_EXIT_TIMEOUT = 5.0
+# How many characters of a runner's own output (e.g. the traceback of a crash) are kept
+PROCESS_OUTPUT_LIMIT = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessOutput:
+    """
+    Reads everything a runner process writes to its stdout and stderr pipe in a background
+    thread, so the runner never blocks on a full pipe. Only the beginning and the end of the
+    output are kept (see `BoundedOutput`), to show why a runner died.
+    """
+
+    _output: BoundedOutput
+    _lock: threading.Lock
+    _thread: threading.Thread
+
+    def __init__(self, pipe: IO[bytes], limit: int = PROCESS_OUTPUT_LIMIT, initial_output: str = "") -> None:
+        self._output = BoundedOutput(limit)
+        self._output.write(initial_output)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._drain, args=(pipe,), name="sandbox-output-drain", daemon=True)
+        self._thread.start()
+
+    def _drain(self, pipe: IO[bytes]) -> None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        # read1 returns whatever is available, starting with anything already buffered by
+        # reading the runner's first line
+        with pipe:
+            while chunk := pipe.read1(64 * 1024):  # type: ignore[attr-defined]
+                with self._lock:
+                    self._output.write(decoder.decode(chunk))
+
+    def getvalue(self, timeout: float | None = None) -> str:
+        """
+        Returns the output read so far. If `timeout` is given, first waits up to that long for
+        the runner to close the pipe, which it does when it exits.
+        """
+        if timeout is not None:
+            self._thread.join(timeout)
+
+        with self._lock:
+            return self._output.getvalue()
+
+
+class RunnerProcess(NamedTuple):
+    """
+    A student code runner process that has finished importing its dependencies
+    and has an open connection to the grader.
+    """
+
+    process: "subprocess.Popen | ForkedProcess"
+    student_socket: socket.socket
+    # How long each startup phase took, in seconds
+    timings: dict[str, float]
+    # The runner's own stdout and stderr, if the grader started it with a pipe for them
+    output: ProcessOutput | None = None
+    # What the runner used to start up, which is not the student code's doing
+    startup_usage: ResourceUsage | None = None
+    # Whether a pool started the runner in the background before it was checked out, so its
+    # startup didn't hold up whoever checked it out
+    started_ahead: bool = False
+
+
+RunnerLauncher = Callable[[], RunnerProcess]
+
+
+def wait_until_ready(student_socket: socket.socket) -> ResourceUsage | None:
+    """
+    Waits for the ready message a runner sends once it has imported its dependencies.
+    Returns the resources the runner used up to then, if it reported them.
+    """
+    try:
+        frame_type, payload = read_frame(student_socket)
+    except ConnectionError as e:
+        raise RuntimeError("Student code runner exited before it was ready.") from e
+
+    ready_message: ProcessReadyMessage = json.loads(payload)
+    if frame_type != FrameType.JSON or ready_message.get("message_type") != "ready":
+        raise RuntimeError(f"Unexpected message from student code runner during startup: {ready_message}")
+
+    return ready_message.get("startup_usage")
+
+
+def spawn_runner_process(worker_username: str | None) -> RunnerProcess:
+    """
+    Starts a new student code runner process and connects to it. Returns once the runner
+    has imported its dependencies and is accepting requests.
+
+    The runner inherits one end of a socket pair, so no port has to be discovered and
+    requests don't go through the TCP stack. On Windows, where sockets can't be inherited
+    this way, the runner listens on a loopback TCP port instead.
+    """
+
+    def try_drop_privileges() -> None:
+        if worker_username is not None:
+            drop_privileges(worker_username)
+
+    # Inheriting sockets (and preexec_fn) is only supported on Unix platforms
+    if sys.platform == "win32":
+        return _spawn_tcp_runner_process()
+
+    student_socket, runner_socket = socket.socketpair()
+    timings: dict[str, float] = {}
+
+    with runner_socket:
+        phase_start = time.perf_counter()
+        process = subprocess.Popen(
+            args=(sys.executable, SCRIPT_PATH, "--socket-fd", str(runner_socket.fileno())),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            preexec_fn=try_drop_privileges,
+            pass_fds=(runner_socket.fileno(),),
+        )
+        timings["process_spawn"] = time.perf_counter() - phase_start
+
+    assert process.stdout is not None
+    output = ProcessOutput(process.stdout)
+
+    # The socket is connected from the start, so there is no port handshake. Waiting for
+    # the ready message covers interpreter startup and the runner's imports.
+    try:
+        phase_start = time.perf_counter()
+        startup_usage = wait_until_ready(student_socket)
+        timings["runner_import"] = time.perf_counter() - phase_start
+    except BaseException:
+        student_socket.close()
+        process.kill()
+        process.wait()
+        raise
+
+    return RunnerProcess(process, student_socket, timings, output, startup_usage)
+
+
+def _spawn_tcp_runner_process() -> RunnerProcess:
+    timings: dict[str, float] = {}
+
+    phase_start = time.perf_counter()
+    process = subprocess.Popen(
+        args=(sys.executable, SCRIPT_PATH),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    timings["process_spawn"] = time.perf_counter() - phase_start
+
+    assert process.stdout is not None, "Process stdout is None. Ensure the process is started correctly."
+
+    # stderr shares the pipe, so anything the runner prints while importing (e.g. a warning)
+    # comes before the "host, port" line and is kept as the runner's output
+    skipped_output: list[str] = []
+
+    try:
+        phase_start = time.perf_counter()
+        while True:
+            line = process.stdout.readline().decode(errors="replace")
+            if not line:
+                raise RuntimeError("The student code runner exited before reporting its port:\n" + "".join(skipped_output))
+
+            host, _, port = line.strip().partition(",")
+            if port.strip().isdigit():
+                break
+
+            skipped_output.append(line)
+        timings["runner_import"] = time.perf_counter() - phase_start
+
+        phase_start = time.perf_counter()
+        student_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        student_socket.connect((host, int(port)))
+        timings["port_handshake"] = time.perf_counter() - phase_start
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+
+    # Everything after the port line is drained like the output of other runners
+    return RunnerProcess(process, student_socket, timings, ProcessOutput(process.stdout, initial_output="".join(skipped_output)))
+
+
+def close_runner_process(runner: RunnerProcess) -> None:
+    runner.student_socket.close()
+    runner.process.terminate()
+    runner.process.wait()
+
+
+def wait_for_resource_usage(process: "subprocess.Popen | ForkedProcess") -> ResourceUsage | None:
+    """
+    Waits for a runner process to exit and returns the resources it used over its lifetime.
+    Returns None if that is not available, e.g. on Windows or if the process was already
+    waited for elsewhere.
+    """
+    if isinstance(process, ForkedProcess):
+        process.wait()
+        return process.resource_usage
+
+    if sys.platform == "win32" or process.returncode is not None:
+        process.wait()
+        return None
+
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # Reaped by someone else in the meantime, so its usage is gone
+        process.wait()
+        return None
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return resource_usage_from_rusage(rusage)
+
+
+class ForkedProcess:
+    """
+    Handle for a runner forked from a fork server. Mirrors the parts of `subprocess.Popen`
+    used by the grader. The runner is a child of the fork server rather than of the grader,
+    so its exit status and resource usage are collected through the fork server.
+    """
+
+    pid: int
+    returncode: int | None
+    resource_usage: ResourceUsage | None
+    fork_server: "ForkServer"
+    _poll_lock: threading.Lock
+
+    def __init__(self, fork_server: "ForkServer", pid: int) -> None:
+        self.fork_server = fork_server
+        self.pid = pid
+        self.returncode = None
+        self.resource_usage = None
+        self._poll_lock = threading.Lock()
+
+    def poll(self) -> int | None:
+        # The fork server reports the exit status only once, so it must not be lost to a
+        # concurrent poll
+        with self._poll_lock:
+            if self.returncode is None:
+                self.returncode, self.resource_usage = self.fork_server.poll_child(self.pid)
+
+            return self.returncode
+
+    def wait(self, timeout: float | None = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while (returncode := self.poll()) is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(str(self.pid), timeout)  # type: ignore[arg-type]
+            time.sleep(0.005)
+
+        return returncode
+
+    def send_signal(self, sig: int) -> None:
+        if self.returncode is not None:
+            return
+
+        try:
+            os.kill(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+
+class ForkServer:
+    """
+    Starts student code runners by forking them from a long-lived fork server process
+    (a "zygote") instead of starting a new interpreter for each one. The fork server
+    imports the runner's dependencies once, so forked runners start almost instantly
+    and share those pages with the fork server copy-on-write.
+
+    Only available on platforms that support `os.fork`.
+
+    If `drop_privileges_at_start` is set, the fork server itself drops privileges to
+    `worker_username` when it starts. This is required when the fork server runs student
+    code (see `initialize`); otherwise each forked runner drops privileges separately.
+    """
+
+    worker_username: str | None
+    drop_privileges_at_start: bool
+    process: subprocess.Popen | None
+    _fd_socket: socket.socket | None
+    _lock: threading.Lock
+    _closed: bool
+
+    def __init__(self, worker_username: str | None, *, drop_privileges_at_start: bool = False) -> None:
+        if sys.platform == "win32":
+            raise NotImplementedError("The fork server is not supported on Windows.")
+
+        self.worker_username = worker_username
+        self.drop_privileges_at_start = drop_privileges_at_start
+        self.process = None
+        self._fd_socket = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start_process(self) -> subprocess.Popen:
+        def try_drop_privileges() -> None:
+            if self.worker_username is not None:
+                drop_privileges(self.worker_username)
+
+        # Each forked runner's end of its socket pair is passed over this socket
+        self._fd_socket, server_fd_socket = socket.socketpair()
+
+        # Unless asked otherwise, the fork server runs with the grader's privileges so that
+        # it can drop them to the worker user in each forked runner.
+        with server_fd_socket:
+            process = subprocess.Popen(
+                args=(sys.executable, SCRIPT_PATH, "--fork-server", "--socket-fd", str(server_fd_socket.fileno())),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                preexec_fn=try_drop_privileges if self.drop_privileges_at_start else None,
+                pass_fds=(server_fd_socket.fileno(),),
+            )
+
+        assert process.stdout is not None
+
+        # Wait until the fork server has finished importing, so that startup time is not
+        # counted against the timeout of the first request.
+        if not process.stdout.readline():
+            raise RuntimeError(f"Fork server terminated with code {process.wait()}.")
+
+        logger.debug(f"Started fork server with pid {process.pid}")
+        return process
+
+    def _request(self, request: dict[str, Any], timeout: float | None = None, fds: list[int] | None = None) -> dict[str, Any]:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Fork server has already been closed.")
+
+            if self.process is None:
+                self.process = self._start_process()
+
+            process = self.process
+            fd_socket = self._fd_socket
+
+            assert process.stdin is not None
+            assert process.stdout is not None
+            assert fd_socket is not None
+
+            try:
+                if fds:
+                    socket.send_fds(fd_socket, [b"\0"], fds)
+
+                process.stdin.write((json.dumps(request) + os.linesep).encode())
+                process.stdin.flush()
+
+                if timeout is not None:
+                    ready, _, _ = select.select([process.stdout], [], [], timeout)
+                    if not ready:
+                        # The response may still arrive later and would be mistaken for the
+                        # response to the next request, so the fork server can't be used again.
+                        process.kill()
+                        process.wait()
+                        self.process = None
+                        fd_socket.close()
+                        self._fd_socket = None
+                        self._closed = True
+                        raise TimeoutError(f"No response from fork server within {timeout} seconds.")
+
+                line = process.stdout.readline()
+            except BrokenPipeError:
+                line = b""
+
+            if not line:
+                raise RuntimeError(f"Fork server terminated with code {process.poll()}.")
+
+        response: dict[str, Any] = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+
+        return response
+
+    def spawn(self) -> RunnerProcess:
+        """
+        Forks a new runner and connects to it.
+        """
+        worker_username = None if self.drop_privileges_at_start else self.worker_username
+        student_socket, runner_socket = socket.socketpair()
+        # The runner's stdout and stderr go to this pipe, like those of a spawned runner
+        output_read_fd, output_write_fd = os.pipe()
+        timings: dict[str, float] = {}
+
+        with runner_socket:
+            try:
+                phase_start = time.perf_counter()
+                response = self._request(
+                    {"command": "fork", "worker_username": worker_username}, fds=[runner_socket.fileno(), output_write_fd]
+                )
+                timings["process_spawn"] = time.perf_counter() - phase_start
+            except BaseException:
+                student_socket.close()
+                os.close(output_read_fd)
+                raise
+            finally:
+                os.close(output_write_fd)
+
+        process = ForkedProcess(self, response["pid"])
+        output = ProcessOutput(os.fdopen(output_read_fd, "rb"))
+
+        # The runner's imports were done by the fork server, so this is mostly dropping
+        # privileges and setting up the event loop.
+        try:
+            phase_start = time.perf_counter()
+            startup_usage = wait_until_ready(student_socket)
+            timings["runner_import"] = time.perf_counter() - phase_start
+        except BaseException:
+            student_socket.close()
+            process.kill()
+            process.wait()
+            raise
+
+        return RunnerProcess(process, student_socket, timings, output, startup_usage)
+
+    def initialize(self, start_request: dict[str, Any], timeout: float) -> dict[str, Any]:
+        """
+        Runs the given start request in the fork server itself and returns the start
+        response. If it succeeds, runners forked afterwards start with the student code
+        already initialized and skip the start request.
+        """
+        return self._request({"command": "initialize", "start_request": start_request}, timeout)["start_response"]
+
+    def poll_child(self, pid: int) -> tuple[int | None, ResourceUsage | None]:
+        """
+        Returns the exit code of a forked runner, or None if it is still running, along
+        with its resource usage once it has exited. Both are only returned once, by the
+        poll that reaps the runner.
+        """
+        if self._closed:
+            # Closing the fork server kills all of its runners
+            return -signal.SIGKILL, None
+
+        response = self._request({"command": "poll", "pid": pid})
+        return response["returncode"], response.get("resource_usage")
+
+    def close(self) -> None:
+        """
+        Shuts down the fork server. Any runners that are still running are killed.
+        """
+        with self._lock:
+            self._closed = True
+
+            if self.process is None:
+                return
+
+            assert self.process.stdin is not None
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+            # Student code run by `initialize` may have left a thread behind that keeps the
+            # fork server from exiting on its own.
+            try:
+                self.process.wait(timeout=FORK_SERVER_EXIT_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+            if self.process.stdout is not None:
+                self.process.stdout.close()
+
+            if self._fd_socket is not None:
+                self._fd_socket.close()
+                self._fd_socket = None
+
+            self.process = None
+
+        logger.debug("Closed fork server")
+
+
+class SandboxPool:
+    """
+    A pool of idle student code runner processes. Starting a runner is dominated by
+    interpreter startup and importing the serialization dependencies, so the pool keeps
+    `size` runners that have already done this and refills itself in the background
+    whenever one is checked out. New runners are started with `launcher`.
+    """
+
+    size: int
+    launcher: RunnerLauncher
+    _idle: list[RunnerProcess]
+    _condition: threading.Condition
+    _closed: bool
+    _refill_thread: threading.Thread | None
+
+    def __init__(self, size: int, launcher: RunnerLauncher) -> None:
+        self.size = size
+        self.launcher = launcher
+
+        self._idle = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._refill_thread = None
+
+    def start(self) -> None:
+        """
+        Starts filling the pool in the background. Calling this more than once has no effect.
+        """
+        with self._condition:
+            if self._refill_thread is not None or self._closed:
+                return
+
+            self._refill_thread = threading.Thread(target=self._refill_loop, name="sandbox-pool-refill", daemon=True)
+            self._refill_thread.start()
+
+        logger.debug(f"Started sandbox pool with size {self.size}")
+
+    def _refill_loop(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and len(self._idle) >= self.size:
+                    self._condition.wait()
+
+                if self._closed:
+                    return
+
+            # Spawn outside of the lock so checkouts are never blocked by a slow start
+            try:
+                runner = self.launcher()
+            except Exception as e:
+                logger.warning(f"Failed to start pooled sandbox process, disabling pool: {e}")
+                with self._condition:
+                    self._closed = True
+                return
+
+            with self._condition:
+                if self._closed:
+                    close_runner_process(runner)
+                    return
+
+                self._idle.append(runner)
+                self._condition.notify_all()
+
+    def checkout(self) -> RunnerProcess:
+        """
+        Returns an idle runner from the pool, or spawns a new one if none is ready.
+        Ownership of the returned runner passes to the caller.
+        """
+        self.start()
+
+        runner = None
+        with self._condition:
+            while self._idle:
+                candidate = self._idle.pop(0)
+
+                if candidate.process.poll() is None:
+                    runner = candidate._replace(started_ahead=True)
+                    break
+
+                logger.debug(f"Discarding pooled sandbox process that exited with code {candidate.process.returncode}")
+                candidate.student_socket.close()
+
+            # Wake the refill thread so it replaces the runner we just took
+            self._condition.notify_all()
+
+        if runner is None:
+            logger.debug("Sandbox pool is empty, starting a new process")
+            runner = self.launcher()
+
+        return runner
+
+    def close(self) -> None:
+        """
+        Stops the refill thread and terminates all idle runners.
+        """
+        with self._condition:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._condition.notify_all()
+
+        if self._refill_thread is not None:
+            self._refill_thread.join()
+
+        for runner in idle:
+            close_runner_process(runner)
+
+        logger.debug(f"Closed sandbox pool, terminated {len(idle)} idle process(es)")
@@ -0,0 +1,122 @@
+import logging
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from .json_utils import from_server_json
+
+# Arrays smaller than this are cheaper to send along with the start request
+SHARED_PARAM_MIN_BYTES = 64 * 1024
+SHARED_ARRAY_TYPE = "shared_ndarray"
+# Memory-backed on Linux. The directory for the files is still created with mkdtemp.
+SHM_DIR = Path("/dev/shm")  # noqa: S108
+
+logger = logging.getLogger(__name__)
+
+
+class SharedParamStore:
+    """
+    Keeps large arrays from the `data.json` params in files that every sandbox maps into
+    memory, instead of sending each sandbox its own copy with the start request. Sandboxes
+    map the files copy-on-write, so all of them share the same pages until one writes to
+    them. The files live in a temporary directory (in `/dev/shm` where there is one, so they
+    stay in memory) that is removed by `close`.
+    """
+
+    directory: Path | None
+    _references: dict[tuple[str, str], dict[str, str] | None]
+
+    def __init__(self) -> None:
+        self.directory = None
+        self._references = {}
+
+    def share_params(self, namespace: str, params: dict[str, Any]) -> dict[str, Any]:
+        """
+        Returns a copy of `params` in which large `ndarray` and `complex_ndarray` values are
+        replaced by references to shared files. `namespace` (e.g. the test module) identifies
+        the params, so each array is only decoded and written once.
+        """
+        shared_params = dict(params)
+
+        for name, value in params.items():
+            key = (namespace, name)
+            if key not in self._references:
+                self._references[key] = self._share_value(name, value)
+
+            if (reference := self._references[key]) is not None:
+                shared_params[name] = reference
+
+        return shared_params
+
+    def _share_value(self, name: str, value: Any) -> dict[str, str] | None:
+        if not isinstance(value, dict) or value.get("_type") not in ("ndarray", "complex_ndarray"):
+            return None
+
+        try:
+            array = from_server_json(value)
+        except (ValueError, TypeError):
+            # Left for the setup code to deal with, as without sharing
+            return None
+
+        if array.dtype.hasobject or array.nbytes < SHARED_PARAM_MIN_BYTES:
+            return None
+
+        if self.directory is None:
+            shm_dir = SHM_DIR if SHM_DIR.is_dir() else None
+            self.directory = Path(tempfile.mkdtemp(prefix="pl-autograder-params-", dir=shm_dir))
+            # Sandboxes may run as a different user
+            if sys.platform != "win32":
+                self.directory.chmod(0o755)
+
+        path = self.directory / f"param-{len(self._references)}.npy"
+        np.save(path, array, allow_pickle=False)
+        logger.debug(f"Shared param {name} ({array.nbytes} bytes) through {path}")
+
+        return {"_type": SHARED_ARRAY_TYPE, "_path": str(path)}
+
+    def close(self) -> None:
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+        self._references.clear()
+
+
+def is_shared_array_reference(value: Any) -> bool:
+    return isinstance(value, dict) and value.get("_type") == SHARED_ARRAY_TYPE
+
+
+def open_shared_array(reference: dict[str, str]) -> np.ndarray:
+    """
+    Maps a shared array copy-on-write. It reads like the original array without copying it,
+    and writing to it only copies the pages that are written to.
+    """
+    return np.load(reference["_path"], mmap_mode="c").view(np.ndarray)
+
+
+def open_shared_params(starting_vars: dict[str, Any]) -> dict[int, dict[str, str]]:
+    """
+    Replaces the shared array references among the starting variables and their
+    `__data_params` with the arrays themselves. Returns the reference of each opened
+    array by its `id`, so other copies can be mapped separately.
+    """
+    opened: dict[str, np.ndarray] = {}
+    references: dict[int, dict[str, str]] = {}
+
+    def open_values(namespace: dict[str, Any]) -> None:
+        for name, value in namespace.items():
+            if is_shared_array_reference(value):
+                if value["_path"] not in opened:
+                    opened[value["_path"]] = open_shared_array(value)
+                    references[id(opened[value["_path"]])] = value
+                namespace[name] = opened[value["_path"]]
+
+    open_values(starting_vars)
+    if isinstance(data_params := starting_vars.get("__data_params"), dict):
+        open_values(data_params)
+
+    return references
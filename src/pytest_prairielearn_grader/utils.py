@@ -1,10 +1,22 @@
+import asyncio
 import base64
 import builtins
+import io
+import json
+import math
 import os
+import signal
+import socket
+import struct
 import sys
+import types
+from collections import deque
+from collections.abc import Mapping
+from enum import IntEnum
 from enum import StrEnum
 from typing import Any
 from typing import Literal
+from typing import NotRequired
 from typing import TypedDict
 
 import dill
@@ -35,6 +47,7 @@ class FunctionStatusCode(StrEnum):
     EXCEPTION = "exception"
     TIMEOUT = "timeout"
     NOT_FOUND = "not_found"
+    SKIPPED = "skipped"
 
 
 class ProcessStatusCode(StrEnum):
@@ -46,6 +59,7 @@ class ProcessStatusCode(StrEnum):
     EXCEPTION = "exception"
     TIMEOUT = "timeout"
     NO_RESPONSE = "no_response"
+    RESOURCE_LIMIT = "resource_limit"
 
 
 # TODO use some inheritance on the query and response types
@@ -57,12 +71,35 @@ class NamesForUserInfo(TypedDict):
     type: str
 
 
+class ResourceLimits(TypedDict, total=False):
+    memory_mb: int
+    cpu_seconds: int
+    processes: int
+    file_size_mb: int
+
+
+class ResourceUsage(TypedDict):
+    user_time: float
+    system_time: float
+    max_rss_kb: int
+    voluntary_context_switches: int
+    involuntary_context_switches: int
+    minor_page_faults: int
+    major_page_faults: int
+
+
+# Requests carry an ID that the runner copies into the response, so responses can be
+# matched to requests when several are in flight.
+
+
 class SetupQueryRequest(TypedDict):
     message_type: Literal["query_setup"]
+    request_id: int
     var: str
 
 
 class SetupQueryResponse(TypedDict):
+    request_id: NotRequired[int]
     status: QueryStatusCode
     value_encoded: str
 
@@ -70,27 +107,116 @@ class SetupQueryResponse(TypedDict):
 # Variable query dict types
 class StudentQueryRequest(TypedDict):
     message_type: Literal["query"]
+    request_id: int
     var: str
     query_timeout: float
 
 
 class StudentQueryResponse(TypedDict):
     # This is meant to be deserialized into a Python object
+    request_id: NotRequired[int]
     status: QueryStatusCode
     value: Any
 
 
 # Function query dict types
+class BenchmarkOptions(TypedDict):
+    rounds: int
+    warmup: int
+    disable_gc: bool
+
+
+class BenchmarkStats(TypedDict):
+    # Durations of the timed calls, in seconds
+    rounds: int
+    min: float
+    max: float
+    mean: float
+    median: float
+    stddev: float
+
+
+class ComparisonOptions(TypedDict):
+    # Name of the reference function, defined by the setup code
+    reference: str
+    # Rounds are run in batches of this size until the speed ratio is stable
+    rounds: int
+    max_rounds: int
+    warmup: int
+    # How much the ratio may change between batches to count as stable, relative to the ratio
+    tolerance: float
+    disable_gc: bool
+    # CPU to pin the timed calls to, if supported by the platform
+    cpu: int | None
+
+
+class PerformanceComparison(TypedDict):
+    function_name: str
+    reference: str
+    student: BenchmarkStats
+    reference_stats: BenchmarkStats
+    # Median duration of the student function divided by that of the reference
+    ratio: float
+
+
+class ScalingOptions(TypedDict):
+    # Name of a setup code function that takes a size and returns the arguments for that size
+    generator: str
+    sizes: list[int]
+    # Each size is timed this many times, and the fastest call counts
+    rounds: int
+    disable_gc: bool
+
+
+class ProfileEntry(TypedDict):
+    # A function from the student code, as profiled by cProfile
+    function: str
+    line: int
+    calls: int
+    # Time spent in the function itself, and including the functions it called, in seconds
+    total_time: float
+    cumulative_time: float
+
+
+class AllocationSite(TypedDict):
+    # A line of the student code, with the memory allocated there that was still in use after the call
+    line: int
+    size: int
+    count: int
+
+
+class MemoryUsage(TypedDict):
+    # Memory allocated during a call, as traced by tracemalloc, in bytes
+    peak: int
+    # Allocated memory that was still in use when the call returned, e.g. the return value
+    net: int
+    sites: list[AllocationSite]
+
+
 class StudentFunctionRequest(TypedDict):
     message_type: Literal["query_function"]
+    request_id: int
     function_name: str
     args_encoded: str  # TODO add a stronger type for the input/output of the serialized function
     kwargs_encoded: str
     query_timeout: float
+    # Whether to send the call's output in chunks while it runs, instead of in the response
+    stream_output: NotRequired[bool]
+    # If given, the function is called repeatedly and timed by the runner
+    benchmark: NotRequired[BenchmarkOptions]
+    # If given, the function is timed in turns with a reference function
+    comparison: NotRequired[ComparisonOptions]
+    # If given, the function is timed on generated inputs of each size instead of on the arguments
+    scaling: NotRequired[ScalingOptions]
+    # If given, the call is profiled and this many of the student's slowest functions are returned
+    profile: NotRequired[int]
+    # If given, the call's memory is traced and this many of the student's top allocation sites are returned
+    memory: NotRequired[int]
 
 
 class StudentFunctionResponse(TypedDict):
     # This is meant to be deserialized into a Python object
+    request_id: NotRequired[int]
     status: FunctionStatusCode
     value: Any
     stdout: str
@@ -98,11 +224,52 @@ class StudentFunctionResponse(TypedDict):
     exception_name: str | None
     exception_message: str | None
     traceback: str | None
+    # For timed out calls, whether the call was stopped without restarting the runner
+    interrupted: NotRequired[bool]
+    # Timings of a benchmarked or compared call that succeeded
+    benchmark: NotRequired[BenchmarkStats]
+    reference_benchmark: NotRequired[BenchmarkStats]
+    # Fastest duration at each size of a scaling call that succeeded, in seconds
+    scaling: NotRequired[list[float]]
+    # Functions from the student code by cumulative time, for a profiled call that finished or was interrupted
+    profile: NotRequired[list[ProfileEntry]]
+    # Memory allocated by a traced call that finished or was interrupted
+    memory: NotRequired[MemoryUsage]
+    # Lines of the student code that ran during the call, if the sandbox collects line coverage
+    covered_lines: NotRequired[list[int]]
+
+
+class StudentFunctionMapRequest(TypedDict):
+    # Each call gets its own request ID, and a separate response is sent for each call
+    message_type: Literal["map_function"]
+    request_ids: list[int]
+    function_name: str
+    args_list_encoded: str
+    per_call_timeout: float
+    total_timeout: float | None
+    stream_output: NotRequired[bool]
+    # Like for a single call, applied to each call separately
+    memory: NotRequired[int]
+
+
+class OutputChunkMessage(TypedDict):
+    # Output of a function call that asked for its output to be streamed, sent before its response
+    message_type: Literal["output"]
+    request_id: int
+    stream: Literal["stdout", "stderr"]
+    data: str
 
 
 # Process start dict types
 
 
+class ProcessReadyMessage(TypedDict):
+    message_type: Literal["ready"]
+    pid: int
+    # What the runner used to start up (the interpreter and its imports), where it can be read
+    startup_usage: NotRequired[ResourceUsage]
+
+
 class ProcessStartRequest(TypedDict):
     message_type: Literal["start"]
     student_code: str
@@ -114,6 +281,22 @@ class ProcessStartRequest(TypedDict):
     starting_vars: dict[str, Any] | None
     builtin_whitelist: list[str] | None
     names_for_user_list: list[NamesForUserInfo] | None
+    resource_limits: NotRequired[ResourceLimits | None]
+    # Marshalled and base64 encoded code objects, compiled from the code above by the grader
+    compiled_setup_code: NotRequired[str | None]
+    compiled_student_code: NotRequired[str | None]
+    # Serialized variables of a setup code run shared by several sandboxes, used instead of running setup_code
+    setup_vars: NotRequired[str | None]
+    # Whether to return the serialized variables of the setup code in the response
+    return_setup_vars: NotRequired[bool]
+    # How many characters of stdout and stderr to keep for each response, None to keep everything
+    output_limit: NotRequired[int | None]
+    # Whether to record which lines of the student code run, where the runner's Python supports it
+    coverage: NotRequired[bool]
+    # How many lines of leading code come before the student's file in student_code, and how
+    # many lines the student's file has, so lines can be reported as lines of that file
+    student_line_offset: NotRequired[int]
+    student_line_count: NotRequired[int | None]
 
 
 class ProcessStartResponse(TypedDict):
@@ -123,6 +306,247 @@ class ProcessStartResponse(TypedDict):
     execution_error: str | None
     execution_message: str | None
     execution_traceback: str
+    timings: NotRequired[dict[str, float]]
+    setup_vars: NotRequired[str | None]
+    # Lines of the student code that ran during initialization, if coverage was asked for and is supported
+    covered_lines: NotRequired[list[int]]
+
+
+# Message framing
+
+# Every message between the grader and a runner is sent as a frame: a fixed-size header
+# with the payload length and the frame type, followed by the payload itself.
+FRAME_HEADER = struct.Struct("!IB")
+
+
+class FrameType(IntEnum):
+    """
+    Types of frames exchanged between the grader and a runner.
+    """
+
+    JSON = 0
+
+
+def encode_frame(payload: bytes, frame_type: FrameType = FrameType.JSON) -> bytes:
+    return FRAME_HEADER.pack(len(payload), frame_type) + payload
+
+
+def encode_json_frame(message: Mapping[str, Any]) -> bytes:
+    return encode_frame(json.dumps(message).encode("utf-8"))
+
+
+class IncompleteFrameError(TimeoutError):
+    """
+    Raised when a read from a connection stopped partway through a frame, so the rest of
+    the stream can't be read as frames any more.
+    """
+
+
+class FrameReader:
+    """
+    Reads frames from a socket, either blocking or from a non-blocking socket in the running
+    event loop. The payload is received directly into a buffer of the right size, so it can
+    be decoded without any further copies.
+
+    If a read stops partway through a frame (e.g. because the socket timed out or an async
+    read was cancelled), the rest of that frame would be read as the next header. The reader
+    is then `broken` and refuses to read anything else.
+    """
+
+    sock: socket.socket
+    broken: bool
+    _in_frame: bool
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.broken = False
+        self._in_frame = False
+
+    def _check_not_broken(self) -> None:
+        if self.broken:
+            raise IncompleteFrameError("A previous read stopped partway through a message, so the connection can't be used any more.")
+
+    def _recv_exactly_into(self, buffer: bytearray) -> None:
+        view = memoryview(buffer)
+
+        try:
+            while view:
+                num_bytes = self.sock.recv_into(view)
+                if num_bytes == 0:
+                    raise ConnectionError("Connection closed by peer before the full message was received.")
+
+                self._in_frame = True
+                view = view[num_bytes:]
+        except TimeoutError as e:
+            if self._in_frame:
+                self.broken = True
+                raise IncompleteFrameError("Socket read timed out partway through a message.") from e
+            raise
+
+    async def _recv_exactly_into_async(self, buffer: bytearray) -> None:
+        loop = asyncio.get_running_loop()
+        view = memoryview(buffer)
+
+        # Cancellation (e.g. by `asyncio.timeout`) has to propagate as is, so it only marks
+        # the reader broken
+        try:
+            while view:
+                num_bytes = await loop.sock_recv_into(self.sock, view)
+                if num_bytes == 0:
+                    raise ConnectionError("Connection closed by peer before the full message was received.")
+
+                self._in_frame = True
+                view = view[num_bytes:]
+        except asyncio.CancelledError:
+            self.broken = self._in_frame
+            raise
+
+    def read(self) -> tuple[FrameType, bytearray]:
+        """
+        Reads a single frame from a blocking socket.
+        """
+        self._check_not_broken()
+
+        header = bytearray(FRAME_HEADER.size)
+        self._recv_exactly_into(header)
+        payload_length, frame_type = FRAME_HEADER.unpack(header)
+
+        payload = bytearray(payload_length)
+        self._recv_exactly_into(payload)
+        self._in_frame = False
+
+        return FrameType(frame_type), payload
+
+    async def read_async(self) -> tuple[FrameType, bytearray]:
+        """
+        Reads a single frame from a non-blocking socket without blocking the running event loop.
+        """
+        self._check_not_broken()
+
+        header = bytearray(FRAME_HEADER.size)
+        await self._recv_exactly_into_async(header)
+        payload_length, frame_type = FRAME_HEADER.unpack(header)
+
+        payload = bytearray(payload_length)
+        await self._recv_exactly_into_async(payload)
+        self._in_frame = False
+
+        return FrameType(frame_type), payload
+
+
+def read_frame(sock: socket.socket) -> tuple[FrameType, bytearray]:
+    """
+    Reads a single frame from a blocking socket that no other frames are read from.
+    """
+    return FrameReader(sock).read()
+
+
+# Output capture
+
+DEFAULT_OUTPUT_LIMIT = 256 * 1024
+OUTPUT_TRUNCATION_MARKER = "\n... [{} characters of output omitted] ...\n"
+
+
+class BoundedOutput(io.TextIOBase):
+    """
+    A text stream that keeps at most `limit` characters of what is written to it: the first
+    half and the most recent half. Whatever falls in between is replaced by a marker saying
+    how much was left out, so printing in a long loop takes constant memory. A limit of None
+    keeps everything.
+    """
+
+    limit: int | None
+    _dropped: int
+    _head: list[str]
+    _head_size: int
+    _tail: deque[str]
+    _tail_size: int
+
+    # Pieces are joined once there are this many, since small writes (e.g. the newline
+    # written by print) take far more memory as separate strings
+    _MAX_PIECES = 1024
+
+    def __init__(self, limit: int | None = DEFAULT_OUTPUT_LIMIT) -> None:
+        super().__init__()
+        self.limit = limit
+        self._dropped = 0
+        self._head = []
+        self._head_size = 0
+        self._tail = deque()
+        self._tail_size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+
+        if self.limit is None:
+            self._head.append(text)
+            self._compact()
+            return len(text)
+
+        head_limit = self.limit // 2
+        tail_limit = self.limit - head_limit
+
+        remaining = text
+        if self._head_size < head_limit:
+            head_part = remaining[: head_limit - self._head_size]
+            self._head.append(head_part)
+            self._head_size += len(head_part)
+            remaining = remaining[len(head_part) :]
+
+        if remaining:
+            self._tail.append(remaining)
+            self._tail_size += len(remaining)
+
+            # The tail may grow to twice its limit before it is cut back, so that trimming it
+            # (which copies it) happens once per `tail_limit` characters instead of on every write
+            if self._tail_size > 2 * tail_limit:
+                tail = self._tail_value(tail_limit)
+                self._dropped += self._tail_size - len(tail)
+                self._tail = deque([tail])
+                self._tail_size = len(tail)
+
+        self._compact()
+        return len(text)
+
+    def _tail_value(self, tail_limit: int) -> str:
+        tail = "".join(self._tail)
+        return tail[max(len(tail) - tail_limit, 0) :]
+
+    def _compact(self) -> None:
+        if len(self._head) > self._MAX_PIECES:
+            self._head = ["".join(self._head)]
+        if len(self._tail) > self._MAX_PIECES:
+            self._tail = deque(["".join(self._tail)])
+
+    @property
+    def omitted(self) -> int:
+        """
+        How many characters were left out of the kept output.
+        """
+        if self.limit is None:
+            return 0
+
+        return self._dropped + max(self._tail_size - (self.limit - self.limit // 2), 0)
+
+    @property
+    def truncated(self) -> bool:
+        return self.omitted > 0
+
+    def getvalue(self) -> str:
+        """
+        Returns the kept output, with a marker where output was left out.
+        """
+        head = "".join(self._head)
+        tail = "".join(self._tail) if self.limit is None else self._tail_value(self.limit - self.limit // 2)
+
+        if self.omitted:
+            return head + OUTPUT_TRUNCATION_MARKER.format(self.omitted) + tail
+
+        return head + tail
 
 
 def serialize_object_unsafe(obj: object) -> str:
@@ -164,6 +588,64 @@ def deserialize_object_unsafe(base64_string: str) -> object:
     return dill.loads(dilled_bytes)
 
 
+class _NamespacePickler(dill.Pickler):
+    """
+    Pickles the functions of a namespace that was populated by `exec`, without a copy of the
+    globals they were defined with. They get the globals given to `_NamespaceUnpickler` instead.
+    """
+
+    def __init__(self, file: io.BytesIO, globals_dict: dict[str, Any]) -> None:
+        super().__init__(file)
+        self._globals_dict = globals_dict
+
+    def persistent_id(self, obj: object) -> str | None:
+        return "globals" if obj is self._globals_dict else None
+
+    def reducer_override(self, obj: object) -> Any:
+        if isinstance(obj, types.FunctionType) and obj.__globals__ is self._globals_dict:
+            # dill would save a copy of the globals, so rebuild the function around them instead
+            attributes = {
+                "__qualname__": obj.__qualname__,
+                "__module__": obj.__module__,
+                "__doc__": obj.__doc__,
+                "__kwdefaults__": obj.__kwdefaults__,
+                "__annotations__": obj.__annotations__,
+                **obj.__dict__,
+            }
+            return types.FunctionType, (obj.__code__, obj.__globals__, obj.__name__, obj.__defaults__, obj.__closure__), (None, attributes)
+
+        return NotImplemented
+
+
+class _NamespaceUnpickler(dill.Unpickler):
+    def __init__(self, file: io.BytesIO, globals_dict: dict[str, Any]) -> None:
+        super().__init__(file)
+        self._globals_dict = globals_dict
+
+    def persistent_load(self, pid: Any) -> dict[str, Any]:
+        return self._globals_dict
+
+
+def serialize_namespace_unsafe(namespace: dict[str, Any], globals_dict: dict[str, Any]) -> str:
+    """
+    Serializes the variables of a namespace populated by `exec` with `globals_dict` as its
+    globals, like `serialize_object_unsafe`. The globals themselves are left out.
+    """
+    buffer = io.BytesIO()
+    _NamespacePickler(buffer, globals_dict).dump(namespace)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def deserialize_namespace_unsafe(base64_string: str, globals_dict: dict[str, Any]) -> dict[str, Any]:
+    """
+    Deserializes a namespace serialized by `serialize_namespace_unsafe`. Functions that used the
+    original globals use `globals_dict` instead, so they see the names defined there, just as the
+    originals saw the names defined in their globals.
+    """
+    buffer = io.BytesIO(base64.b64decode(base64_string.encode("utf-8")))
+    return _NamespaceUnpickler(buffer, globals_dict).load()
+
+
 def get_builtins(builtin_whitelist: list[str] | None) -> dict[str, Any]:
     """
     Returns a dictionary of safe built-in functions and exceptions.
@@ -305,6 +787,151 @@ def drop_privileges(user_name: str) -> None:
     os.seteuid(target_uid)
 
 
+def set_resource_limits(limits: ResourceLimits) -> None:
+    """
+    Lowers the resource limits of the current process (and of any process it starts later).
+    Limits that are not given are left unchanged. Exceeding the CPU time limit kills the
+    process with SIGXCPU. Exceeding the others makes the failing call raise an exception
+    (MemoryError, or OSError for processes and file size).
+
+    The CPU time and memory limits are on top of what the process already uses, since the
+    kernel counts both from the start of the process. Otherwise the runner's own imports
+    (and the libraries they map into memory) would use up a good part of them.
+    """
+    if sys.platform == "win32":
+        raise NotImplementedError("Resource limits are not supported on Windows.")
+
+    # resource module is only available on Unix systems
+    import resource
+
+    def set_limit(resource_id: int, soft: int, hard: int) -> None:
+        # Limits can't be raised above the current hard limit without privileges
+        _, current_hard = resource.getrlimit(resource_id)
+        if current_hard != resource.RLIM_INFINITY:
+            soft = min(soft, current_hard)
+            hard = min(hard, current_hard)
+
+        resource.setrlimit(resource_id, (soft, hard))
+
+    if "memory_mb" in limits:
+        memory = current_address_space() + limits["memory_mb"] * 1024 * 1024
+        set_limit(resource.RLIMIT_AS, memory, memory)
+
+    if "cpu_seconds" in limits:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_seconds = math.ceil(usage.ru_utime + usage.ru_stime + limits["cpu_seconds"])
+        # SIGXCPU is sent at the soft limit, the hard limit is only a backstop (SIGKILL)
+        set_limit(resource.RLIMIT_CPU, cpu_seconds, cpu_seconds + 1)
+
+    if "processes" in limits:
+        set_limit(resource.RLIMIT_NPROC, limits["processes"], limits["processes"])
+
+    if "file_size_mb" in limits:
+        file_size = limits["file_size_mb"] * 1024 * 1024
+        set_limit(resource.RLIMIT_FSIZE, file_size, file_size)
+        # Fail the write with EFBIG instead of killing the process
+        signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+
+
+def current_address_space() -> int:
+    """
+    Returns the size of the current process's address space in bytes, which is what
+    RLIMIT_AS limits, or 0 where it can't be read.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def resource_usage_from_rusage(rusage: Any) -> ResourceUsage:
+    """Converts the result of `os.wait4` or `resource.getrusage` to a `ResourceUsage`."""
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    max_rss_kb = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+
+    return {
+        "user_time": rusage.ru_utime,
+        "system_time": rusage.ru_stime,
+        "max_rss_kb": max_rss_kb,
+        "voluntary_context_switches": rusage.ru_nvcsw,
+        "involuntary_context_switches": rusage.ru_nivcsw,
+        "minor_page_faults": rusage.ru_minflt,
+        "major_page_faults": rusage.ru_majflt,
+    }
+
+
+def read_process_resource_usage(pid: int) -> ResourceUsage | None:
+    """
+    Reads the resource usage so far of a running process from `/proc`. Returns None if the
+    process is gone or `/proc` is not available (e.g. on macOS and Windows).
+    """
+    proc_dir = f"/proc/{pid}"
+
+    try:
+        with open(f"{proc_dir}/stat") as f:
+            # The command name can contain spaces, so split after its closing parenthesis
+            stat_fields = f.read().rpartition(")")[2].split()
+
+        with open(f"{proc_dir}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+
+        # Context switches are only counted per thread, so add up all (live) threads
+        voluntary_context_switches = 0
+        involuntary_context_switches = 0
+        for thread_id in os.listdir(f"{proc_dir}/task"):
+            with open(f"{proc_dir}/task/{thread_id}/status") as f:
+                for line in f:
+                    if line.startswith("voluntary_ctxt_switches:"):
+                        voluntary_context_switches += int(line.split()[1])
+                    elif line.startswith("nonvoluntary_ctxt_switches:"):
+                        involuntary_context_switches += int(line.split()[1])
+    except (OSError, ValueError):
+        return None
+
+    # The first field left is the process state, which is field 3 in proc(5)
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    return {
+        "user_time": int(stat_fields[11]) / clock_ticks,
+        "system_time": int(stat_fields[12]) / clock_ticks,
+        "max_rss_kb": int(status.get("VmHWM", "0 kB").split()[0]),
+        "voluntary_context_switches": voluntary_context_switches,
+        "involuntary_context_switches": involuntary_context_switches,
+        "minor_page_faults": int(stat_fields[7]),
+        "major_page_faults": int(stat_fields[9]),
+    }
+
+
+def add_resource_usage(usage: ResourceUsage, other: ResourceUsage) -> ResourceUsage:
+    """Combines the resource usage of two processes, or of one process at two different times."""
+    return {
+        "user_time": usage["user_time"] + other["user_time"],
+        "system_time": usage["system_time"] + other["system_time"],
+        "max_rss_kb": max(usage["max_rss_kb"], other["max_rss_kb"]),
+        "voluntary_context_switches": usage["voluntary_context_switches"] + other["voluntary_context_switches"],
+        "involuntary_context_switches": usage["involuntary_context_switches"] + other["involuntary_context_switches"],
+        "minor_page_faults": usage["minor_page_faults"] + other["minor_page_faults"],
+        "major_page_faults": usage["major_page_faults"] + other["major_page_faults"],
+    }
+
+
+def resource_usage_since(usage: ResourceUsage, earlier: ResourceUsage) -> ResourceUsage:
+    """
+    Returns the resources used between two samples of the same process. The peak memory
+    can't be split this way, so it is the peak up to the later sample. The samples may be read
+    with different precision (`/proc` counts CPU time in clock ticks), so nothing goes below 0.
+    """
+    return {
+        "user_time": max(usage["user_time"] - earlier["user_time"], 0.0),
+        "system_time": max(usage["system_time"] - earlier["system_time"], 0.0),
+        "max_rss_kb": usage["max_rss_kb"],
+        "voluntary_context_switches": max(usage["voluntary_context_switches"] - earlier["voluntary_context_switches"], 0),
+        "involuntary_context_switches": max(usage["involuntary_context_switches"] - earlier["involuntary_context_switches"], 0),
+        "minor_page_faults": max(usage["minor_page_faults"] - earlier["minor_page_faults"], 0),
+        "major_page_faults": max(usage["major_page_faults"] - earlier["major_page_faults"], 0),
+    }
+
+
 def get_output_level_marker(marker: pytest.Mark | None) -> GradingOutputLevel:
     if marker and marker.kwargs and "level" in marker.kwargs:
         try:
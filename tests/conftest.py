@@ -0,0 +1,42 @@
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from pytest_prairielearn_grader.fixture import StudentFiles
+from pytest_prairielearn_grader.fixture import StudentFixture
+
+
+@pytest.fixture
+def make_student_fixture(tmp_path: Path) -> Callable[..., StudentFixture]:
+    """
+    Returns a function that makes a `StudentFixture` for student code written to `tmp_path`.
+    Leading, trailing and setup code are read from `tmp_path` if the test writes them. Keyword
+    arguments are passed on to `StudentFixture`, replacing its defaults.
+    """
+
+    def make(student_code: str | None = None, **kwargs: Any) -> StudentFixture:
+        student_code_file = tmp_path / "student_code.py"
+        # Without new code, the fixture runs the code written by the previous call
+        if student_code is not None:
+            student_code_file.write_text(student_code)
+
+        options: dict[str, Any] = {
+            "import_whitelist": None,
+            "import_blacklist": None,
+            "starting_vars": None,
+            "builtin_whitelist": None,
+            "names_for_user_list": None,
+            "worker_username": None,
+        }
+        options.update(kwargs)
+
+        return StudentFixture(
+            file_names=StudentFiles(
+                tmp_path / "leading_code.py", tmp_path / "trailing_code.py", student_code_file, tmp_path / "setup_code.py"
+            ),
+            **options,
+        )
+
+    return make
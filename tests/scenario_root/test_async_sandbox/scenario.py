@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+
+from pytest_prairielearn_grader.fixture import AsyncStudentFixture
+from pytest_prairielearn_grader.fixture import FeedbackFixture
+
+
+@pytest.mark.grading_data(name="Async queries", points=2)
+async def test_async_queries(async_sandbox: AsyncStudentFixture, feedback: FeedbackFixture) -> None:
+    values = await async_sandbox.query("values")
+    assert await async_sandbox.query_function("total", values) == 6
+    feedback.set_score(1.0)
+
+
+@pytest.mark.grading_data(name="Concurrent sandboxes", points=2)
+async def test_concurrent_sandboxes(async_sandbox: AsyncStudentFixture, async_module_sandbox: AsyncStudentFixture) -> None:
+    results = await asyncio.gather(
+        async_sandbox.query_function("slow_square", 3),
+        async_module_sandbox.query_function("slow_square", 4),
+    )
+    assert results == [9, 16]
+
+
+@pytest.mark.grading_data(name="Async exception", points=1)
+async def test_async_exception(async_sandbox: AsyncStudentFixture) -> None:
+    await async_sandbox.query_function("broken")
@@ -0,0 +1,20 @@
+import time
+
+values = [1, 2, 3]
+
+
+def total(numbers):
+    print("adding up", len(numbers), "numbers")
+    result = 0
+    for number in numbers:
+        result += number
+    return result
+
+
+def slow_square(x):
+    time.sleep(0.2)
+    return x * x
+
+
+def broken():
+    raise ValueError("this always fails")
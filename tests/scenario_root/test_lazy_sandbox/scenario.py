@@ -0,0 +1,22 @@
+import pytest
+
+from pytest_prairielearn_grader.fixture import StudentFixture
+
+# Only start each sandbox when a test first queries it
+sandbox_lazy_start = True
+
+
+@pytest.mark.grading_data(name="Query", points=2)
+def test_query(sandbox: StudentFixture) -> None:
+    assert sandbox.query_function("double", 4) == 8
+
+
+@pytest.mark.grading_data(name="Unused sandbox", points=1)
+def test_unused_sandbox(sandbox: StudentFixture) -> None:
+    # Nothing was started, since the sandbox was never queried
+    assert sandbox.process is None
+
+
+@pytest.mark.grading_data(name="Fails before querying", points=1)
+def test_fails_before_querying(sandbox: StudentFixture) -> None:
+    pytest.fail("Instructor check failed", pytrace=False)
@@ -0,0 +1,5 @@
+print("Student code initialized")
+
+
+def double(x):
+    return 2 * x
@@ -0,0 +1 @@
+raise ValueError("Broken at import time")
@@ -0,0 +1,18 @@
+import pytest
+
+from pytest_prairielearn_grader.fixture import PerformanceFixture
+from pytest_prairielearn_grader.fixture import StudentFixture
+
+
+@pytest.mark.grading_data(name="Sort speed", points=1)
+@pytest.mark.performance(reference="reference_sort", target_ratio=50, points=3, rounds=3)
+def test_sort_speed(sandbox: StudentFixture, performance: PerformanceFixture) -> None:
+    comparison = performance.compare(sandbox, "sort_values", list(range(2000, 0, -1)))
+    assert comparison["student"]["rounds"] >= 3
+    assert comparison["reference_stats"]["rounds"] == comparison["student"]["rounds"]
+
+
+@pytest.mark.grading_data(name="Missing reference", points=1)
+@pytest.mark.performance(reference="missing_reference", points=2)
+def test_missing_reference(sandbox: StudentFixture, performance: PerformanceFixture) -> None:
+    performance.compare(sandbox, "sort_values", [3, 1, 2])
@@ -0,0 +1,2 @@
+def reference_sort(xs):
+    return sorted(xs)
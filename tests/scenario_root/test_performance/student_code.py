@@ -0,0 +1,2 @@
+def sort_values(xs):
+    return sorted(xs)
@@ -0,0 +1 @@
+# Test module for per-sandbox resource limits
@@ -0,0 +1,26 @@
+# Module-level resource limits (merged with any marker limits)
+sandbox_resource_limits = {"memory_mb": 1024}
+
+import pytest
+
+from pytest_prairielearn_grader.fixture import StudentFixture
+
+
+@pytest.mark.grading_data(name="within_limits", points=2)
+def test_within_limits(sandbox: StudentFixture) -> None:
+    """Test that a small allocation succeeds under the module-level memory limit."""
+    assert sandbox.query_function("allocate", 10) == 10 * 1024 * 1024
+
+
+@pytest.mark.grading_data(name="memory_limit", points=2)
+def test_memory_limit(sandbox: StudentFixture) -> None:
+    """Test that an allocation above the module-level memory limit fails."""
+    assert sandbox.query_function("allocate", 4096) == 4096 * 1024 * 1024
+
+
+@pytest.mark.grading_data(name="cpu_limit", points=2)
+@pytest.mark.sandbox_resource_limits(cpu_seconds=1)
+def test_cpu_limit(sandbox: StudentFixture) -> None:
+    """Test that the marker adds a CPU limit which stops a spinning call."""
+    # The limit counts from when the sandbox starts, so the call must be allowed to run past it
+    sandbox.query_function("spin", query_timeout=5)
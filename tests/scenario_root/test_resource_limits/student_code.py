@@ -0,0 +1,7 @@
+def allocate(megabytes):
+    return len(bytes(megabytes * 1024 * 1024))
+
+
+def spin():
+    while True:
+        pass
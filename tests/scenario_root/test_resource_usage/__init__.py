@@ -0,0 +1 @@
+# Test module for per-test resource usage accounting
@@ -0,0 +1,19 @@
+import pytest
+
+from pytest_prairielearn_grader.fixture import StudentFixture
+
+
+@pytest.mark.grading_data(name="Sandbox", points=1)
+def test_sandbox(sandbox: StudentFixture) -> None:
+    assert sandbox.query_function("total", 1000) == 499500
+
+
+@pytest.mark.grading_data(name="Module sandbox", points=1)
+def test_module_sandbox(module_sandbox: StudentFixture) -> None:
+    assert module_sandbox.query_function("total", 1000) == 499500
+
+
+@pytest.mark.grading_data(name="Shared module sandbox", points=1)
+def test_shared_module_sandbox(module_sandbox: StudentFixture) -> None:
+    # Still running, so this test's usage is sampled from /proc
+    assert module_sandbox.query_function("total", 2000) == 1999000
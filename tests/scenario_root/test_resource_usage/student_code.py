@@ -0,0 +1,5 @@
+def total(n):
+    result = 0
+    for i in range(n):
+        result += i
+    return result
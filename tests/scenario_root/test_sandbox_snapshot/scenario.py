@@ -0,0 +1,21 @@
+import pytest
+
+from pytest_prairielearn_grader.fixture import FeedbackFixture
+from pytest_prairielearn_grader.fixture import StudentFixture
+
+# Initialize the student code once and fork every sandbox from it
+sandbox_snapshot = True
+
+
+@pytest.mark.grading_data(name="First bump", points=1)
+def test_first_bump(sandbox: StudentFixture, feedback: FeedbackFixture) -> None:
+    assert sandbox.query_function("bump") == 1
+    assert sandbox.query_function("bump") == 2
+    feedback.set_score(1.0)
+
+
+@pytest.mark.grading_data(name="Second bump", points=1, include_stdout_feedback=True)
+def test_state_does_not_leak(sandbox: StudentFixture, feedback: FeedbackFixture) -> None:
+    # Each test gets its own copy of the initialized student code
+    assert sandbox.query_function("bump") == 1
+    feedback.set_score(1.0)
@@ -0,0 +1,8 @@
+print("Loading student code")
+
+counter = [0]
+
+
+def bump():
+    counter[0] += 1
+    return counter[0]
@@ -0,0 +1,3 @@
+counter = [0]
+
+raise ValueError("Broken at import time")
@@ -0,0 +1 @@
+# Test module for running the setup code once per module
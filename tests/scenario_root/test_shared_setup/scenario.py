@@ -0,0 +1,25 @@
+# Run the setup code once and share its variables with every sandbox in this module
+sandbox_shared_setup = True
+
+import pytest
+
+from pytest_prairielearn_grader.fixture import StudentFixture
+
+seen_tokens: list[float] = []
+
+
+@pytest.mark.grading_data(name="First sandbox", points=1)
+def test_first_sandbox(sandbox: StudentFixture) -> None:
+    seen_tokens.append(sandbox.query_function("get_token"))
+    assert sandbox.query_setup("token") == seen_tokens[0]
+
+
+@pytest.mark.grading_data(name="Second sandbox", points=1)
+def test_second_sandbox(sandbox: StudentFixture) -> None:
+    # The setup code did not run again for this sandbox
+    assert sandbox.query_function("get_token") == seen_tokens[0]
+
+
+@pytest.mark.grading_data(name="Setup function", points=1)
+def test_setup_function(sandbox: StudentFixture) -> None:
+    assert sandbox.query_function("scaled", 2) == 6
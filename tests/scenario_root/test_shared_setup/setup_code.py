@@ -0,0 +1,9 @@
+import random
+
+# Differs between runs of the setup code, so tests can tell whether it ran again
+token = random.random()
+FACTOR = __data_params["factor"]
+
+
+def scale_by_factor(x):
+    return x * FACTOR
@@ -0,0 +1,6 @@
+def get_token():
+    return token
+
+
+def scaled(x):
+    return scale_by_factor(x)
@@ -0,0 +1,19 @@
+import pytest
+
+from pytest_prairielearn_grader.fixture import StudentFixture
+
+
+@pytest.mark.grading_data(name="Sandbox", points=1)
+def test_sandbox(sandbox: StudentFixture) -> None:
+    assert sandbox.query_function("add_offset", 1) == 4
+
+
+@pytest.mark.grading_data(name="Module sandbox", points=1)
+def test_module_sandbox(module_sandbox: StudentFixture) -> None:
+    assert module_sandbox.query_function("add_offset", 2) == 5
+
+
+@pytest.mark.grading_data(name="Shared module sandbox", points=1)
+def test_shared_module_sandbox(module_sandbox: StudentFixture) -> None:
+    # Reuses the sandbox started by the previous test, so no startup is timed here
+    assert module_sandbox.query_function("add_offset", 3) == 6
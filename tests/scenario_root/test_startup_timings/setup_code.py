@@ -0,0 +1 @@
+scale = 10
@@ -0,0 +1,5 @@
+offset = 3
+
+
+def add_offset(x):
+    return x + offset
@@ -65,6 +65,12 @@ def test_autograder_scenario_with_pytester(pytester: pytest.Pytester, scenario_d
     if sys.platform == "win32" and scenario_dir.name == "test_privilege_drop":
         pytest.skip("Privilege dropping tests only run on Unix systems")
 
+    if sys.platform == "win32" and scenario_dir.name == "test_resource_limits":
+        pytest.skip("Resource limits are only applied on Unix systems")
+
+    if not sys.platform.startswith("linux") and scenario_dir.name == "test_resource_usage":
+        pytest.skip("Resource usage of a running sandbox is only sampled on Linux")
+
     print(f"\n--- Running scenario: {scenario_dir.name} with pytester ---")
 
     # Ensure the common file to copy exists
@@ -122,6 +128,9 @@ def test_autograder_scenario_with_pytester(pytester: pytest.Pytester, scenario_d
         # Check if expected output is a substring of actual output (to allow for flexibility)
         assert expected_output in actual_output, f"Expected output '{expected_output}' not found in actual output '{actual_output}'"
 
+    if "timings" in expected_data_obj:
+        assert set(expected_data_obj["timings"]) <= results_obj.get("timings", {}).keys(), "Missing aggregate startup timings."
+
     outcome_dict: defaultdict[str, int] = defaultdict(int)
 
     # TODO add tests for the tests object
@@ -144,7 +153,20 @@ def test_autograder_scenario_with_pytester(pytester: pytest.Pytester, scenario_d
         assert math.isclose(expected_test["points_frac"], actual_test["points_frac"]), f"Points fraction mismatch for test '{test_id}'."
         assert math.isclose(expected_test["points"], actual_test["points"]), f"Points mismatch for test '{test_id}'."
         assert actual_test["outcome"] == expected_test["outcome"], f"Outcome mismatch for test '{test_id}'."
-        outcome_dict[CONVERSION_DICT[actual_test["outcome"]]] += 1
+
+        # NOTE timings can't be compared exactly, so only the recorded phases are checked
+        expected_timings = expected_test.get("timings")
+        if expected_timings is not None:
+            actual_timings = actual_test.get("timings", {})
+            assert set(expected_timings) <= actual_timings.keys(), f"Missing startup timings for test '{test_id}'."
+            assert expected_timings or not actual_timings, f"Unexpected startup timings for test '{test_id}'."
+
+        if expected_test.get("resource_usage"):
+            assert "resource_usage" in actual_test, f"Missing resource usage for test '{test_id}'."
+
+        # NOTE pytest itself may report a test differently from how it is graded, e.g. a lazily
+        # started sandbox that fails during the call is graded as a setup error
+        outcome_dict[CONVERSION_DICT[expected_test.get("pytest_outcome", actual_test["outcome"])]] += 1
 
     result.assert_outcomes(**outcome_dict)
 
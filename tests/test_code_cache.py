@@ -0,0 +1,104 @@
+import base64
+import marshal
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from pytest_prairielearn_grader.code_cache import CompiledCodeCache
+from pytest_prairielearn_grader.code_cache import load_compiled_code
+from pytest_prairielearn_grader.fixture import StudentFixture
+from pytest_prairielearn_grader.utils import ProcessStatusCode
+
+
+def test_compiled_code_is_shared_and_persisted(tmp_path: Path) -> None:
+    code_cache = CompiledCodeCache(tmp_path)
+    compiled = code_cache.get("x = 1 + 1\n", "student_code.py")
+
+    assert compiled is not None
+    assert code_cache.get("x = 1 + 1\n", "student_code.py") is compiled
+    assert code_cache.get("x = 1 + 1\n", "other_student_code.py") != compiled
+
+    code = load_compiled_code(compiled)
+    assert code.co_filename == "student_code.py"
+    assert "x" in code.co_names
+
+    # A new session finds the entry in the cache directory
+    assert CompiledCodeCache(tmp_path).get("x = 1 + 1\n", "student_code.py") == compiled
+
+
+def test_tampered_entries_are_compiled_again(tmp_path: Path) -> None:
+    compiled = CompiledCodeCache(tmp_path).get("x = 1 + 1\n", "student_code.py")
+    assert compiled is not None
+
+    (entry,) = (path for path in tmp_path.iterdir() if path.name != "signing_key")
+    signature, _, _ = entry.read_text().partition("\n")
+    malicious = base64.b64encode(marshal.dumps(compile("import os\n", "student_code.py", "exec"))).decode("ascii")
+
+    # Neither a forged entry with the old signature nor one without a signature is loaded
+    for tampered in (f"{signature}\n{malicious}", malicious):
+        entry.write_text(tampered)
+        assert CompiledCodeCache(tmp_path).get("x = 1 + 1\n", "student_code.py") == compiled
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Checks POSIX permissions")
+def test_cache_directory_is_private(tmp_path: Path) -> None:
+    tmp_path.chmod(0o777)
+    code_cache = CompiledCodeCache(tmp_path)
+
+    assert code_cache.cache_dir == tmp_path
+    assert tmp_path.stat().st_mode & 0o777 == 0o755
+    assert (tmp_path / "signing_key").stat().st_mode & 0o777 == 0o600
+
+    # A key that other users can read is not trusted
+    (tmp_path / "signing_key").chmod(0o644)
+    assert CompiledCodeCache(tmp_path).cache_dir is None
+
+
+def test_code_that_does_not_compile_is_not_cached(tmp_path: Path) -> None:
+    code_cache = CompiledCodeCache(tmp_path)
+
+    assert code_cache.get("def broken(:\n", "student_code.py") is None
+    assert [path.name for path in tmp_path.iterdir()] == ["signing_key"]
+
+
+def test_sandbox_runs_cached_code(tmp_path: Path, make_student_fixture: Callable[..., StudentFixture]) -> None:
+    (tmp_path / "setup_code.py").write_text("offset = 3\n")
+    code_cache = CompiledCodeCache()
+    fixture = make_student_fixture("def add(x):\n    return x + 1\ndef fail():\n    raise ValueError('nope')\n", code_cache=code_cache)
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert fixture.query_function("add", 1) == 2
+
+        # Tracebacks still point into the student code
+        response = fixture.query_function_raw("fail")
+        assert response["exception_name"] == "ValueError"
+        assert "raise ValueError('nope')" in (response["traceback"] or "")
+    finally:
+        fixture._cleanup()
+
+    # Syntax errors are still reported by the sandbox
+    broken_fixture = make_student_fixture("def broken(:\n", code_cache=code_cache)
+    try:
+        start_response = broken_fixture.start_student_code_server()
+        assert start_response["status"] == ProcessStatusCode.EXCEPTION
+        assert start_response["execution_error"] == "SyntaxError"
+    finally:
+        broken_fixture._cleanup()
+
+
+def test_code_too_nested_to_compile_is_reported_by_sandbox(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    student_code = "x = " + "not " * 200_000 + "1\n"
+    code_cache = CompiledCodeCache()
+
+    assert code_cache.get(student_code, "student_code.py") is None
+
+    fixture = make_student_fixture(student_code, code_cache=code_cache)
+    try:
+        response = fixture.start_student_code_server()
+        assert response["status"] == ProcessStatusCode.EXCEPTION
+        assert response["execution_error"] in {"MemoryError", "RecursionError"}
+    finally:
+        fixture._cleanup()
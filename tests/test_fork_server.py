@@ -0,0 +1,144 @@
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from pytest_prairielearn_grader.fixture import StudentFixture
+from pytest_prairielearn_grader.pool import ForkedProcess
+from pytest_prairielearn_grader.pool import ForkServer
+from pytest_prairielearn_grader.utils import ProcessStatusCode
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="The fork server is not supported on Windows")
+
+
+def test_forked_sandboxes_are_independent(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fork_server = ForkServer(None)
+
+    try:
+        first = make_student_fixture(
+            "counter = [0]\ndef bump():\n    counter[0] += 1\n    return counter[0]\n", sandbox_launcher=fork_server.spawn
+        )
+        second = make_student_fixture(
+            "counter = [0]\ndef bump():\n    counter[0] += 1\n    return counter[0]\n", sandbox_launcher=fork_server.spawn
+        )
+
+        assert first.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert second.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        assert first.process is not None
+        assert second.process is not None
+        assert first.process.pid != second.process.pid
+
+        assert first.query_function("bump") == 1
+        assert first.query_function("bump") == 2
+        assert second.query_function("bump") == 1
+
+        first._cleanup()
+        second._cleanup()
+    finally:
+        fork_server.close()
+
+
+def test_forked_sandbox_exit_code_is_reported(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fork_server = ForkServer(None)
+
+    try:
+        fixture = make_student_fixture("x = 1\n", sandbox_launcher=fork_server.spawn)
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        process = fixture.process
+        assert isinstance(process, ForkedProcess)
+        assert process.poll() is None
+
+        process.kill()
+        assert process.wait(timeout=5) == -9
+        assert process.resource_usage is not None
+
+        # The fork server forgets a reaped runner, as its pid may be reused by a later one
+        assert fork_server.poll_child(process.pid) == (None, None)
+        assert process.poll() == -9
+
+        fixture._cleanup()
+    finally:
+        fork_server.close()
+
+
+def test_forked_sandbox_output_is_drained(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fork_server = ForkServer(None)
+
+    try:
+        fixture = make_student_fixture(
+            "import os\n"
+            "def noisy():\n"
+            "    os.write(2, b'warning: something in C code\\n' * 100_000)\n"
+            "    return 1\n"
+            "def crash():\n"
+            "    os.write(2, b'fatal error in extension module\\n')\n"
+            "    os._exit(3)\n",
+            sandbox_launcher=fork_server.spawn,
+        )
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert fixture.query_function("noisy", query_timeout=5.0) == 1
+
+        with pytest.raises(RuntimeError, match="terminated with code 3") as exc_info:
+            fixture.query_function("crash")
+        assert "fatal error in extension module" in str(exc_info.value)
+
+        fixture._cleanup()
+    finally:
+        fork_server.close()
+
+
+def test_sandboxes_start_from_snapshot(tmp_path: Path, make_student_fixture: Callable[..., StudentFixture]) -> None:
+    (tmp_path / "setup_code.py").write_text("scale = 10\n")
+    student_code = "print('initializing')\ncounter = [0]\ndef bump():\n    counter[0] += 1\n    return counter[0]\n"
+
+    # The snapshot starts a fork server of its own
+    snapshot_fixture = make_student_fixture(student_code)
+    snapshot = snapshot_fixture.create_snapshot()
+
+    try:
+        assert snapshot.start_response["status"] == ProcessStatusCode.SUCCESS
+
+        first = make_student_fixture(student_code, sandbox_launcher=snapshot.fork_server.spawn)
+        second = make_student_fixture(student_code, sandbox_launcher=snapshot.fork_server.spawn)
+
+        assert first.start_from_snapshot(snapshot)["status"] == ProcessStatusCode.SUCCESS
+        assert second.start_from_snapshot(snapshot)["status"] == ProcessStatusCode.SUCCESS
+
+        assert first.query_setup("scale") == 10
+        assert first.query_function("bump") == 1
+        assert first.query_function("bump") == 2
+        assert second.query_function("bump") == 1
+        assert second.get_accumulated_stdout().startswith("initializing")
+
+        first._cleanup()
+        second._cleanup()
+    finally:
+        snapshot.close()
+
+
+def test_failed_snapshot_is_not_forked(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    snapshot_fixture = make_student_fixture("raise ValueError('broken')\n")
+    snapshot = snapshot_fixture.create_snapshot()
+
+    try:
+        fixture = make_student_fixture("", sandbox_launcher=snapshot.fork_server.spawn)
+        response = fixture.start_from_snapshot(snapshot)
+
+        assert response["status"] == ProcessStatusCode.EXCEPTION
+        assert response["execution_error"] == "ValueError"
+        assert fixture.process is None
+    finally:
+        snapshot.close()
+
+
+def test_closing_fork_server_kills_runners(tmp_path: Path) -> None:
+    fork_server = ForkServer(None)
+    runner = fork_server.spawn()
+
+    fork_server.close()
+
+    assert runner.process.poll() is not None
+    runner.student_socket.close()
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import socket
+import sys
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+from pytest_prairielearn_grader import pool
+from pytest_prairielearn_grader.fixture import StudentFixture
+from pytest_prairielearn_grader.pool import _spawn_tcp_runner_process
+from pytest_prairielearn_grader.pool import close_runner_process
+from pytest_prairielearn_grader.pool import spawn_runner_process
+from pytest_prairielearn_grader.utils import FrameReader
+from pytest_prairielearn_grader.utils import IncompleteFrameError
+from pytest_prairielearn_grader.utils import ProcessStatusCode
+from pytest_prairielearn_grader.utils import encode_json_frame
+from pytest_prairielearn_grader.utils import read_frame
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Runners use a TCP socket on Windows")
+def test_runner_uses_inherited_socket() -> None:
+    runner = spawn_runner_process(None)
+
+    assert runner.student_socket.family == socket.AF_UNIX
+    assert runner.process.poll() is None
+
+    # The runner only serves the inherited connection, so it exits once the grader closes it
+    runner.student_socket.close()
+    assert runner.process.wait(timeout=10) == 0
+
+
+def test_tcp_fallback_runner_is_connected() -> None:
+    runner = _spawn_tcp_runner_process()
+
+    try:
+        assert runner.student_socket.getpeername()[0] == "127.0.0.1"
+        assert runner.process.poll() is None
+    finally:
+        close_runner_process(runner)
+
+
+def test_tcp_fallback_skips_output_before_port(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # Stands in for a warning printed while the runner imports its dependencies
+    wrapper = tmp_path / "noisy_runner.py"
+    wrapper.write_text(
+        "import runpy\n"
+        "import sys\n"
+        "print('DeprecationWarning: something, 1 2 3', file=sys.stderr, flush=True)\n"
+        f"runpy.run_path({pool.SCRIPT_PATH!r}, run_name='__main__')\n"
+    )
+    monkeypatch.setattr(pool, "SCRIPT_PATH", str(wrapper))
+
+    runner = _spawn_tcp_runner_process()
+
+    try:
+        assert runner.student_socket.getpeername()[0] == "127.0.0.1"
+        assert runner.process.poll() is None
+    finally:
+        close_runner_process(runner)
+
+    assert runner.output is not None
+    assert "DeprecationWarning: something" in runner.output.getvalue(timeout=10)
+
+
+def test_frames_are_read_back_to_back() -> None:
+    grader_socket, runner_socket = socket.socketpair()
+
+    with grader_socket, runner_socket:
+        # Both frames arrive in a single read; nothing after the first frame may be lost
+        runner_socket.sendall(encode_json_frame({"n": 1}) + encode_json_frame({"n": 2}))
+
+        assert [json.loads(read_frame(grader_socket)[1])["n"] for _ in range(2)] == [1, 2]
+
+
+def test_timeout_inside_frame_breaks_reader() -> None:
+    grader_socket, runner_socket = socket.socketpair()
+
+    with grader_socket, runner_socket:
+        grader_socket.settimeout(0.1)
+        frame_reader = FrameReader(grader_socket)
+
+        # A timeout between frames leaves the stream intact
+        with pytest.raises(TimeoutError):
+            frame_reader.read()
+        assert not frame_reader.broken
+
+        frame = encode_json_frame({"n": 1})
+        runner_socket.sendall(frame[:-1])
+        with pytest.raises(IncompleteFrameError):
+            frame_reader.read()
+        assert frame_reader.broken
+
+        # The rest of the frame would be taken for a header, so nothing more is read
+        runner_socket.sendall(frame[-1:] + encode_json_frame({"n": 2}))
+        with pytest.raises(IncompleteFrameError):
+            frame_reader.read()
+
+
+def test_cancelled_read_inside_frame_breaks_reader() -> None:
+    async def read_partial_frame(frame_reader: FrameReader) -> None:
+        async with asyncio.timeout(0.1):
+            await frame_reader.read_async()
+
+    grader_socket, runner_socket = socket.socketpair()
+
+    with grader_socket, runner_socket:
+        grader_socket.setblocking(False)
+        frame_reader = FrameReader(grader_socket)
+
+        runner_socket.sendall(encode_json_frame({"n": 1})[:3])
+        with pytest.raises(TimeoutError):
+            asyncio.run(read_partial_frame(frame_reader))
+        assert frame_reader.broken
+
+
+def test_sandbox_is_restarted_after_partial_response(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture("x = 1\n")
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        process = fixture.process
+
+        # As if a query had timed out partway through its response
+        assert fixture._frame_reader is not None
+        fixture._frame_reader.broken = True
+
+        assert fixture.query("x") == 1
+        assert fixture.process is not process
+    finally:
+        fixture._cleanup()
+
+
+def test_large_messages_round_trip(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture("def echo(value):\n    return value\n")
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        # Larger than the runner's old 10 MB line limit
+        value = "x" * (16 * 1024 * 1024)
+        assert fixture.query_function("echo", value, query_timeout=30) == value
+    finally:
+        fixture._cleanup()
@@ -0,0 +1,89 @@
+import functools
+import time
+from collections.abc import Callable
+
+from pytest_prairielearn_grader.fixture import StudentFixture
+from pytest_prairielearn_grader.pool import SandboxPool
+from pytest_prairielearn_grader.pool import close_runner_process
+from pytest_prairielearn_grader.pool import spawn_runner_process
+from pytest_prairielearn_grader.utils import ProcessStatusCode
+
+
+def wait_for_idle(pool: SandboxPool, count: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while len(pool._idle) < count:
+        assert time.monotonic() < deadline, f"Pool did not reach {count} idle process(es) in time"
+        time.sleep(0.05)
+
+
+def test_pool_refills_after_checkout() -> None:
+    pool = SandboxPool(2, functools.partial(spawn_runner_process, None))
+    pool.start()
+
+    try:
+        wait_for_idle(pool, 2)
+        runner = pool.checkout()
+
+        assert runner.process.poll() is None
+        wait_for_idle(pool, 2)
+
+        close_runner_process(runner)
+    finally:
+        pool.close()
+
+
+def test_pool_discards_dead_processes() -> None:
+    pool = SandboxPool(1, functools.partial(spawn_runner_process, None))
+    pool.start()
+
+    try:
+        wait_for_idle(pool, 1)
+        dead_runner = pool._idle[0]
+        dead_runner.process.kill()
+        dead_runner.process.wait()
+
+        runner = pool.checkout()
+        assert runner is not dead_runner
+        assert runner.process.poll() is None
+
+        close_runner_process(runner)
+    finally:
+        pool.close()
+
+
+def test_pool_close_terminates_idle_processes() -> None:
+    pool = SandboxPool(2, functools.partial(spawn_runner_process, None))
+    pool.start()
+    wait_for_idle(pool, 2)
+    idle = list(pool._idle)
+
+    pool.close()
+
+    assert all(runner.process.poll() is not None for runner in idle)
+
+
+def test_pooled_startup_is_timed_apart(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    pool = SandboxPool(1, functools.partial(spawn_runner_process, None))
+    pool.start()
+
+    try:
+        wait_for_idle(pool, 1)
+        fixture = make_student_fixture("x = 1\n", sandbox_launcher=pool.checkout)
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        # The pool started the runner in the background, so only taking it counts for the test
+        assert {"process_spawn", "runner_import"} <= fixture.pool_startup_timings.keys()
+        assert "process_spawn" not in fixture.startup_timings
+        assert "sandbox_acquire" in fixture.startup_timings
+
+        fixture._cleanup()
+    finally:
+        pool.close()
+
+    fixture = make_student_fixture()
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert "process_spawn" in fixture.startup_timings
+        assert fixture.pool_startup_timings == {}
+    finally:
+        fixture._cleanup()
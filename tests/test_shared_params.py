@@ -0,0 +1,64 @@
+from collections.abc import Callable
+from collections.abc import Iterator
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from pytest_prairielearn_grader.fixture import StudentFixture
+from pytest_prairielearn_grader.json_utils import to_json
+from pytest_prairielearn_grader.shared_params import SharedParamStore
+from pytest_prairielearn_grader.utils import ProcessStatusCode
+
+
+@pytest.fixture
+def shared_params() -> Iterator[SharedParamStore]:
+    store = SharedParamStore()
+    yield store
+    store.close()
+
+
+def test_only_large_arrays_are_shared(shared_params: SharedParamStore) -> None:
+    params = {
+        "large": to_json(np.arange(100_000, dtype=np.float64)),
+        "small": to_json(np.arange(10)),
+        "numbers": list(range(100_000)),
+        "name": "matrix",
+    }
+
+    sandbox_params = shared_params.share_params("test_module", params)
+
+    assert sandbox_params["large"]["_type"] == "shared_ndarray"
+    assert sandbox_params["small"] == params["small"]
+    assert sandbox_params["numbers"] is params["numbers"]
+    assert sandbox_params["name"] == "matrix"
+
+    # The array is only written once
+    assert shared_params.share_params("test_module", params)["large"] == sandbox_params["large"]
+
+    shared_params.close()
+    assert not Path(sandbox_params["large"]["_path"]).exists()
+
+
+def test_sandbox_maps_shared_arrays(
+    tmp_path: Path, make_student_fixture: Callable[..., StudentFixture], shared_params: SharedParamStore
+) -> None:
+    matrix = np.arange(100_000, dtype=np.float64).reshape(100, 1000)
+    sandbox_params = shared_params.share_params("test_module", {"A": to_json(matrix)})
+
+    (tmp_path / "setup_code.py").write_text("A = __from_server_json(__data_params['A'])\nA_total = float(A.sum())\n")
+    fixture = make_student_fixture(
+        "def total():\n    return float(A.sum())\ndef zero():\n    A[:] = 0\n    return float(A.sum())\n",
+        starting_vars={"__data_params": sandbox_params, "A": sandbox_params["A"]},
+        names_for_user_list=[{"name": "A", "type": "ndarray", "description": ""}],
+    )
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert fixture.query_function("total") == matrix.sum()
+
+        # Writes only change the student code's copy
+        assert fixture.query_function("zero") == 0
+        np.testing.assert_array_equal(fixture.query_setup("A"), matrix)
+    finally:
+        fixture._cleanup()
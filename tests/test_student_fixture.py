@@ -0,0 +1,740 @@
+import asyncio
+import io
+import os
+import sys
+import time
+from collections.abc import Callable
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from pytest_prairielearn_grader.fixture import AsyncStudentFixture
+from pytest_prairielearn_grader.fixture import FeedbackFixture
+from pytest_prairielearn_grader.fixture import PerformanceFixture
+from pytest_prairielearn_grader.fixture import StudentFixture
+from pytest_prairielearn_grader.utils import DEFAULT_OUTPUT_LIMIT
+from pytest_prairielearn_grader.utils import OUTPUT_TRUNCATION_MARKER
+from pytest_prairielearn_grader.utils import BenchmarkStats
+from pytest_prairielearn_grader.utils import BoundedOutput
+from pytest_prairielearn_grader.utils import ProcessStatusCode
+from pytest_prairielearn_grader.utils import ResourceLimits
+from pytest_prairielearn_grader.utils import StudentQueryRequest
+
+
+@pytest.fixture
+def student_fixture(make_student_fixture: Callable[..., StudentFixture]) -> Iterator[StudentFixture]:
+    fixture = make_student_fixture("x = 1\ny = [2, 3]\nz = 'four'\n")
+
+    assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+    yield fixture
+    fixture._cleanup()
+
+
+def test_query_many(student_fixture: StudentFixture) -> None:
+    assert student_fixture.query_many(["z", "x", "y"]) == ["four", 1, [2, 3]]
+
+    with pytest.raises(NameError):
+        student_fixture.query_many(["x", "missing"])
+
+    # Nothing from the failed batch is left behind
+    assert student_fixture.query("y") == [2, 3]
+
+
+def test_late_response_is_discarded(student_fixture: StudentFixture) -> None:
+    # Send a query and give up on it, as happens when the socket times out
+    request_id = student_fixture._new_request_id()
+    student_fixture._send_json_object(StudentQueryRequest(message_type="query", request_id=request_id, var="x", query_timeout=1.0))
+    student_fixture._pending_request_ids.discard(request_id)
+
+    # The abandoned response arrives first, but must not be mistaken for this one
+    assert student_fixture.query("z") == "four"
+
+
+def test_map_function(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture(
+        "import time\n"
+        "def f(x, y=0):\n"
+        "    print(x)\n"
+        "    if x < 0:\n"
+        "        raise ValueError('negative')\n"
+        "    if x > 100:\n"
+        "        time.sleep(0.3)\n"
+        "    return x + y\n"
+    )
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        assert fixture.map_function("f", [(i,) for i in range(50)]) == list(range(50))
+        assert fixture.map_function("f", [(1, 2), (3, 4)]) == [3, 7]
+
+        # Each call keeps its own status and output
+        responses = fixture.map_function_raw("f", [(1,), (-1,), (2,)])
+        assert [response["status"] for response in responses] == ["success", "exception", "success"]
+        assert responses[1]["exception_name"] == "ValueError"
+        assert [response["stdout"] for response in responses] == ["1\n", "-1\n", "2\n"]
+
+        with pytest.raises(RuntimeError, match="negative"):
+            fixture.map_function("f", [(1,), (-1,)])
+
+        # Calls are cut off at the total timeout, and calls that would start after it are skipped
+        responses = fixture.map_function_raw("f", [(101,), (102,), (1,)], total_timeout=0.5)
+        assert [response["status"] for response in responses] == ["success", "timeout", "skipped"]
+        assert responses[1]["exception_name"] == "TimeoutError"
+
+        assert fixture.query_function("f", 5) == 5
+    finally:
+        fixture._cleanup()
+
+
+def test_timed_out_calls(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture(
+        "import time\n"
+        "print('initializing')\n"
+        "counter = [0]\n"
+        "def bump():\n"
+        "    counter[0] += 1\n"
+        "    return counter[0]\n"
+        "def spin():\n"
+        "    try:\n"
+        "        while True:\n"
+        "            pass\n"
+        "    except Exception:\n"
+        "        return 'caught'\n"
+        "def block():\n"
+        "    time.sleep(10)\n"
+        "def raise_timeout():\n"
+        "    raise TimeoutError('from student code')\n"
+    )
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        first_process = fixture.process
+        assert fixture.query_function("bump") == 1
+
+        # A TimeoutError raised by the student code is an ordinary exception
+        assert fixture.query_function_raw("raise_timeout")["status"] == "exception"
+
+        # A busy loop is interrupted in place, so the student code's state is kept
+        with pytest.raises(TimeoutError):
+            fixture.query_function("spin", query_timeout=0.2)
+
+        responses = fixture.map_function_raw("spin", [(), ()], per_call_timeout=0.2)
+        assert [response["status"] for response in responses] == ["timeout", "timeout"]
+        assert all(response.get("interrupted") for response in responses)
+
+        assert fixture.process is first_process
+        assert fixture.query_function("bump") == 2
+
+        # A call blocked outside of Python code can't be interrupted, so the sandbox is killed
+        # and the student code is initialized again
+        with pytest.raises(TimeoutError):
+            fixture.query_function("block", query_timeout=0.2)
+
+        assert first_process is not None
+        assert first_process.poll() is not None
+        assert fixture.process is not first_process
+
+        # A call queued behind the blocked one would time out, while the new sandbox answers at once
+        assert fixture.query_function("bump") == 1
+        assert fixture.get_accumulated_stdout() == "initializing\n"
+
+        # Calls after a stuck call in the same batch are skipped, since they would be queued behind it
+        responses = fixture.map_function_raw("block", [(), ()], per_call_timeout=0.2)
+        assert [response["status"] for response in responses] == ["timeout", "skipped"]
+        assert fixture.query_function("bump") == 1
+    finally:
+        fixture._cleanup()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Resource limits are not supported on Windows")
+@pytest.mark.parametrize(
+    ("student_code", "resource_limits", "execution_error"),
+    [
+        ("data = bytes(4096 * 1024 * 1024)\n", {"memory_mb": 1024}, "MemoryError"),
+        ("while True:\n    pass\n", {"cpu_seconds": 1}, "RuntimeError"),
+        (
+            "import os\nfd = os.open(output_path, os.O_WRONLY | os.O_CREAT)\nfor _ in range(3):\n    os.write(fd, bytes(1024 * 1024))\n",
+            {"file_size_mb": 1},
+            "OSError",
+        ),
+    ],
+    ids=["memory", "cpu", "file_size"],
+)
+def test_resource_limit_breach_is_reported(
+    tmp_path: Path,
+    make_student_fixture: Callable[..., StudentFixture],
+    student_code: str,
+    resource_limits: ResourceLimits,
+    execution_error: str,
+) -> None:
+    fixture = make_student_fixture(f"output_path = {str(tmp_path / 'output.bin')!r}\n" + student_code, resource_limits=resource_limits)
+
+    try:
+        response = fixture.start_student_code_server(initialization_timeout=5.0)
+
+        assert response["status"] == ProcessStatusCode.RESOURCE_LIMIT
+        assert response["execution_error"] == execution_error
+    finally:
+        fixture._cleanup()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Resource limits are not supported on Windows")
+def test_resource_limits_apply_to_function_calls(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    student_code = "def allocate(mb):\n    return len(bytes(mb * 1024 * 1024))\ndef spin():\n    while True:\n        pass\n"
+    fixture = make_student_fixture(student_code, resource_limits={"memory_mb": 1024, "cpu_seconds": 2})
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert fixture.query_function("allocate", 10) == 10 * 1024 * 1024
+
+        with pytest.raises(RuntimeError, match="MemoryError"):
+            fixture.query_function("allocate", 4096)
+
+        with pytest.raises(RuntimeError, match="CPU time limit"):
+            fixture.query_function("spin", query_timeout=5.0)
+    finally:
+        fixture._cleanup()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Resource limits are not supported on Windows")
+def test_resource_limits_exclude_runner_startup(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    # The runner's own imports take more CPU time and address space than these limits allow
+    student_code = (
+        "import time\n"
+        "def spin(seconds):\n"
+        "    end = time.process_time() + seconds\n"
+        "    while time.process_time() < end:\n"
+        "        pass\n"
+        "def allocate(mb):\n"
+        "    return len(bytes(mb * 1024 * 1024))\n"
+    )
+    fixture = make_student_fixture(student_code, resource_limits={"memory_mb": 64, "cpu_seconds": 1})
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert fixture.query_function("allocate", 32) == 32 * 1024 * 1024
+        assert fixture.query_function("spin", 0.5, query_timeout=5.0) is None
+    finally:
+        fixture._cleanup()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Sampling a running sandbox reads /proc")
+def test_resource_usage_is_accounted(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    student_code = (
+        "import time\ndef spin(seconds):\n    end = time.process_time() + seconds\n    while time.process_time() < end:\n        pass\n"
+    )
+    fixture = make_student_fixture(student_code, resource_limits={})
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        fixture.query_function("spin", 0.3)
+        first_sample = fixture.sample_resource_usage()
+        assert first_sample is not None
+        # The runner's startup is left out, and /proc counts CPU time in whole clock ticks
+        assert first_sample["user_time"] + first_sample["system_time"] >= 0.25
+
+        # Later samples only count what was used since the previous one
+        fixture.query_function("spin", 0.2)
+        second_sample = fixture.sample_resource_usage()
+        assert second_sample is not None
+        assert 0.15 <= second_sample["user_time"] + second_sample["system_time"] < first_sample["user_time"] + first_sample["system_time"]
+    finally:
+        fixture._cleanup()
+
+    assert fixture.resource_usage is not None
+    assert fixture.resource_usage["user_time"] + fixture.resource_usage["system_time"] >= 0.45
+    assert fixture.resource_usage["max_rss_kb"] > 0
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Resource usage is not collected on Windows")
+def test_runner_startup_is_not_accounted(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture("x = 1\n")
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert fixture.query("x") == 1
+    finally:
+        fixture._cleanup()
+
+    # Starting the interpreter and importing the runner's dependencies takes far more CPU
+    # time than running this student code, and is not the student code's doing
+    assert fixture._startup_usage is not None
+    assert fixture.resource_usage is not None
+    startup_time = fixture._startup_usage["user_time"] + fixture._startup_usage["system_time"]
+    assert fixture.resource_usage["user_time"] + fixture.resource_usage["system_time"] < startup_time / 2
+
+
+def test_shared_setup_vars(tmp_path: Path, make_student_fixture: Callable[..., StudentFixture]) -> None:
+    setup_code_file = tmp_path / "setup_code.py"
+    setup_code_file.write_text("import random\ntoken = random.random()\n")
+
+    def make_fixture() -> StudentFixture:
+        return make_student_fixture(
+            "def get_token():\n    return token\n", names_for_user_list=[{"name": "token", "type": "float", "description": ""}]
+        )
+
+    shared_setup_vars = make_fixture().create_shared_setup()
+    assert shared_setup_vars is not None
+
+    tokens = []
+    for _ in range(2):
+        fixture = make_fixture()
+        fixture.shared_setup_vars = shared_setup_vars
+        try:
+            assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+            tokens.append(fixture.query_function("get_token"))
+            assert fixture.query_setup("token") == tokens[-1]
+        finally:
+            fixture._cleanup()
+
+    assert tokens[0] == tokens[1]
+
+    # Setup code that fails is left to each sandbox, which reports the error as usual
+    setup_code_file.write_text("raise ValueError('bad setup')\n")
+    assert make_fixture().create_shared_setup() is None
+
+
+def test_async_calls_to_different_sandboxes_overlap(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    # Each call reports when it started and when it finished
+    fixtures = [
+        make_student_fixture(
+            "import time\ndef slow(x):\n    start = time.time()\n    time.sleep(0.5)\n    return [x, start, time.time()]\n"
+        )
+        for _ in range(3)
+    ]
+
+    async def query_all() -> list[list[float]]:
+        clients = [AsyncStudentFixture(fixture) for fixture in fixtures]
+        return await asyncio.gather(*(client.query_function("slow", i) for i, client in enumerate(clients)))
+
+    try:
+        for fixture in fixtures:
+            assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        results = asyncio.run(query_all())
+        assert [result[0] for result in results] == [0, 1, 2]
+        # Every call started before any of them finished
+        assert max(result[1] for result in results) < min(result[2] for result in results)
+
+        # The synchronous client still works on the same connection afterwards
+        assert fixtures[0].query_function("slow", 7)[0] == 7
+    finally:
+        for fixture in fixtures:
+            fixture._cleanup()
+
+
+CHATTY_CODE = (
+    "import sys\n"
+    "print('initializing')\n"
+    "def chatty(n):\n"
+    "    for i in range(n):\n"
+    "        print(i)\n"
+    "    print('done', file=sys.stderr)\n"
+    "    return n\n"
+)
+
+
+def test_output_is_bounded(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture(CHATTY_CODE, output_limit=1000)
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        # Short output is kept as it is
+        assert fixture.query_function_raw("chatty", 3)["stdout"] == "0\n1\n2\n"
+
+        # The beginning and the end of long output are kept
+        response = fixture.query_function_raw("chatty", 100_000)
+        assert response["stdout"].startswith("0\n1\n2\n")
+        assert response["stdout"].endswith("99998\n99999\n")
+        assert "characters of output omitted" in response["stdout"]
+        assert len(response["stdout"]) < 1100
+        assert response["stderr"] == "done\n"
+
+        accumulated_stdout = fixture.get_accumulated_stdout()
+        assert accumulated_stdout.startswith("initializing\n0\n1\n2\n")
+        assert accumulated_stdout.endswith("99999\n")
+        assert len(accumulated_stdout) < 1100
+    finally:
+        fixture._cleanup()
+
+
+def test_bounded_output_throughput() -> None:
+    lines = [f"{i}\n" for i in range(200_000)]
+
+    start = time.perf_counter()
+    unbounded = io.StringIO()
+    for line in lines:
+        unbounded.write(line)
+    unbounded_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    bounded = BoundedOutput(DEFAULT_OUTPUT_LIMIT)
+    for line in lines:
+        bounded.write(line)
+    bounded_time = time.perf_counter() - start
+
+    full_output = unbounded.getvalue()
+    head_limit = DEFAULT_OUTPUT_LIMIT // 2
+    tail_limit = DEFAULT_OUTPUT_LIMIT - head_limit
+    assert bounded.omitted == len(full_output) - DEFAULT_OUTPUT_LIMIT
+    assert bounded.getvalue() == (
+        full_output[:head_limit] + OUTPUT_TRUNCATION_MARKER.format(bounded.omitted) + full_output[len(full_output) - tail_limit :]
+    )
+
+    # Writing must not copy the kept tail each time; that made this hundreds of times slower than StringIO
+    assert bounded_time < 20 * unbounded_time + 0.5
+
+
+def test_output_is_streamed(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture(CHATTY_CODE, output_limit=1000)
+    chunks: list[tuple[str, str]] = []
+    fixture.output_callback = lambda stream, data: chunks.append((stream, data))
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        response = fixture.query_function_raw("chatty", 100_000)
+        assert response["status"] == "success"
+
+        # All of the output arrives in chunks, and the response keeps it up to the limit
+        assert len(chunks) > 1
+        assert "".join(data for stream, data in chunks if stream == "stdout") == "".join(f"{i}\n" for i in range(100_000))
+        assert ("stderr", "done\n") in chunks
+        assert response["stdout"].startswith("0\n1\n2\n")
+        assert response["stdout"].endswith("99999\n")
+        assert len(response["stdout"]) < 1100
+        assert response["stderr"] == "done\n"
+
+        chunks.clear()
+        responses = fixture.map_function_raw("chatty", [(2,), (3,)])
+        assert [response["stdout"] for response in responses] == ["0\n1\n", "0\n1\n2\n"]
+        assert [data for stream, data in chunks if stream == "stdout"] == ["0\n1\n", "0\n1\n2\n"]
+    finally:
+        fixture._cleanup()
+
+
+def test_runner_output_is_drained(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture(
+        "import os\n"
+        "def noisy():\n"
+        "    # Far more than fits into a pipe, written past the redirected sys.stderr\n"
+        "    os.write(2, b'warning: something in C code\\n' * 100_000)\n"
+        "    return 1\n"
+        "def crash():\n"
+        "    os.write(2, b'fatal error in extension module\\n')\n"
+        "    os._exit(3)\n"
+    )
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert fixture.query_function("noisy", query_timeout=5.0) == 1
+
+        # A crash is reported with what the sandbox wrote before it died
+        with pytest.raises(RuntimeError, match="terminated with code 3") as exc_info:
+            fixture.query_function("crash")
+        assert "fatal error in extension module" in str(exc_info.value)
+    finally:
+        fixture._cleanup()
+
+    # The same goes for a sandbox that dies while the student code is initialized
+    fixture = make_student_fixture("import os\nos.write(2, b'fatal error in extension module\\n')\nos._exit(3)\n")
+    try:
+        response = fixture.start_student_code_server()
+        assert response["status"] == ProcessStatusCode.NO_RESPONSE
+        assert "fatal error in extension module" in response["stderr"]
+    finally:
+        fixture._cleanup()
+
+
+def test_benchmark_function(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture(
+        "import time\n"
+        "def slow(seconds):\n"
+        "    time.sleep(seconds)\n"
+        "def append_one(xs):\n"
+        "    xs.append(1)\n"
+        "    return len(xs)\n"
+        "def fail():\n"
+        "    raise ValueError('nope')\n"
+    )
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        stats = fixture.benchmark_function("slow", 0.01, rounds=3, warmup=0, disable_gc=True)
+        assert stats["rounds"] == 3
+        assert 0.01 <= stats["min"] <= stats["median"] <= stats["max"] < 0.5
+        assert stats["stddev"] >= 0
+
+        # Every call gets a fresh copy of the arguments
+        response = fixture.benchmark_function_raw("append_one", [], rounds=10)
+        assert response["status"] == "success"
+        assert response["value"] == 1
+        assert response["benchmark"]["rounds"] == 10
+
+        with pytest.raises(RuntimeError, match="nope"):
+            fixture.benchmark_function("fail")
+
+        # The timeout applies to all of the rounds together
+        with pytest.raises(TimeoutError):
+            fixture.benchmark_function("slow", 0.1, rounds=10, query_timeout=0.5)
+
+        with pytest.raises(ValueError, match="at least one round"):
+            fixture.benchmark_function("slow", 0, rounds=0)
+    finally:
+        fixture._cleanup()
+
+
+def test_performance_comparison(tmp_path: Path, make_student_fixture: Callable[..., StudentFixture]) -> None:
+    (tmp_path / "setup_code.py").write_text("def reference_sort(xs):\n    return sorted(xs)\n")
+    fixture = make_student_fixture(
+        "def bubble_sort(xs):\n"
+        "    for i in range(len(xs)):\n"
+        "        for j in range(len(xs) - i - 1):\n"
+        "            if xs[j] > xs[j + 1]:\n"
+        "                xs[j], xs[j + 1] = xs[j + 1], xs[j]\n"
+        "    return xs\n"
+    )
+    cpu = min(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None
+    performance = PerformanceFixture("test", reference="reference_sort", target_ratio=2.0, rounds=3, max_rounds=9, cpu=cpu)
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        comparison = performance.compare(fixture, "bubble_sort", list(range(300, 0, -1)))
+        assert 3 <= comparison["student"]["rounds"] <= 9
+        assert comparison["student"]["median"] > comparison["reference_stats"]["median"]
+        assert comparison["ratio"] == comparison["student"]["median"] / comparison["reference_stats"]["median"]
+
+        # The slower the student function, the less credit. Bubble sort is far slower than
+        # `sorted` on this input, so the ratio is well past the target.
+        assert performance.score is not None
+        assert 0 < performance.score < 1
+        assert performance.score == pytest.approx(2.0 / comparison["ratio"])
+
+        # The slowest comparison counts
+        performance.compare(fixture, "bubble_sort", [2, 1])
+        assert performance.ratio == comparison["ratio"]
+    finally:
+        fixture._cleanup()
+
+
+def test_timing_ignores_replaced_clock(tmp_path: Path, make_student_fixture: Callable[..., StudentFixture]) -> None:
+    (tmp_path / "setup_code.py").write_text("def reference_sum(n):\n    return (n - 1) * n // 2\n")
+    fixture = make_student_fixture(
+        "import gc\n"
+        "import itertools\n"
+        "import statistics\n"
+        "import time\n"
+        "ticks = itertools.count()\n"
+        "def fast_sum(n):\n"
+        "    # Make every call look like it took a negative amount of time\n"
+        "    time.perf_counter = lambda: -1e9 * next(ticks)\n"
+        "    statistics.median = lambda data: 1e-12\n"
+        "    gc.disable = lambda: None\n"
+        "    total = 0\n"
+        "    for i in range(n):\n"
+        "        total += i\n"
+        "    return total\n"
+    )
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        comparison = fixture.compare_function("fast_sum", 10_000, reference="reference_sum", rounds=3, max_rounds=6)
+        assert comparison["student"]["min"] > 0
+        assert comparison["reference_stats"]["min"] > 0
+        assert comparison["ratio"] > 0
+
+        assert fixture.benchmark_function("fast_sum", 10_000, rounds=3, disable_gc=True)["min"] > 0
+    finally:
+        fixture._cleanup()
+
+
+def test_performance_score_is_clamped() -> None:
+    stats: BenchmarkStats = {"rounds": 1, "min": 1.0, "max": 1.0, "mean": 1.0, "median": 1.0, "stddev": 0.0}
+    performance = PerformanceFixture("test", reference="reference", target_ratio=2.0)
+    assert performance.score is None
+
+    performance.comparisons.append(
+        {"function_name": "f", "reference": "reference", "student": stats, "reference_stats": stats, "ratio": 0.5}
+    )
+    assert performance.score == 1.0
+
+    for ratio in (0.0, -1e9):
+        performance.comparisons = [
+            {"function_name": "f", "reference": "reference", "student": stats, "reference_stats": stats, "ratio": ratio}
+        ]
+        assert performance.score == 0.0
+
+
+def test_measure_scaling(tmp_path: Path, make_student_fixture: Callable[..., StudentFixture]) -> None:
+    (tmp_path / "setup_code.py").write_text("def make_list(n):\n    return list(range(n, 0, -1))\n")
+    fixture = make_student_fixture(
+        "def total(xs):\n"
+        "    result = 0\n"
+        "    for x in xs:\n"
+        "        result += x\n"
+        "    return result\n"
+        "def count_inversions(xs):\n"
+        "    inversions = 0\n"
+        "    for i in range(len(xs)):\n"
+        "        for j in range(i + 1, len(xs)):\n"
+        "            if xs[i] > xs[j]:\n"
+        "                inversions += 1\n"
+        "    return inversions\n"
+    )
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        linear = fixture.measure_scaling("total", "make_list", [25_000, 50_000, 100_000, 200_000, 400_000])
+        assert linear.sizes == [25_000, 50_000, 100_000, 200_000, 400_000]
+        assert len(linear.times) == 5
+        assert linear.is_at_most("n log n")
+        assert 0 <= linear.confidence <= 1
+
+        quadratic = fixture.measure_scaling("count_inversions", "make_list", [100, 200, 400, 800])
+        assert not quadratic.is_at_most("n log n")
+        assert quadratic.exponent > 1.5
+
+        with pytest.raises(RuntimeError, match="Input generator 'missing'"):
+            fixture.measure_scaling("total", "missing", [1, 2, 3])
+
+        with pytest.raises(ValueError, match="at least three positive sizes"):
+            fixture.measure_scaling("total", "make_list", [10, 20])
+    finally:
+        fixture._cleanup()
+
+
+def test_profile_function(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture(
+        "import time\n"
+        "def slow_part(n):\n"
+        "    time.sleep(n)\n"
+        "def fast_part():\n"
+        "    return 1\n"
+        "def solve(n):\n"
+        "    for _ in range(3):\n"
+        "        slow_part(n)\n"
+        "    return fast_part()\n"
+        "def spin():\n"
+        "    while True:\n"
+        "        slow_part(0.01)\n"
+    )
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        assert fixture.query_function("solve", 0.02, profile=True) == 1
+        assert fixture.last_profile is not None
+        # Only the student's functions, slowest first
+        assert [entry["function"] for entry in fixture.last_profile] == ["solve", "slow_part", "fast_part"]
+        solve, slow_part, _ = fixture.last_profile
+        assert slow_part["calls"] == 3
+        assert slow_part["line"] == 2
+        assert solve["cumulative_time"] >= slow_part["cumulative_time"] >= 0.06
+
+        # Calls without profiling don't return a profile
+        assert "profile" not in fixture.query_function_raw("solve", 0)
+
+        # A call that timed out still shows where its time went
+        with pytest.raises(TimeoutError):
+            fixture.query_function("spin", profile=True, query_timeout=0.3)
+        assert [entry["function"] for entry in fixture.last_profile] == ["spin", "slow_part"]
+
+        feedback = FeedbackFixture("test")
+        feedback.add_profile(fixture.last_profile)
+        assert feedback.messages[0].splitlines()[1].startswith("  spin (line 10): ")
+
+        feedback.add_profile(None)
+        assert len(feedback.messages) == 1
+    finally:
+        fixture._cleanup()
+
+
+def test_trace_memory(make_student_fixture: Callable[..., StudentFixture]) -> None:
+    fixture = make_student_fixture(
+        "def squares(n):\n    return [i * i for i in range(n)]\ndef total_squares(n):\n    values = squares(n)\n    return len(values)\n"
+    )
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        assert len(fixture.query_function("squares", 100_000, trace_memory=True)) == 100_000
+        usage = fixture.last_memory_usage
+        assert usage is not None
+        # The returned list and its ints are still allocated after the call
+        assert usage["peak"] >= usage["net"] > 100_000 * 8
+        assert usage["sites"][0]["line"] == 2
+
+        # The temporary list is freed before the call returns, but still counts for the peak
+        assert fixture.query_function("total_squares", 100_000, trace_memory=True) == 100_000
+        usage = fixture.last_memory_usage
+        assert usage is not None
+        assert usage["peak"] > 100_000 * 8 > usage["net"]
+
+        # Calls without tracing don't return their memory usage
+        assert "memory" not in fixture.query_function_raw("squares", 10)
+
+        assert fixture.query_function("total_squares", 1000, max_memory=1024**2) == 1000
+        with pytest.raises(AssertionError, match=r"used up to .* MB of memory, more than the limit of 1\.00 MB"):
+            fixture.query_function("squares", 100_000, max_memory=1024**2)
+
+        responses = fixture.map_function_raw("total_squares", [(10,), (100_000,), (100,)], trace_memory=True)
+        assert all("memory" in response for response in responses)
+        assert fixture.last_memory_usage == responses[1]["memory"]
+
+        with pytest.raises(AssertionError, match="Function 'total_squares' used up to"):
+            fixture.map_function("total_squares", [(10,), (100_000,)], max_memory=1024**2)
+    finally:
+        fixture._cleanup()
+
+
+def test_lines_are_reported_in_student_file(tmp_path: Path, make_student_fixture: Callable[..., StudentFixture]) -> None:
+    (tmp_path / "leading_code.py").write_text("def helper(n):\n    return [0] * n\n")
+    (tmp_path / "trailing_code.py").write_text("def unused():\n    pass\n")
+    fixture = make_student_fixture("def build(n):\n    values = helper(n)\n    return [value + 1 for value in values]\n")
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+
+        # The leading code's function is left out, and lines are counted from the start of the student's file
+        assert len(fixture.query_function("build", 100_000, profile=True)) == 100_000
+        assert fixture.last_profile is not None
+        assert "helper" not in [entry["function"] for entry in fixture.last_profile]
+        assert fixture.last_profile[0]["function"] == "build"
+        assert fixture.last_profile[0]["line"] == 1
+
+        assert len(fixture.query_function("build", 100_000, trace_memory=True)) == 100_000
+        assert fixture.last_memory_usage is not None
+        assert fixture.last_memory_usage["sites"][0]["line"] == 3
+    finally:
+        fixture._cleanup()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 12), reason="Line coverage uses sys.monitoring")
+def test_line_coverage(tmp_path: Path, make_student_fixture: Callable[..., StudentFixture]) -> None:
+    # Lines of the leading and trailing code are not reported
+    (tmp_path / "leading_code.py").write_text("LEADING = 1\n")
+    (tmp_path / "trailing_code.py").write_text("TRAILING = 1\n")
+    fixture = make_student_fixture("def sign(x):\n    if x < 0:\n        return -1\n    return 1\nLIMIT = 10\n", collect_coverage=True)
+
+    try:
+        assert fixture.start_student_code_server()["status"] == ProcessStatusCode.SUCCESS
+        assert fixture.sample_covered_lines() == [1, 5]
+
+        # Each call reports the lines it ran, even if an earlier call ran them too
+        assert fixture.query_function_raw("sign", 5)["covered_lines"] == [2, 4]
+        assert fixture.query_function_raw("sign", 7)["covered_lines"] == [2, 4]
+        assert fixture.sample_covered_lines() == [2, 4]
+
+        assert fixture.query_function("sign", -5) == -1
+        assert fixture.sample_covered_lines() == [2, 3]
+        assert fixture.covered_lines == {1, 2, 3, 4, 5}
+    finally:
+        fixture._cleanup()